@@ -26,7 +26,7 @@ import sys
 import time
 
 from optparse import OptionParser
-from sockaudio import socket_audio
+from sockaudio import socket_audio, socket_mixer, parse_streams, JITTER_MAX_DELAY, PCM_BACKENDS
 
 def signal_handler(signal, frame):
    sys.stderr.write("audio.py shutting down\n")
@@ -34,18 +34,28 @@ def signal_handler(signal, frame):
    sys.exit(0)
 
 parser = OptionParser()
-parser.add_option("-O", "--audio-output", type="string", default="default", help="audio output device name")
+parser.add_option("-O", "--audio-output", type="string", default="default", help="audio output device name (file name for the wav backend)")
+parser.add_option("-b", "--backend", type="string", default=None, help="audio backend: %s or module:class (default alsa, stdout with -s)" % ', '.join(sorted(PCM_BACKENDS)))
 parser.add_option("-u", "--wireshark-port", type="int", default=23456, help="Wireshark port")
 parser.add_option("-2", "--two-channel", action="store_true", default=False, help="single or two channel audio")
 parser.add_option("-x", "--audio-gain", type="float", default="1.0", help="audio gain (default = 1.0)")
 parser.add_option("-s", "--stdout", action="store_true", default=False, help="write to stdout instead of audio device")
+parser.add_option("-j", "--jitter-buffer", type="float", default=0.0, help="play through a jitter buffer of at most this many ms (0 = off, e.g. 300 for remote rx.py)")
+parser.add_option("-m", "--mix", type="string", default=None, help="mix several ports: port[:gain[:pan[:priority]]],... (pan -1 left .. 1 right, higher priority ducks the others)")
+parser.add_option("--stats-interval", type="float", default=0.0, help="log jitter buffer statistics every this many seconds")
  
 (options, args) = parser.parse_args()
 if len(args) != 0:
    parser.print_help()
    sys.exit(1)
 
-audio_handler = socket_audio("0.0.0.0", options.wireshark_port, options.audio_output, options.two_channel, options.audio_gain, options.stdout)
+if options.mix:
+   streams = parse_streams(options.mix, (options.jitter_buffer / 1000.0) or JITTER_MAX_DELAY)
+   audio_handler = socket_mixer("0.0.0.0", streams, options.audio_output, options.audio_gain, options.stdout,
+      stats_interval = options.stats_interval, backend = options.backend)
+else:
+   audio_handler = socket_audio("0.0.0.0", options.wireshark_port, options.audio_output, options.two_channel, options.audio_gain, options.stdout,
+      jitter_delay = options.jitter_buffer / 1000.0, stats_interval = options.stats_interval, backend = options.backend)
 
 if __name__ == "__main__":
    signal.signal(signal.SIGINT, signal_handler)
@@ -0,0 +1,226 @@
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Per-call recording of the logfile worker audio
+
+Instead of a wavfile_sink per decoder slot, p25_decoder_sink_b(dest='call')
+hands the decoded 8 kHz 16-bit PCM to a message_sink which never blocks the
+flowgraph.  The call_recorder thread collects the PCM of each call in
+memory and, when rx_ctl ends the call, passes it to a bounded
+multiprocessing pool which encodes it and writes the audio file and a JSON
+sidecar (tgid, srcaddr, nac, frequency, slot, start/end) in one go.
+
+Formats:
+    flac    FLAC through the soundfile module (libsndfile), if installed
+    adpcm   IMA ADPCM WAV, 4 bits per sample, python only
+    wav     16-bit PCM WAV, as written by wavfile_sink
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import struct
+import signal
+import audioop
+import threading
+import collections
+import Queue
+import multiprocessing
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+SAMPLE_RATE = 8000
+ADPCM_BLOCK_ALIGN = 256
+ADPCM_SAMPLES_PER_BLOCK = (ADPCM_BLOCK_ALIGN - 4) * 2 + 1
+
+FORMATS = ('flac', 'adpcm', 'wav')
+EXTENSIONS = {'flac': '.flac', 'adpcm': '.wav', 'wav': '.wav'}
+
+# audioop puts the first sample of a byte in the high nibble, WAV in the low one
+NIBBLE_SWAP = ''.join([chr(((i & 0xf) << 4) | (i >> 4)) for i in range(256)])
+
+
+def default_format():
+    if soundfile is not None:
+        return 'flac'
+    return 'adpcm'
+
+
+def adpcm_wav(pcm):
+    # mono 16-bit little endian PCM -> IMA ADPCM (WAVE_FORMAT_DVI_ADPCM) file contents.
+    # Each block starts with a header holding its first sample and the step
+    # index the rest of the block is coded from; the short final block is
+    # padded with silence, the fact chunk holds the real sample count.
+    nsamples = len(pcm) // 2
+    chunks = []
+    index = 0
+    for start in range(0, nsamples, ADPCM_SAMPLES_PER_BLOCK):
+        block = pcm[start * 2:(start + ADPCM_SAMPLES_PER_BLOCK) * 2]
+        block += '\0' * (ADPCM_SAMPLES_PER_BLOCK * 2 - len(block))
+        first = struct.unpack('<h', block[:2])[0]
+        chunks.append(struct.pack('<hBB', first, index, 0))
+        data, (valprev, index) = audioop.lin2adpcm(block[2:], 2, (first, index))
+        chunks.append(data.translate(NIBBLE_SWAP))
+    data = ''.join(chunks)
+    fmt = struct.pack('<HHIIHHHH', 0x11, 1, SAMPLE_RATE,
+                      SAMPLE_RATE * ADPCM_BLOCK_ALIGN // ADPCM_SAMPLES_PER_BLOCK,
+                      ADPCM_BLOCK_ALIGN, 4, 2, ADPCM_SAMPLES_PER_BLOCK)
+    return ''.join(['RIFF', struct.pack('<I', 4 + (8 + len(fmt)) + 12 + (8 + len(data))), 'WAVE',
+                    'fmt ', struct.pack('<I', len(fmt)), fmt,
+                    'fact', struct.pack('<II', 4, nsamples),
+                    'data', struct.pack('<I', len(data)), data])
+
+
+def encode_call(filename, fmt, pcm, info):
+    # runs in a pool process: write the audio file and its sidecar
+    if fmt == 'flac':
+        import numpy as np
+        soundfile.write(filename, np.frombuffer(pcm, dtype='<i2'), SAMPLE_RATE, format='FLAC', subtype='PCM_16')
+    elif fmt == 'adpcm':
+        with open(filename, 'wb') as fp:
+            fp.write(adpcm_wav(pcm))
+    else:
+        w = wave.open(filename, 'wb')
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm)
+        w.close()
+    info = dict(info)
+    info['file'] = os.path.basename(filename)
+    info['format'] = fmt
+    with open(os.path.splitext(filename)[0] + '.json', 'w') as fp:
+        fp.write(json.dumps(info, sort_keys=True))
+    return filename
+
+
+def ignore_sigint():
+    # ^C is handled by rx.py, which then stops the recorder
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class call_recorder(threading.Thread):
+    def __init__(self, directory='.', fmt=None, processes=2, max_pending=8, poll_interval=0.05):
+        threading.Thread.__init__(self)
+        self.setDaemon(1)
+        if fmt is None:
+            fmt = default_format()
+        if fmt not in FORMATS:
+            raise ValueError('unknown recording format %s' % fmt)
+        if fmt == 'flac' and soundfile is None:
+            raise ValueError('flac recording requires the soundfile module')
+        self.directory = directory
+        self.fmt = fmt
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.sources = []      # pcm msgq of each decoder slot
+        self.calls = {}        # source -> call being recorded: {'info', 'filename', 'pcm'}
+        self.commands = Queue.Queue()
+        self.pending = collections.deque()
+        self.stats = {'calls': 0, 'seconds': 0.0}
+        self.pool = multiprocessing.Pool(processes, ignore_sigint)
+        self.keep_running = True
+        self.start()
+
+    def add_source(self, msgq):
+        # register the message_sink queue of a decoder slot; returns its source id
+        self.sources.append(msgq)
+        return len(self.sources) - 1
+
+    def start_call(self, source, filename, info):
+        # called by rx_ctl (through p25_decoder_sink_b.set_output); ends any
+        # call still recorded on the source
+        self.commands.put(('start', source, filename, dict(info)))
+
+    def end_call(self, source, end_time):
+        self.commands.put(('end', source, end_time))
+
+    def drain(self, source):
+        msgq = self.sources[source]
+        call = self.calls.get(source)
+        while True:
+            msg = msgq.delete_head_nowait()
+            if msg is None:
+                return
+            if call is not None:
+                call['pcm'].append(msg.to_string())
+
+    def finish(self, source, end_time):
+        call = self.calls.pop(source, None)
+        if call is None:
+            return
+        pcm = ''.join(call['pcm'])
+        info = call['info']
+        info['end'] = end_time
+        info['duration'] = len(pcm) / 2.0 / SAMPLE_RATE
+        while len(self.pending) >= self.max_pending:
+            self.reap(self.pending.popleft())
+        self.pending.append(self.pool.apply_async(encode_call, (call['filename'], self.fmt, pcm, info)))
+        self.stats['calls'] += 1
+        self.stats['seconds'] += info['duration']
+
+    def reap(self, result):
+        try:
+            result.get()
+        except Exception as e:
+            sys.stderr.write('%f call_recorder: encoding failed: %s\n' % (time.time(), e))
+
+    def run_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except Queue.Empty:
+                return
+            if command[0] == 'start':
+                cmd, source, filename, info = command
+                self.finish(source, info['start'])
+                filename = os.path.join(self.directory, os.path.splitext(os.path.basename(filename))[0] + EXTENSIONS[self.fmt])
+                self.calls[source] = {'info': info, 'filename': filename, 'pcm': []}
+            else:
+                cmd, source, end_time = command
+                self.finish(source, end_time)
+
+    def run(self):
+        while self.keep_running:
+            # audio first, so that it goes to the call it was decoded for
+            for source in range(len(self.sources)):
+                self.drain(source)
+            self.run_commands()
+            while self.pending and self.pending[0].ready():
+                self.reap(self.pending.popleft())
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.keep_running = False
+        self.join()
+        for source in range(len(self.sources)):
+            self.drain(source)
+        self.run_commands()
+        for source in self.calls.keys():
+            self.finish(source, time.time())
+        while self.pending:
+            self.reap(self.pending.popleft())
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Call detail record store
+
+rx_ctl reports the start and end of every call it sees granted (the
+call_event callback, see trunking.py) and cdr_store appends them to an
+SQLite database in WAL mode.  Events are queued and written by a thread
+in one transaction per flush interval, so the decoder never waits on the
+disk.  Queries run against the same file, also while rx.py is writing:
+
+    ./cdr.py -d calls.db --top 10 --since 3600    most active talkgroups
+    ./cdr.py -d calls.db --tgid 1234               recent calls of a talkgroup
+    ./cdr.py -d calls.db --srcaddr 5678            recent calls of a radio
+"""
+
+import sys
+import time
+import sqlite3
+import threading
+import Queue
+from optparse import OptionParser
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS calls (time REAL NOT NULL, event TEXT NOT NULL, nac INTEGER, '
+    'tgid INTEGER, srcaddr INTEGER, frequency INTEGER, slot INTEGER, duration REAL, encrypted INTEGER)',
+    'CREATE INDEX IF NOT EXISTS calls_time ON calls (time)',
+    'CREATE INDEX IF NOT EXISTS calls_tgid ON calls (tgid, time)',
+    'CREATE INDEX IF NOT EXISTS calls_srcaddr ON calls (srcaddr, time)',
+]
+
+FIELDS = ('time', 'event', 'nac', 'tgid', 'srcaddr', 'frequency', 'slot', 'duration', 'encrypted')
+INSERT = 'INSERT INTO calls (%s) VALUES (%s)' % (', '.join(FIELDS), ', '.join(['?'] * len(FIELDS)))
+
+
+def connect(filename):
+    db = sqlite3.connect(filename, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.commit()
+    return db
+
+
+class cdr_store(threading.Thread):
+    def __init__(self, filename, flush_interval=1.0):
+        threading.Thread.__init__(self)
+        self.setDaemon(1)
+        self.db = connect(filename)
+        self.flush_interval = flush_interval
+        self.events = Queue.Queue()
+        self.count = 0
+        self.keep_running = True
+        self.start()
+
+    def record(self, event):
+        # rx_ctl call_event callback: a dict with (some of) FIELDS
+        self.events.put(tuple([event.get(k) for k in FIELDS]))
+
+    def flush(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self.events.get_nowait())
+            except Queue.Empty:
+                break
+        if not rows:
+            return
+        with self.db:
+            self.db.executemany(INSERT, rows)
+        self.count += len(rows)
+
+    def run(self):
+        while self.keep_running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                sys.stderr.write('%f cdr_store: %s\n' % (time.time(), e))
+
+    def stop(self):
+        self.keep_running = False
+        self.join()
+        self.flush()
+        self.db.close()
+
+
+def most_active_talkgroups(db, since, limit=10):
+    # (tgid, calls, seconds) of the talkgroups with the most calls since the given time
+    return db.execute('SELECT tgid, COUNT(*), SUM(duration) FROM calls WHERE time >= ? AND event = ? '
+                      'GROUP BY tgid ORDER BY COUNT(*) DESC, SUM(duration) DESC LIMIT ?',
+                      (since, 'end', limit)).fetchall()
+
+
+def recent_calls(db, column, value, limit=20):
+    # ended calls of one tgid or srcaddr, most recent first
+    assert column in ('tgid', 'srcaddr')
+    return db.execute('SELECT %s FROM calls WHERE %s = ? AND event = ? ORDER BY time DESC LIMIT ?' % (
+                      ', '.join(FIELDS), column), (value, 'end', limit)).fetchall()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-d", "--database", type="string", default=None, help="call detail record file (rx.py --cdr-file)")
+    parser.add_option("--top", type="int", default=10, help="number of talkgroups to list")
+    parser.add_option("--since", type="float", default=3600.0, help="seconds of history for --top")
+    parser.add_option("--tgid", type="int", default=None, help="list recent calls of this talkgroup")
+    parser.add_option("--srcaddr", type="int", default=None, help="list recent calls from this radio")
+    (options, args) = parser.parse_args()
+    if not options.database:
+        parser.print_help()
+        sys.exit(1)
+
+    db = connect(options.database)
+    t0 = time.time()
+    if options.tgid is not None or options.srcaddr is not None:
+        column, value = ('tgid', options.tgid) if options.tgid is not None else ('srcaddr', options.srcaddr)
+        for row in recent_calls(db, column, value):
+            d = dict(zip(FIELDS, row))
+            sys.stdout.write('%s  tgid %s  srcaddr %s  nac 0x%x  freq %.6f  slot %s  %.1fs%s\n' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(d['time'])), d['tgid'], d['srcaddr'], d['nac'],
+                d['frequency'] / 1e6, d['slot'], d['duration'] or 0.0, '  encrypted' if d['encrypted'] else ''))
+    else:
+        for tgid, calls, seconds in most_active_talkgroups(db, time.time() - options.since, options.top):
+            sys.stdout.write('%8s  %6d calls  %8.1f s\n' % (tgid, calls, seconds or 0.0))
+    sys.stderr.write('query took %.1f ms\n' % ((time.time() - t0) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Table-driven P25 CRCs
+
+All P25 CRCs are MSB-first with a zero initial register and an inverted
+result (TIA-102.BAAA), so one byte-wise table per generator covers them:
+    CRC_CCITT   16 bit  TSBK, PDU header and MBT header
+    CRC_32      32 bit  PDU packet
+    CRC_9        9 bit  confirmed data block (7 bit serial + 128 data bits)
+
+Data is passed as an integer (MSB first) with its length in bits.  Since
+the register starts at zero, leading zero bits do not change the result
+and the data is simply processed as whole bytes.  The *_batch forms take
+a numpy uint8 array with one block per row and return one CRC per row.
+"""
+
+import numpy as np
+
+
+class table_crc(object):
+    def __init__(self, width, poly, xorout):
+        self.width = width
+        self.poly = poly
+        self.xorout = xorout
+        self.mask = (1 << width) - 1
+        self.table = [self.remainder(i) for i in range(256)]
+        self.np_table = np.array(self.table, dtype=np.int64)
+
+    def remainder(self, byte):
+        # (byte * x^width) mod g, one bit at a time
+        crc = byte << self.width
+        for i in range(7, -1, -1):
+            if crc & (1 << (self.width + i)):
+                crc ^= (self.poly | (1 << self.width)) << i
+        return crc & self.mask
+
+    def compute(self, data, nbits):
+        table = self.table
+        mask = self.mask
+        crc = 0
+        if self.width >= 8:
+            top = self.width - 8
+            for shift in range(((nbits + 7) & ~7) - 8, -8, -8):
+                crc = ((crc << 8) & mask) ^ table[((crc >> top) ^ (data >> shift)) & 0xff]
+        else:
+            for shift in range(((nbits + 7) & ~7) - 8, -8, -8):
+                crc = table[((crc << (8 - self.width)) ^ (data >> shift)) & 0xff]
+        return crc ^ self.xorout
+
+    def batch(self, blocks):
+        blocks = np.atleast_2d(np.asarray(blocks, dtype=np.uint8))
+        table = self.np_table
+        crc = np.zeros(blocks.shape[0], dtype=np.int64)
+        if self.width >= 8:
+            for j in range(blocks.shape[1]):
+                crc = ((crc << 8) & self.mask) ^ table[((crc >> (self.width - 8)) ^ blocks[:, j]) & 0xff]
+        else:
+            for j in range(blocks.shape[1]):
+                crc = table[((crc << (8 - self.width)) ^ blocks[:, j]) & 0xff]
+        return crc ^ self.xorout
+
+
+CRC_CCITT = table_crc(16, 0x1021, 0xffff)
+CRC_32 = table_crc(32, 0x04c11db7, 0xffffffff)
+CRC_9 = table_crc(9, 0x059, 0x1ff)
+
+
+def crc_ccitt(data, nbits=80):
+    return CRC_CCITT.compute(data, nbits)
+
+
+def crc_32(data, nbits):
+    return CRC_32.compute(data, nbits)
+
+
+def crc_9(data, nbits=135):
+    return CRC_9.compute(data, nbits)
+
+
+def crc16(dat, len):
+    # check a block of len bytes ending in its CRC_CCITT; zero if correct.
+    # The remainder of the whole block is the crc of the leading bytes
+    # xored with the trailing two.
+    if len < 2:
+        return (dat & ((1 << (len * 8)) - 1)) ^ 0xffff
+    return crc_ccitt(dat >> 16, (len - 2) * 8) ^ (dat & 0xffff)
+
+
+def crc_ccitt_batch(blocks):
+    return CRC_CCITT.batch(blocks)
+
+
+def crc_32_batch(blocks):
+    return CRC_32.batch(blocks)
+
+
+def crc_9_batch(blocks):
+    return CRC_9.batch(blocks)
+
+
+def crc16_batch(blocks):
+    # crc16() over every row of an (N, len) uint8 array, e.g. 12-byte TSBKs
+    blocks = np.atleast_2d(np.asarray(blocks, dtype=np.uint8))
+    rx_crc = (blocks[:, -2].astype(np.int64) << 8) | blocks[:, -1]
+    return CRC_CCITT.batch(blocks[:, :-2]) ^ rx_crc
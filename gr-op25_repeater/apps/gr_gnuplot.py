@@ -22,7 +22,10 @@
 import sys
 import os
 import time
+import struct
+import threading
 import subprocess
+import collections
 
 from gnuradio import gr, gru, eng_notation
 from gnuradio import blocks, audio
@@ -41,6 +44,27 @@ MIX_AVG  = 0.15
 BAL_AVG  = 0.05
 FFT_BINS = 512
 
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+def read_png(fp):
+	# the next PNG image written to fp, None at the end
+	signature = fp.read(len(PNG_SIGNATURE))
+	if signature != PNG_SIGNATURE:
+		return None
+	chunks = [signature]
+	while True:
+		head = fp.read(8)
+		if len(head) < 8:
+			return None
+		length, chunk_type = struct.unpack('>I4s', head)
+		body = fp.read(length + 4)	# data and crc
+		if len(body) < length + 4:
+			return None
+		chunks.append(head)
+		chunks.append(body)
+		if chunk_type == 'IEND':
+			return ''.join(chunks)
+
 class wrap_gp(object):
 	def __init__(self, sps=_def_sps, plot_name=""):
 		self.sps = sps
@@ -58,6 +82,9 @@ class wrap_gp(object):
 		self.plot_interval = None
 		self.sequence = 0
 		self.output_dir = None
+		self.output_store = None
+		self.pending = collections.deque()	# names of the plots gnuplot is writing to stdout
+		self.stored = collections.deque()
 		self.filename = None
                 if plot_name == "":
                         self.plot_name = ""
@@ -69,7 +96,29 @@ class wrap_gp(object):
 	def attach_gp(self):
 		args = (GNUPLOT, '-noraise')
 		exe  = GNUPLOT
-		self.gp = subprocess.Popen(args, executable=exe, stdin=subprocess.PIPE)
+		stdout = None
+		if self.output_store:
+			stdout = subprocess.PIPE
+		self.gp = subprocess.Popen(args, executable=exe, stdin=subprocess.PIPE, stdout=stdout)
+		if self.output_store:
+			reader = threading.Thread(target=self.read_plots, args=(self.gp,))
+			reader.setDaemon(1)
+			reader.start()
+
+	def read_plots(self, gp):
+		# hand the plots from gnuplot's stdout to output_store, keeping the last two
+		while True:
+			png = read_png(gp.stdout)
+			if png is None:
+				break
+			if not self.pending:
+				continue
+			filename = self.pending.popleft()
+			self.output_store.put(filename, png)
+			self.filename = filename
+			self.stored.append(filename)
+			while len(self.stored) > 2:
+				self.output_store.remove(self.stored.popleft())
 
         def set_sps(self, sps):
             self.sps = sps
@@ -95,6 +144,15 @@ class wrap_gp(object):
 	def set_output_dir(self, v):
 		self.output_dir = v
 
+	def set_output_store(self, store):
+		# plots as PNG to gnuplot's stdout and from there to
+		# store.put(filename, png) instead of files in output_dir
+		if self.output_store is store:
+			return
+		self.kill()
+		self.output_store = store
+		self.attach_gp()
+
 	def plot(self, buf, bufsz, mode='eye'):
 		BUFSZ = bufsz
 		consumed = min(len(buf), BUFSZ-len(self.buf))
@@ -163,7 +221,13 @@ class wrap_gp(object):
 		self.last_plot = time.time()
 
 		filename = None
-		if self.output_dir:
+		if self.output_store:
+			h= 'set terminal png\n'
+			filename = 'plot-%s-%d.png' % (mode, self.sequence)
+			self.sequence += 1
+			h += 'set output\n'
+			self.pending.append(filename)
+		elif self.output_dir:
 			if self.sequence >= 2:
 				delete_pathname = '%s/plot-%s-%d.png' % (self.output_dir, mode, self.sequence-2)
 				if os.access(delete_pathname, os.W_OK):
@@ -213,7 +277,7 @@ class wrap_gp(object):
 				self.gp.stdin.write(dat)
 			except (IOError, ValueError):
 				pass
-		if filename:
+		if filename and not self.output_store:
 			self.filename = filename
 		return consumed
 
@@ -23,76 +23,460 @@ import os
 import time
 import re
 import json
+import gzip
 import socket
+import hashlib
 import traceback
 import threading
+import collections
+import urlparse
+import SocketServer
+import email.utils
+from cStringIO import StringIO
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
 
 from gnuradio import gr
-from waitress.server import create_server
 
 my_input_q = None
 my_output_q = None
-my_recv_q = None
+my_hub = None
 my_port = None
 
 """
-fake http and ajax server module
-TODO: make less fake
+http and ajax server module
+
+The trunk_update, change_freq and rx_update messages from rx.py go to an
+update_hub shared by all clients: a short log of the messages, each with
+a sequence number (the client's cursor), and the latest state per
+json_type.  A client is sent what was published after its cursor,
+coalesced to one message per json_type (trunk_update deltas are merged),
+or the whole state if it is new or fell behind the log, so no client
+takes messages away from another and a slow one only ever gets fewer,
+larger updates.  While push clients are connected update_pump asks rx.py
+for an update every UPDATE_INTERVAL.
+
+    GET /events             server-sent events, one per message; the event
+                            id is the cursor (EventSource resends it as
+                            Last-Event-ID when it reconnects)
+    GET /updates?cursor=N   long poll: {"cursor": ..., "messages": [...]}
+                            as soon as there is anything after N
+    POST /command           commands (a JSON list of {command, data}),
+                            answered at once; the result comes as an update
+    POST /                  commands, answered with the messages published
+                            in response (the original polling interface)
+
+Each connection is served by its own thread (python 2 has no asyncio).
+
+Static files and images are served from asset_cache, which keeps them in
+memory (checking their mtime at most every ASSET_CHECK_INTERVAL) together
+with a gzip variant of the text types, a file.gz next to the file if
+there is an up to date one.  Responses carry ETag and Last-Modified and
+conditional requests are answered with 304.  The plots of gr_gnuplot are
+put() into the cache by the plot sinks and never go to the disk.
 """
 
-def static_file(environ, start_response):
-    content_types = { 'png': 'image/png', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'css': 'text/css', 'js': 'application/javascript', 'html': 'text/html'}
-    img_types = 'png jpg jpeg gif'.split()
-    if environ['PATH_INFO'] == '/':
-        filename = 'index.html'
+UPDATE_INTERVAL = 1.0     # seconds between updates requested for push clients
+CLIENT_IDLE = 5.0         # keep requesting updates this long after the last long poll
+LOG_SIZE = 64             # messages kept for clients to catch up from
+LONG_POLL_TIMEOUT = 20.0
+SSE_KEEPALIVE = 15.0
+SSE_RETRY = 1000          # ms before EventSource reconnects
+POST_TIMEOUT = 1.0        # longest wait for the answer to a POST /
+POST_SETTLE = 0.02        # a POST / is answered once no message arrived for this long
+
+STATIC_DIR = '../www/www-static'
+IMAGE_DIR = '../www/images'
+CONTENT_TYPES = { 'png': 'image/png', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'css': 'text/css', 'js': 'application/javascript', 'html': 'text/html'}
+IMG_TYPES = 'png jpg jpeg gif'.split()
+GZIP_TYPES = 'css js html'.split()
+GZIP_MIN_SIZE = 512       # smaller files are sent as they are
+ASSET_CHECK_INTERVAL = 1.0
+MAX_PATHS = 256           # request paths remembered by asset_cache.resolve
+
+def merge_tsys(old, new, delta):
+    # trunk_update entry of one nac: new (a delta) applied to old
+    d = dict(old)
+    removed = [str(f) for f in new.get('removed_frequencies', [])]
+    for k in ('frequencies', 'frequency_data'):
+        if k in new or (removed and k in d):
+            freqs = dict(d.get(k, {}))
+            for f in removed:
+                freqs.pop(f, None)
+            freqs.update(new.get(k, {}))
+            d[k] = freqs
+    for k, v in new.items():
+        if k not in ('frequencies', 'frequency_data', 'removed_frequencies'):
+            d[k] = v
+    if delta:
+        # still removed unless new brought the frequency back
+        readded = new.get('frequencies', {})
+        removed = [f for f in old.get('removed_frequencies', []) if str(f) not in readded and str(f) not in removed]
+        removed += new.get('removed_frequencies', [])
+        if removed:
+            d['removed_frequencies'] = removed
+        else:
+            d.pop('removed_frequencies', None)
+    return d
+
+def merge_update(old, new):
+    # trunk_update delta new (see rx_ctl.to_json) applied to old, a full
+    # update or a delta itself; the result covers both, neither is modified
+    d = dict(old)
+    delta = 'since' in old
+    for k, v in new.items():
+        if isinstance(v, dict) and isinstance(d.get(k), dict):
+            d[k] = merge_tsys(d[k], v, delta)
+        else:
+            d[k] = v
+    if delta:
+        d['since'] = old['since']
     else:
-        filename = re.sub(r'[^a-zA-Z0-9_.\-]', '', environ['PATH_INFO'])
-    suf = filename.split('.')[-1]
-    pathname = '../www/www-static'
-    if suf in img_types:
-        pathname = '../www/images'
-    pathname = '%s/%s' % (pathname, filename)
-    if suf not in content_types.keys() or '..' in filename or not os.access(pathname, os.R_OK):
-        sys.stderr.write('404 %s\n' % pathname)
+        d.pop('since', None)
+    return d
+
+class update_hub(object):
+    def __init__(self, log_size=LOG_SIZE):
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.log = collections.deque(maxlen=log_size)   # (seq, msg, js)
+        self.state = {}          # json_type -> latest (seq, msg, js), trunk_update merged
+        self.clients = 0         # connected event streams
+        self.last_active = 0     # time of the last long poll
+
+    def publish(self, js):
+        msg = json.loads(js)
+        with self.cond:
+            self.seq += 1
+            entry = (self.seq, msg, js)
+            self.log.append(entry)
+            json_type = msg.get('json_type')
+            prev = self.state.get(json_type)
+            if json_type == 'trunk_update' and msg.get('since') and prev is not None:
+                merged = merge_update(prev[1], msg)
+                entry = (self.seq, merged, json.dumps(merged))
+            self.state[json_type] = entry
+            self.cond.notify_all()
+
+    def update_since(self):
+        # seq of the last trunk_update to request the changes after, 0 for all
+        trunk = self.state.get('trunk_update')
+        if trunk is None or 'since' in trunk[1]:
+            return 0
+        return trunk[1].get('seq', 0)
+
+    def updates(self, cursor):
+        # (new cursor, json of the messages after cursor, one per json_type)
+        with self.cond:
+            if cursor > self.seq:    # from before a restart
+                cursor = 0
+            if cursor >= self.seq:
+                return self.seq, []
+            if cursor <= 0 or cursor < self.log[0][0] - 1:
+                entries = self.state.values()
+            else:
+                latest = {}
+                for entry in self.log:
+                    if entry[0] <= cursor:
+                        continue
+                    seq, msg, js = entry
+                    json_type = msg.get('json_type')
+                    prev = latest.get(json_type)
+                    if json_type == 'trunk_update' and msg.get('since') and prev is not None:
+                        entry = (seq, merge_update(prev[1], msg), None)
+                    latest[json_type] = entry
+                entries = latest.values()
+            entries.sort()
+            return self.seq, [js if js is not None else json.dumps(msg) for seq, msg, js in entries]
+
+    def wait(self, cursor, timeout):
+        # until there is something after cursor or timeout; woken by
+        # publish and by the pump's tick, so timeout is only that precise
+        deadline = time.time() + timeout
+        with self.cond:
+            if cursor > self.seq:
+                return self.seq
+            while self.seq <= cursor and time.time() < deadline:
+                self.cond.wait()
+            return self.seq
+
+    def settle(self, cursor, timeout):
+        # the (msg, js) published after cursor, once they stop coming
+        deadline = time.time() + timeout
+        with self.cond:
+            seq = cursor
+            while time.time() < deadline:
+                self.cond.wait(POST_SETTLE)
+                if self.seq == seq and seq > cursor:
+                    break
+                seq = self.seq
+            return [(msg, js) for s, msg, js in self.log if s > cursor]
+
+    def tick(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def connect(self):
+        with self.cond:
+            self.clients += 1
+
+    def disconnect(self):
+        with self.cond:
+            self.clients -= 1
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def active(self):
+        return self.clients > 0 or time.time() < self.last_active + CLIENT_IDLE
+
+def gzip_data(data, mtime):
+    buf = StringIO()
+    fp = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=mtime)
+    fp.write(data)
+    fp.close()
+    return buf.getvalue()
+
+class asset_cache(object):
+    def __init__(self, check_interval=ASSET_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.paths = {}      # request path -> (filename, pathname) or None if not servable
+        self.files = {}      # pathname -> entry
+        self.memory = {}     # filename -> entry, see put()
+
+    def resolve(self, path):
+        with self.lock:
+            if path in self.paths:
+                return self.paths[path]
+        if path == '/':
+            filename = 'index.html'
+        else:
+            filename = re.sub(r'[^a-zA-Z0-9_.\-]', '', path)
+        suf = filename.split('.')[-1]
+        pathname = STATIC_DIR
+        if suf in IMG_TYPES:
+            pathname = IMAGE_DIR
+        pathname = '%s/%s' % (pathname, filename)
+        result = (filename, pathname)
+        if suf not in CONTENT_TYPES or '..' in filename:
+            result = None
+        with self.lock:
+            if len(self.paths) < MAX_PATHS:
+                self.paths[path] = result
+        return result
+
+    def make_entry(self, data, mtime, suf, gz=None, key=None):
+        # gz: the precompressed variant, if there is one; for text types
+        # without one data is compressed here
+        if gz is None and suf in GZIP_TYPES and len(data) >= GZIP_MIN_SIZE:
+            gz = gzip_data(data, mtime)
+        etag = hashlib.md5(data).hexdigest()
+        return {'data': data, 'gzip': gz, 'etag': '"%s"' % etag, 'gzip_etag': '"%s-gz"' % etag,
+                'mtime': int(mtime), 'last_modified': email.utils.formatdate(mtime, usegmt=True),
+                'content_type': CONTENT_TYPES[suf], 'key': key, 'checked': time.time()}
+
+    def stat(self, pathname):
+        # (mtime, size, mtime of pathname.gz or None), None if pathname can't be read
+        try:
+            st = os.stat(pathname)
+        except OSError:
+            return None
+        try:
+            gz_mtime = os.stat(pathname + '.gz').st_mtime
+        except OSError:
+            gz_mtime = None
+        if gz_mtime is not None and gz_mtime < st.st_mtime:
+            gz_mtime = None     # stale
+        return (st.st_mtime, st.st_size, gz_mtime)
+
+    def load(self, pathname, key):
+        suf = pathname.split('.')[-1]
+        try:
+            with open(pathname, 'rb') as fp:
+                data = fp.read()
+            gz = None
+            if key[2] is not None:
+                with open(pathname + '.gz', 'rb') as fp:
+                    gz = fp.read()
+        except IOError:
+            return None
+        return self.make_entry(data, key[0], suf, gz, key)
+
+    def get_file(self, pathname):
+        with self.lock:
+            entry = self.files.get(pathname)
+        now = time.time()
+        if entry is not None and now < entry['checked'] + self.check_interval:
+            return entry
+        key = self.stat(pathname)
+        if entry is not None and entry['key'] == key:
+            entry['checked'] = now
+            return entry
+        entry = None
+        if key is not None:
+            entry = self.load(pathname, key)
+        with self.lock:
+            if entry is None:
+                self.files.pop(pathname, None)
+            else:
+                self.files[pathname] = entry
+        return entry
+
+    def get(self, path):
+        # the entry to serve for the request path, None if there is none
+        resolved = self.resolve(path)
+        if resolved is None:
+            return None
+        filename, pathname = resolved
+        with self.lock:
+            entry = self.memory.get(filename)
+        if entry is not None:
+            return entry
+        return self.get_file(pathname)
+
+    def put(self, filename, data):
+        # serve data (a plot) as filename, from memory only
+        entry = self.make_entry(data, time.time(), filename.split('.')[-1])
+        with self.lock:
+            self.memory[filename] = entry
+
+    def remove(self, filename):
+        with self.lock:
+            self.memory.pop(filename, None)
+
+my_assets = asset_cache()    # before any http_server: plot sinks put() into it
+
+def accepts_gzip(environ):
+    # Accept-Encoding lists gzip, or *, with a q above 0
+    codings = {}
+    for item in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in codings:
+            return codings[coding] > 0
+    return False
+
+def not_modified(environ, etag, mtime):
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        tags = [t.strip() for t in environ['HTTP_IF_NONE_MATCH'].split(',')]
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+    if 'HTTP_IF_MODIFIED_SINCE' in environ:
+        since = email.utils.parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+        return since is not None and mtime <= email.utils.mktime_tz(since)
+    return False
+
+def static_file(environ, start_response):
+    entry = my_assets.get(environ['PATH_INFO'])
+    if entry is None:
+        sys.stderr.write('404 %s\n' % environ['PATH_INFO'])
         status = '404 NOT FOUND'
-        content_type = 'text/plain'
-        output = status
-    else:
-        output = open(pathname).read()
-        content_type = content_types[suf]
-        status = '200 OK'
-    return status, content_type, output
+        return status, [('Content-type', 'text/plain')], status
+    headers = [('Content-type', entry['content_type']),
+               ('Last-Modified', entry['last_modified']),
+               ('Cache-Control', 'no-cache')]
+    output = entry['data']
+    etag = entry['etag']
+    if entry['gzip'] is not None:
+        headers.append(('Vary', 'Accept-Encoding'))
+        if accepts_gzip(environ):
+            output = entry['gzip']
+            etag = entry['gzip_etag']
+            headers.append(('Content-Encoding', 'gzip'))
+    headers.append(('ETag', etag))
+    if not_modified(environ, etag, entry['mtime']):
+        return '304 Not Modified', headers, ''
+    return '200 OK', headers, output
 
-def post_req(environ, start_response, postdata):
-    global my_input_q, my_output_q, my_recv_q, my_port
-    valid_req = False
+def send_commands(postdata):
+    # returns the data of the update command, if any, or None if postdata is invalid
+    since = False
     try:
         data = json.loads(postdata)
         for d in data:
             msg = gr.message().make_from_string(str(d['command']), -2, d['data'], 0)
             my_output_q.insert_tail(msg)
-        valid_req = True
-        time.sleep(0.2)
+            if d['command'] == 'update':
+                since = int(d['data'])
     except:
         sys.stderr.write('post_req: error processing input: %s:\n' % (postdata))
+        return None
+    return since
+
+def post_req(environ, start_response, postdata):
+    cursor = my_hub.seq
+    since = send_commands(postdata)
+    if environ['PATH_INFO'] == '/command' or since is None or since is False:
+        return '200 OK', 'application/json', '[]'
+    # the answer to the update: trunk_update deltas for other clients only
+    # if they include everything after this client's own last update
+    resp_msg = [js for msg, js in my_hub.settle(cursor, POST_TIMEOUT)
+                if msg.get('json_type') != 'trunk_update' or msg.get('since', 0) <= since]
+    return '200 OK', 'application/json', '[%s]' % ','.join(resp_msg)
+
+def long_poll(environ, start_response):
+    query = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+    try:
+        cursor = int(query.get('cursor', ['0'])[0])
+    except ValueError:
+        cursor = 0
+    my_hub.touch()
+    my_hub.wait(cursor, LONG_POLL_TIMEOUT)
+    cursor, msgs = my_hub.updates(cursor)
+    return '200 OK', 'application/json', '{"cursor": %d, "messages": [%s]}' % (cursor, ','.join(msgs))
+
+def event_stream(cursor):
+    my_hub.connect()
+    try:
+        yield 'retry: %d\n\n' % SSE_RETRY
+        while True:
+            cursor, msgs = my_hub.updates(cursor)
+            if msgs:
+                yield ''.join(['data: %s\n\n' % js for js in msgs[:-1]] +
+                              ['id: %d\ndata: %s\n\n' % (cursor, msgs[-1])])
+            else:
+                yield ': keepalive\n\n'
+            my_hub.wait(cursor, SSE_KEEPALIVE)
+    finally:
+        my_hub.disconnect()
 
-    resp_msg = []
-    while not my_recv_q.empty_p():
-        msg = my_recv_q.delete_head()
-        if msg.type() == -4:
-            resp_msg.append(json.loads(msg.to_string()))
-    if not valid_req:
-        resp_msg = []
-    status = '200 OK'
-    content_type = 'application/json'
-    output = json.dumps(resp_msg)
-    return status, content_type, output
+def events(environ, start_response):
+    try:
+        cursor = int(environ.get('HTTP_LAST_EVENT_ID', 0))
+    except ValueError:
+        cursor = 0
+    start_response('200 OK', [('Content-type', 'text/event-stream'),
+                              ('Cache-Control', 'no-cache')])
+    return event_stream(cursor)
 
 def http_request(environ, start_response):
-    if environ['REQUEST_METHOD'] == 'GET':
-        status, content_type, output = static_file(environ, start_response)
+    if environ['REQUEST_METHOD'] == 'GET' and environ['PATH_INFO'] == '/events':
+        return events(environ, start_response)
+    elif environ['REQUEST_METHOD'] == 'GET' and environ['PATH_INFO'] == '/updates':
+        status, content_type, output = long_poll(environ, start_response)
+    elif environ['REQUEST_METHOD'] == 'GET':
+        status, response_headers, output = static_file(environ, start_response)
+        if status.startswith('304'):
+            # a 304 has no body and must not carry Content-Length (RFC 7232 4.1).
+            # wsgiref adds "Content-Length: 0" to a response that writes
+            # nothing, so push the headers out with an empty write first
+            start_response(status, response_headers)('')
+            return []
+        start_response(status, response_headers + [('Content-Length', str(len(output)))])
+        return [output]
     elif environ['REQUEST_METHOD'] == 'POST':
-        postdata = environ['wsgi.input'].read()
+        postdata = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
         status, content_type, output = post_req(environ, start_response, postdata)
     else:
         status = '200 OK'
@@ -117,15 +501,49 @@ def application(environ, start_response):
     return result
 
 def process_qmsg(msg):
-    if my_recv_q.full_p():
-        my_recv_q.delete_head_nowait()   # ignores result
-    if my_recv_q.full_p():
+    if msg.type() != -4:
         return
-    my_recv_q.insert_tail(msg)
+    try:
+        my_hub.publish(msg.to_string())
+    except ValueError:
+        sys.stderr.write('process_qmsg: invalid json: %s\n' % msg.to_string())
+
+class wsgi_handler(ServerHandler):
+    def log_exception(self, exc_info):
+        if issubclass(exc_info[0], socket.error):   # the client went away
+            return
+        ServerHandler.log_exception(self, exc_info)
+
+class request_handler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # WSGIRequestHandler.handle, with wsgi_handler
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = wsgi_handler(self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+class threaded_server(SocketServer.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if issubclass(sys.exc_info()[0], socket.error):
+            return
+        WSGIServer.handle_error(self, request, client_address)
 
 class http_server(object):
     def __init__(self, input_q, output_q, endpoint, **kwds):
-        global my_input_q, my_output_q, my_recv_q, my_port
+        global my_input_q, my_output_q, my_hub, my_port
         host, port = endpoint.split(':')
         if my_port is not None:
             raise AssertionError('this server is already active on port %s' % my_port)
@@ -133,13 +551,33 @@ class http_server(object):
         my_output_q = output_q
         my_port = int(port)
 
-        my_recv_q = gr.msg_queue(10)
+        my_hub = update_hub()
         self.q_watcher = queue_watcher(my_input_q, process_qmsg)
+        self.pump = update_pump(my_hub, my_output_q)
 
-        self.server = create_server(application, host=host, port=my_port)
+        self.server = threaded_server((host, my_port), request_handler)
+        self.server.set_app(application)
 
     def run(self):
-        self.server.run()
+        self.server.serve_forever()
+
+class update_pump(threading.Thread):
+    def __init__(self, hub, output_q, interval=UPDATE_INTERVAL, **kwds):
+        threading.Thread.__init__ (self, **kwds)
+        self.setDaemon(1)
+        self.hub = hub
+        self.output_q = output_q
+        self.interval = interval
+        self.keep_running = True
+        self.start()
+
+    def run(self):
+        while(self.keep_running):
+            if self.hub.active():
+                msg = gr.message().make_from_string('update', -2, self.hub.update_since(), 0)
+                self.output_q.insert_tail(msg)
+            self.hub.tick()     # wakes up waiting clients for their timeouts
+            time.sleep(self.interval)
 
 class queue_watcher(threading.Thread):
     def __init__(self, msgq,  callback, **kwds):
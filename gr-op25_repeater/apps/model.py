@@ -49,6 +49,12 @@ class Options:
         self.vocoder = True
         self.sample_rate = 2400000
         self.logfile_workers = None
+        self.multi_site = False
+        self.record_msgq = None
+        self.call_format = None
+        self.call_processes = 2
+        self.cdr_file = None
+        self.xor_cache = None
         self.fine_tune = 0.0
         self.udp_player = True
         self.audio = False
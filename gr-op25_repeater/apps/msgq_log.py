@@ -0,0 +1,113 @@
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Binary log of the msgq messages handed to trunking.rx_ctl
+
+The file starts with MAGIC and a version number, followed by one record
+per message: RECORD (timestamp, queue, type, arg1, arg2, payload length)
+and the payload bytes.  queue tells which rx_ctl entry point received the
+message: MAIN_QUEUE for process_qmsg, SITE_QUEUE for process_site_qmsg.
+read_log() returns replay_msg objects, which stand in for gr.message so
+that a log can be fed to rx_ctl without GNU Radio (see msgq_replay.py).
+"""
+
+import struct
+import threading
+import time
+
+MAGIC = 'OP25MSGQ'
+VERSION = 1
+HEADER = struct.Struct('<8sH')
+RECORD = struct.Struct('<dBiddI')
+
+MAIN_QUEUE = 0
+SITE_QUEUE = 1
+
+
+class replay_msg(object):
+    def __init__(self, type, arg1, arg2, s):
+        self.msg_type = type
+        self.msg_arg1 = arg1
+        self.msg_arg2 = arg2
+        self.s = s
+
+    def type(self):
+        return self.msg_type
+
+    def arg1(self):
+        return self.msg_arg1
+
+    def arg2(self):
+        return self.msg_arg2
+
+    def length(self):
+        return len(self.s)
+
+    def to_string(self):
+        return self.s
+
+
+class msgq_recorder(object):
+    def __init__(self, filename, flush_interval=1.0):
+        self.fp = open(filename, 'wb')
+        self.fp.write(HEADER.pack(MAGIC, VERSION))
+        self.lock = threading.Lock()  # the site queue has its own watcher thread
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.count = 0
+
+    def record(self, msg, queue=MAIN_QUEUE):
+        s = msg.to_string()
+        curr_time = time.time()
+        rec = RECORD.pack(curr_time, queue, msg.type(), msg.arg1(), msg.arg2(), len(s)) + s
+        with self.lock:
+            self.fp.write(rec)
+            self.count += 1
+            if curr_time >= self.last_flush + self.flush_interval:
+                self.fp.flush()
+                self.last_flush = curr_time
+
+    def wrap(self, callback, queue=MAIN_QUEUE):
+        # callback for du_queue_watcher which records each message before handling it
+        def record_and_call(msg):
+            self.record(msg, queue)
+            return callback(msg)
+        return record_and_call
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+
+def read_log(filename):
+    # yields (timestamp, queue, replay_msg) for every record in the log
+    with open(filename, 'rb') as fp:
+        magic, version = HEADER.unpack(fp.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a version %d msgq log' % (filename, VERSION))
+        while True:
+            rec = fp.read(RECORD.size)
+            if len(rec) < RECORD.size:  # end of file, or a record cut short by a crash
+                return
+            timestamp, queue, type, arg1, arg2, length = RECORD.unpack(rec)
+            s = fp.read(length)
+            if len(s) < length:
+                return
+            yield timestamp, queue, replay_msg(type, arg1, arg2, s)
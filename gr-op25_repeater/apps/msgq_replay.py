@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Replay a msgq log into trunking.rx_ctl without GNU Radio
+
+Feeds the messages recorded by rx.py --record-msgq (see msgq_log.py) to
+rx_ctl.process_qmsg / process_site_qmsg, either as fast as possible or
+paced by the recorded timestamps (-r), and reports messages/sec,
+per-message latency percentiles, the rx_ctl state transitions and the
+tuning requests rx_ctl made.  Give the trunking config (-T) the log was
+recorded with, otherwise rx_ctl runs in manual mode and only decodes.
+
+rx_ctl keeps its hold and hunt timers in wall-clock time, so at full
+speed fewer of them expire between messages than in the recording.
+
+Without a log file (-S) a synthetic control channel of type-7 TSBK
+messages is generated instead.
+"""
+
+import sys
+import time
+import collections
+from optparse import OptionParser
+
+import trunking
+import msgq_log
+
+STATE_NAMES = {0: 'ACQ', 1: 'CC', 2: 'TO_VC', 3: 'VC'}
+
+
+def synthetic_log(count, nac=0x293, rate=40.0):
+    # (timestamp, queue, msg) for count synthetic TSBKs at rate TSBKs/sec
+    import tsbk_bench
+    t0 = time.time()
+    for i, payload in enumerate(tsbk_bench.to_payloads(tsbk_bench.synthetic_tsbks(count), nac=nac)):
+        yield t0 + i / rate, msgq_log.MAIN_QUEUE, msgq_log.replay_msg(7, 0, 0, payload.tostring())
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def replay(records, rx, realtime=False, verbose=False):
+    latencies = []
+    types = collections.Counter()
+    transitions = collections.Counter()
+    wall0 = rec0 = None
+    t_start = time.time()
+    for timestamp, queue, msg in records:
+        if realtime:
+            if wall0 is None:
+                wall0, rec0 = time.time(), timestamp
+            delay = wall0 + (timestamp - rec0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        process = rx.process_site_qmsg if queue == msgq_log.SITE_QUEUE else rx.process_qmsg
+        state = rx.current_state
+        t0 = time.time()
+        process(msg)
+        latencies.append(time.time() - t0)
+        types[msg.type()] += 1
+        if rx.current_state != state:
+            transitions['%s->%s' % (STATE_NAMES.get(state, state), STATE_NAMES.get(rx.current_state, rx.current_state))] += 1
+            if verbose:
+                sys.stdout.write('%f state %s -> %s tgid %s\n' % (timestamp, STATE_NAMES.get(state, state),
+                                 STATE_NAMES.get(rx.current_state, rx.current_state), rx.current_tgid))
+    return time.time() - t_start, latencies, types, transitions
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [msgq-log]")
+    parser.add_option("-T", "--trunk-conf-file", type="string", default=None, help="trunking config file name")
+    parser.add_option("-r", "--realtime", action="store_true", default=False, help="replay at the recorded pace")
+    parser.add_option("-S", "--synthetic", type="int", default=0, help="replay this many synthetic TSBKs instead of a log")
+    parser.add_option("-v", "--verbose", action="store_true", default=False, help="list every state transition and tune")
+    (options, args) = parser.parse_args()
+    if len(args) != 1 and not options.synthetic:
+        parser.print_help()
+        sys.exit(1)
+
+    tunes = []
+
+    def frequency_set(params):
+        tunes.append(params)
+        if options.verbose:
+            sys.stdout.write('%f tune %f nac %s tgid %s slot %s\n' % (time.time(), params['freq'] / 1000000.0,
+                             params['nac'], params['tgid'], params['tdma']))
+
+    rx = trunking.rx_ctl(frequency_set=frequency_set, conf_file=options.trunk_conf_file,
+                         meta_update=lambda tgid, tag: None)
+    del tunes[:]  # initial control channel
+
+    if options.synthetic:
+        records = synthetic_log(options.synthetic)
+    else:
+        records = msgq_log.read_log(args[0])
+    elapsed, latencies, types, transitions = replay(records, rx, realtime=options.realtime, verbose=options.verbose)
+
+    n = len(latencies)
+    if not n:
+        sys.stderr.write('no messages to replay\n')
+        sys.exit(1)
+    latencies.sort()
+    sys.stdout.write('%d msgs in %.3f s, %.0f msgs/sec (%.0f msgs/sec in process_qmsg)\n' % (
+        n, elapsed, n / elapsed, n / sum(latencies)))
+    sys.stdout.write('latency us: p50 %.1f  p90 %.1f  p99 %.1f  p99.9 %.1f  max %.1f\n' % tuple(
+        percentile(latencies, p) * 1e6 for p in (50, 90, 99, 99.9, 100)))
+    sys.stdout.write('msg types: %s\n' % '  '.join('%d: %d' % (t, types[t]) for t in sorted(types)))
+    sys.stdout.write('state transitions: %s\n' % ('  '.join('%s %d' % (k, transitions[k]) for k in sorted(transitions)) or 'none'))
+    sys.stdout.write('tunes: %d\n' % len(tunes))
+
+
+if __name__ == '__main__':
+    main()
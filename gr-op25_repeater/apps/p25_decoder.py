@@ -61,7 +61,8 @@ class p25_decoder_sink_b(gr.hier_block2):
                  msgq		= None,
                  audio_output	= _def_audio_output,
                  debug		= _def_debug,
-                 nocrypt        = _def_nocrypt ):
+                 nocrypt        = _def_nocrypt,
+                 recorder       = None ):
         """
 	Hierarchical block for P25 decoding.
 
@@ -74,15 +75,17 @@ class p25_decoder_sink_b(gr.hier_block2):
 				gr.io_signature(0, 0, 0)) # Output signature
 
         assert 0 <= num_ambe <= _def_max_tdma_timeslots
-        assert not (num_ambe > 1 and dest != 'wav')
+        assert not (num_ambe > 1 and dest not in ('wav', 'call'))
+        assert (dest == 'call') == (recorder is not None)
 
         self.debug = debug
         self.dest = dest
+        self.recorder = recorder
         do_output = False
         do_audio_output = False
         do_phase2_tdma = False
         do_nocrypt = nocrypt
-        if dest == 'wav':
+        if dest in ('wav', 'call'):
             do_output = True
 
         if do_imbe:
@@ -99,6 +102,7 @@ class p25_decoder_sink_b(gr.hier_block2):
         self.scaler = []
         self.audio_sink = []
         self.xorhash = []
+        self.call_sources = []
         num_decoders = 1
         if num_ambe > 1:
            num_decoders += num_ambe - 1
@@ -117,10 +121,19 @@ class p25_decoder_sink_b(gr.hier_block2):
                 self.scaler.append(blocks.multiply_const_ff(1 / 32768.0))
                 self.audio_sink.append(blocks.wavfile_sink(filename, n_channels, sample_rate, bits_per_sample))
                 self.connect(self, self.p25_decoders[slot], self.audio_s2f[slot], self.scaler[slot], self.audio_sink[slot])
+            elif dest == 'call':
+                # PCM goes to the call_recorder thread; the sink drops rather than block
+                pcm_q = gr.msg_queue(100)
+                self.call_sources.append(recorder.add_source(pcm_q))
+                self.audio_sink.append(blocks.message_sink(gr.sizeof_short, pcm_q, True))
+                self.connect(self, self.p25_decoders[slot], self.audio_sink[slot])
             elif dest == 'audio':
                 self.connect(self, self.p25_decoders[slot])
 
     def close_file(self, index=0):
+        if self.dest == 'call':
+            self.recorder.end_call(self.call_sources[index], time.time())
+            return
         if self.dest != 'wav':
             return
         self.audio_sink[index].close()
@@ -131,7 +144,10 @@ class p25_decoder_sink_b(gr.hier_block2):
     def set_slotkey(self, key, index=0):
         self.p25_decoders[index].set_slotkey(key)
 
-    def set_output(self, filename, index=0):
+    def set_output(self, filename, index=0, info=None):
+        if self.dest == 'call':
+            self.recorder.start_call(self.call_sources[index], filename, info or {'start': time.time()})
+            return
         if self.dest != 'wav':
             return
         self.audio_sink[index].open(filename)
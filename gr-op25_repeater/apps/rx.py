@@ -53,6 +53,9 @@ import op25
 import op25_repeater
 
 import trunking
+import msgq_log
+import call_recorder
+import cdr
 
 import p25_demodulator
 import p25_decoder
@@ -77,7 +80,6 @@ os.environ['IMBE'] = 'soft'
 WIRESHARK_PORT = 23456
 
 _def_interval = 1.0	# sec
-_def_file_dir = '../www/images'
 
 # The P25 receiver
 #
@@ -104,6 +106,8 @@ class p25_rx_block (gr.top_block):
         self.target_freq = 0.0
         self.last_freq_params = {'freq' : 0.0, 'tgid' : None, 'tag' : "", 'tdma' : None}
         self.meta_server = None
+        self.call_recorder = None
+        self.cdr_store = None
         self.stream_url = ""
 
         self.src = None
@@ -254,7 +258,7 @@ class p25_rx_block (gr.top_block):
             udp_port = self.options.wireshark_port
 
         self.tdma_state = False
-        self.xor_cache = {}
+        self.xor_cache = lfsr.xor_cache(self.options.xor_cache)
 
         self.fft_state  = False
         self.c4fm_state = False
@@ -316,18 +320,48 @@ class p25_rx_block (gr.top_block):
         logfile_workers = []
         if self.options.phase2_tdma:
             num_ambe = 2
+        dest = 'wav'
+        if self.options.logfile_workers and self.options.call_format:
+            sys.stderr.write("Recording calls as %s, %d encoder processes\n" % (self.options.call_format, self.options.call_processes))
+            self.call_recorder = call_recorder.call_recorder(fmt=self.options.call_format, processes=self.options.call_processes)
+            dest = 'call'
         if self.options.logfile_workers:
             for i in xrange(self.options.logfile_workers):
                 demod = p25_demodulator.p25_demod_cb(input_rate=capture_rate,
                                                      demod_type=self.options.demod_type,
                                                      offset=self.options.offset)
-                decoder = p25_decoder.p25_decoder_sink_b(debug = self.options.verbosity, do_imbe = self.options.vocoder, num_ambe=num_ambe)
+                decoder = p25_decoder.p25_decoder_sink_b(dest = dest, debug = self.options.verbosity, do_imbe = self.options.vocoder, num_ambe=num_ambe, recorder = self.call_recorder)
                 logfile_workers.append({'demod': demod, 'decoder': decoder, 'active': False})
                 self.connect(source, demod, decoder)
 
+        # multi-site mode: one control channel demodulator per configured system,
+        # created by site_set() while rx_ctl reads the trunking config
+        self.site_channels = []
+        self.site_q = gr.msg_queue(100)
+        self.site_source = source
+        self.site_capture_rate = capture_rate
+        site_set = None
+        if self.options.multi_site:
+            site_set = self.site_set
+
+        call_event = None
+        if self.options.cdr_file:
+            sys.stderr.write("Recording call detail records to file: %s\n" % self.options.cdr_file)
+            self.cdr_store = cdr.cdr_store(self.options.cdr_file)
+            call_event = self.cdr_store.record
+
         print("trunking.rx_ctl - %s " % self.options.trunk_conf_file)
-        self.trunk_rx = trunking.rx_ctl(frequency_set = self.change_freq, debug = self.options.verbosity, conf_file = self.options.trunk_conf_file, logfile_workers=logfile_workers, meta_update = self.meta_update)
-        self.du_watcher = du_queue_watcher(self.rx_q, self.trunk_rx.process_qmsg)
+        self.trunk_rx = trunking.rx_ctl(frequency_set = self.change_freq, debug = self.options.verbosity, conf_file = self.options.trunk_conf_file, logfile_workers=logfile_workers, meta_update = self.meta_update, site_set = site_set, call_event = call_event, xor_cache = self.xor_cache)
+        process_qmsg = self.trunk_rx.process_qmsg
+        process_site_qmsg = self.trunk_rx.process_site_qmsg
+        if self.options.record_msgq:
+            sys.stderr.write("Recording trunking messages to file: %s\n" % self.options.record_msgq)
+            self.msgq_recorder = msgq_log.msgq_recorder(self.options.record_msgq)
+            process_qmsg = self.msgq_recorder.wrap(process_qmsg)
+            process_site_qmsg = self.msgq_recorder.wrap(process_site_qmsg, msgq_log.SITE_QUEUE)
+        self.du_watcher = du_queue_watcher(self.rx_q, process_qmsg)
+        if self.site_channels:
+            self.site_watcher = du_queue_watcher(self.site_q, process_site_qmsg)
 
     # Connect up the flow graph
     #
@@ -372,9 +406,7 @@ class p25_rx_block (gr.top_block):
         self.tdma_state = set_tdma
         if set_tdma:
             hash = '%x%x%x' % (params['nac'], params['sysid'], params['wacn'])
-            if hash not in self.xor_cache:
-                self.xor_cache[hash] = lfsr.p25p2_lfsr(params['nac'], params['sysid'], params['wacn']).xor_chars
-            self.decoder.set_xormask(self.xor_cache[hash], hash)
+            self.decoder.set_xormask(self.xor_cache.get(params['nac'], params['sysid'], params['wacn']), hash)
             rate = 6000
         else:
             rate = 4800
@@ -434,6 +466,25 @@ class p25_rx_block (gr.top_block):
         self.configure_tdma(params)
         self.freq_update()
 
+    def site_set(self, params):
+        # (re)tune the control channel demodulator of one system
+        site = params['site']
+        if site >= len(self.site_channels):
+            demod = p25_demodulator.p25_demod_cb(input_rate=self.site_capture_rate,
+                                                 demod_type=self.options.demod_type,
+                                                 offset=self.options.offset)
+            # control channel only: no audio, wav file or udp output
+            decoder = p25_decoder.p25_decoder_sink_b(dest = 'audio', do_imbe = False, debug = self.options.verbosity, do_msgq = True, msgq = self.site_q)
+            if params['modulation'] == 'c4fm':
+                demod.connect_chain('fsk4')
+            self.site_channels.append({'demod': demod, 'decoder': decoder})
+            self.connect(self.site_source, demod, decoder)
+        relative_freq = params['center_frequency'] - params['freq']
+        if abs(relative_freq) > self.site_capture_rate / 2:
+            sys.stderr.write("%f site %d nac 0x%x: control channel %d outside of capture bandwidth\n" % (time.time(), site, params['nac'], params['freq']))
+            return
+        self.site_channels[site]['demod'].set_relative_frequency(relative_freq)
+
     def freq_update(self):
         #print 'freq_update: %s' % self.last_freq_params
         params = self.last_freq_params
@@ -662,8 +713,9 @@ class p25_rx_block (gr.top_block):
         if plot not in self.plot_sinks:
             self.plot_sinks.append(plot)
         if self.options.terminal_type.startswith('http:'):
+            from http import my_assets
             plot.gnuplot.set_interval(_def_interval)
-            plot.gnuplot.set_output_dir(_def_file_dir)
+            plot.gnuplot.set_output_store(my_assets)
 
     def remove_plot_sink(self, plot):
         if plot in self.plot_sinks:
@@ -820,7 +872,7 @@ class p25_rx_block (gr.top_block):
             self.freq_update()
             if self.trunk_rx is None:
                 return False	## possible race cond - just ignore
-            js = self.trunk_rx.to_json()
+            js = self.trunk_rx.to_json(int(msg.arg1()))	# arg1: seq of the client's last update, 0 for all
             msg = gr.message().make_from_string(js, -4, 0, 0)
             self.input_q.insert_tail(msg)
             self.process_ajax()
@@ -915,6 +967,10 @@ class rx_main(object):
         if self.tb.audio:
             self.tb.audio.stop()
         self.tb.stop()
+        if self.tb.call_recorder:
+            self.tb.call_recorder.stop()
+        if self.tb.cdr_store:
+            self.tb.cdr_store.stop()
         for sink in self.tb.plot_sinks:
             sink.kill()
 
@@ -937,7 +993,10 @@ class rx_main(object):
         parser.add_option("-H", "--hamlib-model", type="int", default=None, help="specify model for hamlib")
         parser.add_option("-s", "--seek", type="int", default=0, help="ifile seek in K, symbols file seek in seconds")
         parser.add_option("-l", "--terminal-type", type="string", default='curses', help="'curses' or udp port or 'http:host:port'")
+        parser.add_option("-m", "--multi-site", action="store_true", default=False, help="decode the control channels of all configured systems at once")
         parser.add_option("-L", "--logfile-workers", type="int", default=None, help="number of demodulators to instantiate")
+        parser.add_option("--call-format", type="choice", default=None, choices=(None,) + call_recorder.FORMATS, help="record logfile worker calls as flac | adpcm | wav, with a json sidecar per call")
+        parser.add_option("--call-processes", type="int", default=2, help="number of processes encoding recorded calls")
         parser.add_option("-M", "--metacfg", type="string", default=None, help="Icecast Metadata Config File")
         parser.add_option("-S", "--sample-rate", type="int", default=960000, help="source samp rate")
         parser.add_option("-t", "--tone-detect", action="store_true", default=False, help="use experimental tone detect algorithm")
@@ -950,6 +1009,9 @@ class rx_main(object):
         parser.add_option("-w", "--wireshark", action="store_true", default=False, help="output data to Wireshark")
         parser.add_option("-W", "--wireshark-host", type="string", default="127.0.0.1", help="Wireshark host")
         parser.add_option("-u", "--wireshark-port", type="int", default=23456, help="Wireshark udp port")
+        parser.add_option("--xor-cache", type="string", default=None, help="file caching the phase 2 scrambling sequences across restarts (default: memory only)")
+        parser.add_option("--cdr-file", type="string", default=None, help="record call start/end events to SQLite file (see cdr.py)")
+        parser.add_option("--record-msgq", type="string", default=None, help="record trunking messages to file (see msgq_replay.py)")
         parser.add_option("-r", "--raw-symbols", type="string", default=None, help="dump decoded symbols to file")
         parser.add_option("--symbols", type="string", default="", help="playback symbols file (captured using -r)")
         parser.add_option("-R", "--rx-subdev-spec", type="subdev", default=(0, 0), help="select USRP Rx side A or B (default=A)")
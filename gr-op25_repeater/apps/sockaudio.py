@@ -28,13 +28,32 @@ import threading
 import select
 import socket
 import errno
-import struct
+import wave
+import importlib
+import numpy as np
 
 # OP25 defaults
 PCM_RATE = 8000			# audio sample rate (Hz)
 PCM_BUFFER_SIZE = 4000		# size of ALSA buffer in frames
 
 MAX_SUPERFRAME_SIZE = 320	# maximum size of incoming UDP audio buffer
+RECV_RING_SLOTS = 32		# datagrams the receive ring holds
+
+# Jitter buffer (socket_audio jitter_delay > 0)
+JITTER_MIN_DELAY = 0.04		# lowest playout delay (s)
+JITTER_MAX_DELAY = 0.3		# default highest playout delay (s), older audio is discarded
+JITTER_PCM_BUFFER_SIZE = 1600	# ALSA buffer in frames when the jitter buffer absorbs network jitter
+JITTER_WINDOW = 250		# frames of delay history for the target delay
+JITTER_MIN_FRAMES = 25		# frames of a transmission before its delays set the target
+CONCEAL_FRAMES = 5		# frames of concealment before a channel rebuffers
+CONCEAL_FADE = 0.6		# gain applied to each repeat of the last frame
+DRIFT_AVG = 256			# frames averaged for the depth the drift correction follows (~5 s)
+DRIFT_BLOCK = 50		# frames per transit minimum in the clock skew fit
+DRIFT_MIN_BLOCKS = 20		# blocks of a transmission before its fit sets the skew
+DRIFT_HORIZON = 500		# frames over which a depth offset beyond the dead band is corrected
+
+# Mixer (socket_mixer)
+DUCK_GAIN = 0.25		# gain of streams while one of higher priority is active
 
 # Debug
 LOG_AUDIO_XRUNS = True		# log audio underruns to stderr
@@ -191,9 +210,14 @@ class alsasound(object):
 		return ret
 
 	def write(self, pcm_data):
-		datalen = len(pcm_data)
+		# pcm_data is a string or a contiguous numpy array, which is passed without a copy
+		if isinstance(pcm_data, np.ndarray):
+			datalen = pcm_data.nbytes
+			c_data = c_void_p(pcm_data.ctypes.data)
+		else:
+			datalen = len(pcm_data)
+			c_data = c_char_p(pcm_data)
 		n_frames = c_ulong(datalen / self.framesize)
-		c_data = c_char_p(pcm_data)
 		ret = 0
 
 		if (self.c_pcm.value == None):
@@ -303,31 +327,451 @@ class stdout_wrapper(object):
 	def dump(self):
 		pass
 
-# Main class that receives UDP audio samples and sends them to a PCM subsystem (currently ALSA or STDOUT)
+# Sinks that measure the audio path instead of playing it: every write is
+# timed, and close() reports frames/sec, the time spent in write() and
+# the longest gap between writes (what a sound card would see as an
+# underrun).  put() does the actual output.
+class measured_sink(object):
+	name = 'measured'
+
+	def __init__(self):
+		self.device = None
+		self.channels = 2
+		self.rate = PCM_RATE
+		self.reset_stats()
+
+	def reset_stats(self):
+		self.stats = {'writes': 0, 'frames': 0, 'write_time': 0.0, 'max_write': 0.0, 'max_gap': 0.0}
+		self.first_write = None
+		self.last_write = None
+
+	def open(self, hwdev):
+		self.device = hwdev
+		return 0
+
+	def close(self):
+		sys.stderr.write('%f audio %s sink: %s\n' % (time.time(), self.name, self.stats_string()))
+		return 0
+
+	def setup(self, pcm_format, pcm_channels, pcm_rate, pcm_buffer_size):
+		self.channels = pcm_channels
+		self.rate = pcm_rate
+		return 0
+
+	def put(self, pcm_data):
+		return 0
+
+	def write(self, pcm_data):
+		t0 = time.time()
+		ret = self.put(pcm_data)
+		t1 = time.time()
+		st = self.stats
+		if self.last_write is not None:
+			st['max_gap'] = max(st['max_gap'], t0 - self.last_write)
+		else:
+			self.first_write = t0
+		self.last_write = t1
+		st['writes'] += 1
+		st['frames'] += (pcm_data.nbytes if isinstance(pcm_data, np.ndarray) else len(pcm_data)) / (2 * self.channels)
+		st['write_time'] += t1 - t0
+		st['max_write'] = max(st['max_write'], t1 - t0)
+		return ret
+
+	def drain(self):
+		return 0
+
+	def drop(self):
+		return 0
+
+	def check(self):
+		return 0
+
+	def dump(self):
+		pass
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		elapsed = (self.last_write - self.first_write) if self.first_write is not None else 0.0
+		stats['frames_per_sec'] = stats['frames'] / elapsed if elapsed > 0 else 0.0
+		stats['mean_write'] = stats['write_time'] / stats['writes'] if stats['writes'] else 0.0
+		return stats
+
+	def stats_string(self):
+		st = self.get_stats()
+		return '%d frames in %d writes, %.0f frames/sec, write latency mean %.1f us max %.1f us, max gap %.1f ms' % (
+			st['frames'], st['writes'], st['frames_per_sec'], st['mean_write'] * 1e6, st['max_write'] * 1e6, st['max_gap'] * 1e3)
+
+# Discards the audio
+class null_sink(measured_sink):
+	name = 'null'
+
+# Writes the audio to a WAV file, the device name is the file name
+class wav_sink(measured_sink):
+	name = 'wav'
+
+	def __init__(self):
+		measured_sink.__init__(self)
+		self.wav = None
+
+	def setup(self, pcm_format, pcm_channels, pcm_rate, pcm_buffer_size):
+		measured_sink.setup(self, pcm_format, pcm_channels, pcm_rate, pcm_buffer_size)
+		if pcm_format != SND_PCM_FORMAT_S16_LE.value:
+			sys.stderr.write("wav sink supports S16_LE only\n")
+			return -1
+		try:
+			self.wav = wave.open(self.device, 'wb')
+		except IOError as e:
+			sys.stderr.write("wav sink: %s\n" % e)
+			return -1
+		self.wav.setnchannels(pcm_channels)
+		self.wav.setsampwidth(2)
+		self.wav.setframerate(pcm_rate)
+		return 0
+
+	def put(self, pcm_data):
+		if self.wav is None:
+			return -1
+		if isinstance(pcm_data, np.ndarray):
+			pcm_data = buffer(pcm_data)	# no copy; len() in bytes, as wave expects
+		self.wav.writeframesraw(pcm_data)
+		return 0
+
+	def close(self):
+		if self.wav is not None:
+			self.wav.close()	# updates the header lengths
+			self.wav = None
+		return measured_sink.close(self)
+
+# pcm output backends: name -> class with the alsasound interface
+# (open, close, setup, write, drain, drop, check, dump)
+PCM_BACKENDS = {
+	'alsa': alsasound,
+	'stdout': stdout_wrapper,
+	'wav': wav_sink,
+	'null': null_sink,
+}
+
+def register_backend(name, cls):
+	PCM_BACKENDS[name] = cls
+
+def make_pcm(backend):
+	# a backend by name, or "module:class" for one outside this file
+	if backend in PCM_BACKENDS:
+		return PCM_BACKENDS[backend]()
+	if ':' in backend:
+		module, cls = backend.split(':', 1)
+		return getattr(importlib.import_module(module), cls)()
+	raise ValueError('unknown audio backend %s (one of %s or module:class)' % (backend, ', '.join(sorted(PCM_BACKENDS))))
+
+# Preallocated receive buffers: datagrams are read with recv_into into the
+# next of RECV_RING_SLOTS fixed slots of one bytearray, and their samples
+# are used in place through int16 views of the slots.  A slot is reused
+# RECV_RING_SLOTS datagrams later, so the audio has to be consumed (or
+# copied, as the jitter buffers do) by then.
+class recv_ring(object):
+	def __init__(self, slots = RECV_RING_SLOTS, size = MAX_SUPERFRAME_SIZE):
+		self.slots = slots
+		self.size = size
+		self.buf = bytearray(slots * size)
+		mv = memoryview(self.buf)
+		self.views = [mv[i * size:(i + 1) * size] for i in range(slots)]
+		self.pcm_views = np.frombuffer(self.buf, dtype='<i2').reshape(slots, size / 2)
+		self.lengths = [0] * slots
+		self.next = 0
+
+	def recv(self, sock):
+		# one datagram into the next slot; returns the slot, None if there is none
+		i = self.next
+		try:
+			self.lengths[i] = sock.recv_into(self.views[i], self.size)
+		except socket.error as e:
+			if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+				return None
+			raise
+		self.next = (i + 1) % self.slots
+		return i
+
+	def recv_batch(self, sock):
+		# the slots of every datagram waiting on sock (at most a ring full)
+		batch = []
+		while len(batch) < self.slots:
+			i = self.recv(sock)
+			if i is None:
+				break
+			batch.append(i)
+		return batch
+
+	def flag(self, i):
+		# 2 byte datagrams are flags (16 bit little endian), -1 for audio
+		if self.lengths[i] != 2:
+			return -1
+		off = i * self.size
+		return self.buf[off] + (self.buf[off + 1] << 8)
+
+	def pcm(self, i):
+		# the samples of slot i, in place
+		return self.pcm_views[i, :self.lengths[i] / 2]
+
+# Per-channel playout buffer for UDP audio arriving with network jitter.
+# Frames are queued as they arrive and get() hands out one frame of
+# frame_samples every playout period.  The transit of a frame is its
+# arrival time less the duration of the audio before it in the same
+# transmission, and its delay the transit less the lowest transit of the
+# last JITTER_WINDOW frames.  A channel starts playing once it holds the
+# target delay: the 95th percentile delay plus one frame, between
+# min_delay and max_delay.  A new transmission keeps the previous target
+# until it has JITTER_MIN_FRAMES frames of its own.  When it runs dry the
+# last frame is repeated with a fade for up to CONCEAL_FRAMES periods, then
+# it rebuffers.  Sender and playout clocks differ slightly, which shows as
+# a slope in the transits: the clock skew is the least squares slope of
+# the minimum transit of each DRIFT_BLOCK frames of a transmission, kept
+# across transmissions.  It sets the rate at which single samples are
+# dropped or repeated (at most one per frame).  On top of that, an offset
+# of the long term average depth from where the target and the mean delay
+# put it is worked off over DRIFT_HORIZON frames once it exceeds half a
+# frame, so jitter alone causes no corrections.
+class jitter_buffer(object):
+	def __init__(self, frame_samples = MAX_SUPERFRAME_SIZE / 2, rate = PCM_RATE, min_delay = JITTER_MIN_DELAY, max_delay = JITTER_MAX_DELAY):
+		self.frame_samples = frame_samples
+		self.rate = rate
+		self.min_samples = int(min_delay * rate)
+		self.max_samples = max(int(max_delay * rate), self.min_samples + 2 * frame_samples)
+		# queued samples live in a preallocated ring, put() copies into it
+		self.ring = np.zeros(self.max_samples + MAX_SUPERFRAME_SIZE, dtype='<i2')
+		self.read = 0			# ring index of the oldest queued sample
+		self.depth = 0			# samples queued
+		self.avg_depth = 0.0
+		self.transits = np.zeros(JITTER_WINDOW, dtype=np.float64)
+		self.transit_scratch = np.zeros(JITTER_WINDOW, dtype=np.float64)
+		self.n_transits = 0
+		self.mean_delay = 0.0
+		self.jitter = 0.0		# 95th percentile delay (s)
+		self.sent = None		# audio received in this transmission (s)
+		self.target = self.min_samples
+		self.playing = False
+		self.ending = False
+		self.has_last = False
+		self.concealed = 0		# consecutive concealed frames
+		self.frame = np.zeros(frame_samples, dtype='<i2')	# returned by get()
+		self.last = np.zeros(frame_samples, dtype='<i2')	# last frame played, for concealment
+		self.drift = np.zeros(frame_samples + 1, dtype='<i2')
+		self.skew = 0.0			# transit change per second of audio, > 0: sender clock slow
+		self.drift_acc = 0.0		# samples to drop (> 0) or repeat (< 0)
+		self.reset_skew_fit()
+		self.stats = {'received': 0, 'played': 0, 'concealed': 0, 'underruns': 0, 'overflows': 0,
+			'drift_drops': 0, 'drift_repeats': 0}
+
+	def reset_skew_fit(self):
+		self.fit = [0, 0.0, 0.0, 0.0, 0.0, 0.0]	# n, sum x, sum y, sum xx, sum xy, sum yy
+		self.block_min = None
+		self.block_frames = 0
+
+	def update_skew(self, transit):
+		# fit a line through the per block minimum transits
+		if self.block_min is None or transit < self.block_min:
+			self.block_min = transit
+		self.block_frames += 1
+		if self.block_frames < DRIFT_BLOCK:
+			return
+		x, y = self.sent, self.block_min
+		f = self.fit
+		f[0] += 1
+		f[1] += x
+		f[2] += y
+		f[3] += x * x
+		f[4] += x * y
+		f[5] += y * y
+		self.block_min = None
+		self.block_frames = 0
+		if f[0] < DRIFT_MIN_BLOCKS:
+			return
+		sxx = f[3] - f[1] * f[1] / f[0]
+		sxy = f[4] - f[1] * f[2] / f[0]
+		syy = f[5] - f[2] * f[2] / f[0]
+		slope = sxy / sxx
+		# a slope within the noise of the minima counts as no skew
+		se = np.sqrt(max(syy - slope * sxy, 0.0) / (f[0] - 2) / sxx)
+		self.skew = slope if abs(slope) > 2 * se else 0.0
+
+	def put(self, pcm, arrival):
+		# queue a copy of an int16 array which arrived at time arrival
+		if self.sent is None:	# transits of different transmissions don't compare
+			self.sent = 0.0
+			self.n_transits = 0
+			self.reset_skew_fit()
+		self.transits[self.n_transits % JITTER_WINDOW] = arrival - self.sent
+		self.n_transits += 1
+		self.update_skew(arrival - self.sent)
+		self.sent += len(pcm) / float(self.rate)
+		if self.n_transits >= JITTER_MIN_FRAMES:
+			self.update_target()
+		n = min(len(pcm), len(self.ring) - self.depth)
+		w = (self.read + self.depth) % len(self.ring)
+		k = min(n, len(self.ring) - w)
+		self.ring[w:w + k] = pcm[:k]
+		self.ring[:n - k] = pcm[k:n]
+		self.depth += n
+		self.ending = False
+		self.stats['received'] += 1
+		if self.depth > self.max_samples:	# bound the delay: skip ahead to the target
+			self.stats['overflows'] += 1
+			self.discard(self.depth - self.target)
+
+	def update_target(self):
+		# nearest rank percentile, partitioned in a scratch copy
+		k = min(self.n_transits, JITTER_WINDOW)
+		d = self.transit_scratch[:k]
+		d[:] = self.transits[:k]
+		d -= d.min()
+		self.mean_delay = d.mean()
+		i = min(int(k * 0.95), k - 1)
+		d.partition(i)
+		self.jitter = d[i]
+		self.target = min(max(int(self.jitter * self.rate) + self.frame_samples, self.min_samples), self.max_samples)
+
+	def end(self):
+		# end of the transmission: play out what is queued, then go idle
+		self.ending = True
+		self.sent = None
+
+	def clear(self):
+		self.read = 0
+		self.depth = 0
+		self.playing = False
+		self.ending = False
+		self.sent = None
+
+	def idle(self):
+		return not self.playing and self.depth == 0
+
+	def discard(self, n):
+		n = min(n, self.depth)
+		self.read = (self.read + n) % len(self.ring)
+		self.depth -= n
+
+	def take(self, out, n):
+		# move the next n queued samples (n <= depth) to out[:n]
+		k = min(n, len(self.ring) - self.read)
+		out[:k] = self.ring[self.read:self.read + k]
+		out[k:n] = self.ring[:n - k]
+		self.read = (self.read + n) % len(self.ring)
+		self.depth -= n
+
+	def conceal(self):
+		self.concealed += 1
+		if not self.has_last or self.concealed > CONCEAL_FRAMES:
+			self.playing = False
+			self.has_last = False
+			self.stats['underruns'] += 1
+			return None
+		self.stats['concealed'] += 1
+		np.multiply(self.last, CONCEAL_FADE ** self.concealed, out=self.frame, casting='unsafe')
+		return self.frame
+
+	def get(self):
+		# the frame to play this period, or None when the channel is silent.
+		# The array is reused by the next call.
+		n = self.frame_samples
+		h = n / 2
+		frame = self.frame
+		if not self.playing:
+			if self.depth == 0 or (self.depth < self.target and not self.ending):
+				return None
+			self.playing = True
+			self.avg_depth = max(self.depth - n, 0)
+			self.drift_acc = 0.0
+			self.concealed = 0
+		if self.depth < n:
+			if not self.ending:
+				return self.conceal()
+			# end of transmission: the rest, padded with silence
+			k = self.depth
+			self.take(frame, k)
+			frame[k:] = 0
+			self.playing = False
+			self.ending = False
+			self.has_last = False
+			self.stats['played'] += 1
+			return frame
+		# depth left after this frame, against the same measure of the
+		# target: what is left of the target delay once the frames have
+		# taken their mean delay, and half a frame on average is still
+		# under way between periods
+		self.avg_depth += (self.depth - n - self.avg_depth) / DRIFT_AVG
+		offset = self.avg_depth - (self.target - h - self.mean_delay * self.rate)
+		offset -= max(min(offset, h), -h)	# dead band
+		self.drift_acc += offset / DRIFT_HORIZON - self.skew * n
+		self.drift_acc = max(min(self.drift_acc, 2.0), -2.0)
+		if self.drift_acc >= 1.0 and self.depth > n:
+			# one sample too many: leave out the middle one
+			self.take(self.drift, n + 1)
+			frame[:h] = self.drift[:h]
+			frame[h:] = self.drift[h + 1:]
+			self.drift_acc -= 1.0
+			self.stats['drift_drops'] += 1
+		elif self.drift_acc <= -1.0 and not self.ending:
+			# one sample short: play the middle one twice
+			self.take(self.drift, n - 1)
+			frame[:h + 1] = self.drift[:h + 1]
+			frame[h + 1:] = self.drift[h:n - 1]
+			self.drift_acc += 1.0
+			self.stats['drift_repeats'] += 1
+		else:
+			self.take(frame, n)
+		self.last[:] = frame
+		self.has_last = True
+		self.concealed = 0
+		self.stats['played'] += 1
+		return frame
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['depth_ms'] = self.depth * 1000.0 / self.rate
+		stats['target_ms'] = self.target * 1000.0 / self.rate
+		stats['jitter_ms'] = self.jitter * 1000.0
+		stats['skew_ppm'] = self.skew * 1e6
+		return stats
+
+# Main class that receives UDP audio samples and sends them to a PCM subsystem (see PCM_BACKENDS)
 class socket_audio(object):
-	def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, **kwds):
+	def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, jitter_delay = 0, stats_interval = 0, backend = None, **kwds):
 		self.keep_running = True
 		self.two_channels = two_channels
 		self.audio_gain = audio_gain
 		self.dest_stdout = dest_stdout
 		self.sock_a = None
 		self.sock_b = None
-                if dest_stdout:
-			pcm_device = "stdout"
-			self.pcm = stdout_wrapper()
-		else:
-			self.pcm = alsasound()
+		self.setup_buffers(MAX_SUPERFRAME_SIZE / 2)
+		self.ring = recv_ring()
+		self.jitter = None
+		self.pcm_buffer_size = PCM_BUFFER_SIZE
+		self.stats_interval = stats_interval
+		if jitter_delay > 0:	# highest playout delay of the jitter buffers (s)
+			self.jitter = [jitter_buffer(max_delay = jitter_delay) for i in range(2)]
+			self.pcm_buffer_size = JITTER_PCM_BUFFER_SIZE
+		pcm_device = self.setup_backend(backend, pcm_device)
 		self.setup_sockets(udp_host, udp_port)
 		self.setup_pcm(pcm_device)
 
+	def setup_backend(self, backend, pcm_device):
+		# the pcm backend: by name (see PCM_BACKENDS), default ALSA or, with dest_stdout, stdout
+		if backend is None:
+			backend = 'stdout' if self.dest_stdout else 'alsa'
+		if backend == 'stdout':
+			pcm_device = "stdout"
+		self.pcm = make_pcm(backend)
+		return pcm_device
+
 	def run(self):
+		if self.jitter is not None:
+			return self.run_jitter()
 		rc = 0
 		while self.keep_running and (rc >= 0):
 			readable, writable, exceptional = select.select( [self.sock_a, self.sock_b], [], [self.sock_a, self.sock_b], 5.0)
 			in_a = None
 			in_b = None
-			data_a = ""
-			data_b = ""
+			data_a = self.no_data
+			data_b = self.no_data
 			flag_a = -1
 			flag_b = -1
 
@@ -336,26 +780,23 @@ class socket_audio(object):
  				rc = self.pcm.check()
 				continue
 
-			# Data received on the udp port is 320 bytes for an audio frame or 2 bytes for a flag
+			# Data received on the udp port is 320 bytes for an audio frame or 2 bytes for a flag.
+			# It is read into the receive ring and used from there without copies.
 			if self.sock_a in readable:
-				in_a = self.sock_a.recvfrom(MAX_SUPERFRAME_SIZE)
+				in_a = self.ring.recv(self.sock_a)
 
 			if self.sock_b in readable:
-				in_b = self.sock_b.recvfrom(MAX_SUPERFRAME_SIZE)
+				in_b = self.ring.recv(self.sock_b)
 
 			if in_a is not None:
-				len_a = len(in_a[0])
-				if len_a == 2:
-					flag_a = ord(in_a[0][0]) + (ord(in_a[0][1]) << 8)	# 16 bit little endian
-				elif len_a > 0:
-					data_a = in_a[0]
+				flag_a = self.ring.flag(in_a)
+				if flag_a < 0:
+					data_a = self.ring.pcm(in_a)
 
 			if in_b is not None:
-				len_b = len(in_b[0])
-				if len_b == 2:
-					flag_b = ord(in_b[0][0]) + (ord(in_b[0][1]) << 8)	# 16 bit little endian
-				elif len_b > 0:
-					data_b = in_b[0]
+				flag_b = self.ring.flag(in_b)
+				if flag_b < 0:
+					data_b = self.ring.pcm(in_b)
 
 			if (flag_a == 0) or (flag_b == 0):
 				rc = self.pcm.drain()
@@ -368,42 +809,166 @@ class socket_audio(object):
 				continue
 
 			if not self.two_channels:
-				data_a = self.scale(data_a)
-				rc = self.pcm.write(self.interleave(data_a, data_a))
+				rc = self.pcm.write(self.scale_interleave_into(data_a, data_a))
 			else:
-				data_a = self.scale(data_a)
-				data_b = self.scale(data_b)
-				rc = self.pcm.write(self.interleave(data_a, data_b))
+				rc = self.pcm.write(self.scale_interleave_into(data_a, data_b))
 
 		self.close_sockets()
 		self.close_pcm()
 		return
 
+	def run_jitter(self):
+		# like run(), but frames go through the jitter buffers and are
+		# played out by a local clock, one frame period at a time
+		# (input_sockets() and mix_frames() are overridden by socket_mixer)
+		rc = 0
+		socks = self.input_sockets()
+		period = self.jitter[0].frame_samples / float(PCM_RATE)
+		next_play = None
+		flush = None		# drain or drop the pcm once all channels are idle
+		next_stats = time.time() + self.stats_interval
+		while self.keep_running and (rc >= 0):
+			now = time.time()
+			timeout = 5.0 if next_play is None else max(next_play - now, 0)
+			readable, writable, exceptional = select.select(socks, [], socks, timeout)
+			now = time.time()
+			if (next_play is None) and (not readable):
+				rc = self.pcm.check()
+				continue
+
+			# Data received on the udp port is 320 bytes for an audio frame or 2 bytes for a flag
+			for i in range(len(socks)):
+				if socks[i] not in readable:
+					continue
+				for slot in self.ring.recv_batch(socks[i]):
+					flag = self.ring.flag(slot)
+					if flag == 0:
+						self.jitter[i].end()
+						flush = flush or self.pcm.drain
+					elif flag == 1:
+						self.jitter[i].clear()
+						flush = self.pcm.drop
+					elif self.ring.lengths[slot] > 2:
+						self.jitter[i].put(self.ring.pcm(slot), now)
+						flush = None
+
+			if next_play is None:
+				if all([jb.idle() for jb in self.jitter]):
+					if flush is not None:
+						rc = flush()
+						flush = None
+					continue
+				next_play = now
+			elif now - next_play > JITTER_PCM_BUFFER_SIZE / float(PCM_RATE):
+				next_play = now	# stalled for longer than the pcm buffer, don't try to catch up
+
+			while (next_play is not None) and (next_play <= now) and (rc >= 0):
+				pcm_data = self.mix_frames([jb.get() for jb in self.jitter])
+				if pcm_data is not None:
+					rc = self.pcm.write(pcm_data)
+				next_play += period
+				if all([jb.idle() for jb in self.jitter]):
+					next_play = None
+					if flush is not None:
+						rc = flush()
+						flush = None
+
+			if self.stats_interval and now >= next_stats:
+				next_stats = now + self.stats_interval
+				self.log_stats()
+
+		self.close_sockets()
+		self.close_pcm()
+		return
+
+	def input_sockets(self):
+		# one per jitter buffer
+		return [self.sock_a, self.sock_b]
+
+	def mix_frames(self, frames):
+		# one frame (or None) per channel from the jitter buffers -> pcm data, None for silence
+		frame_a, frame_b = frames
+		if self.two_channels:
+			if (frame_a is None) and (frame_b is None):
+				return None
+			return self.scale_interleave_into(frame_a if frame_a is not None else self.no_data, frame_b if frame_b is not None else self.no_data)
+		if frame_a is None:
+			return None
+		return self.scale_interleave_into(frame_a, frame_a)
+
+	def get_stats(self):
+		# jitter buffer statistics of each channel
+		if self.jitter is None:
+			return []
+		return [jb.get_stats() for jb in self.jitter]
+
+	def log_stats(self):
+		for i, stats in enumerate(self.get_stats()):
+			sys.stderr.write('%f audio channel %d: %s\n' % (time.time(), i, ' '.join(['%s %s' % (k, ('%.1f' % v) if isinstance(v, float) else v) for k, v in sorted(stats.items())])))
+
+	def setup_buffers(self, n_samples):
+		# stereo S16_LE output frame and float work area, reused for every frame
+		self.frame_buf = np.zeros((n_samples, 2), dtype='<i2')
+		self.gain_buf = np.zeros(n_samples, dtype=np.float64)
+		self.no_data = np.zeros(0, dtype='<i2')
+
+	def samples(self, data, pad = False):
+		# S16_LE byte string -> int16 array (a view, no copy); an odd
+		# trailing byte is dropped, or with pad completed with a zero byte.
+		# Arrays (from the jitter buffers) are passed through.
+		if isinstance(data, np.ndarray):
+			return data
+		if len(data) & 1:
+			data = data + chr(0) if pad else data[:-1]
+		return np.frombuffer(data, dtype='<i2')
+
+	def put_channel(self, channel, pcm):
+		# scale one channel with saturation into its column of frame_buf
+		n = len(pcm)
+		if self.audio_gain == 1.0:
+			self.frame_buf[:n, channel] = pcm
+			return n
+		g = self.gain_buf[:n]
+		np.multiply(pcm, self.audio_gain, out=g)
+		np.clip(g, -32768, 32767, out=g)
+		self.frame_buf[:n, channel] = g	# truncates toward zero like int()
+		return n
+
+	def scale_interleave(self, data_a, data_b):
+		return self.scale_interleave_into(data_a, data_b).tostring()
+
+	def scale_interleave_into(self, data_a, data_b):
+		# scale(interleave()) of one frame in a single pass: both channels
+		# are scaled straight into the preallocated stereo buffer, and a
+		# view of it is returned (valid until the next frame)
+		pcm_a = self.samples(data_a)
+		pcm_b = pcm_a if data_b is data_a else self.samples(data_b)
+		n = max(len(pcm_a), len(pcm_b))
+		if n > len(self.frame_buf):
+			self.setup_buffers(n)
+		n_a = self.put_channel(0, pcm_a)
+		if pcm_b is pcm_a:	# single channel: copy rather than scale again
+			self.frame_buf[:n_a, 1] = self.frame_buf[:n_a, 0]
+			n_b = n_a
+		else:
+			n_b = self.put_channel(1, pcm_b)
+		self.frame_buf[n_a:n, 0] = 0
+		self.frame_buf[n_b:n, 1] = 0
+		return self.frame_buf[:n]
+
 	def scale(self, data):	# crude amplitude scaler (volume) for S16_LE samples
-		scaled_data = ""
-		d_len = len(data) / 2
-		iter_d = iter(data)
-		i = 0;
-		while i < d_len:
-			i += 1
-			pcm_r = struct.unpack('<h', next(iter_d, chr(0)) + next(iter_d, chr(0)))[0]
-			pcm_s = min(max((int)(pcm_r * self.audio_gain), -32768), 32767)
-			scaled_data += struct.pack('<h', pcm_s)
-		return scaled_data
+		pcm = self.samples(data)
+		if self.audio_gain == 1.0:
+			return pcm.tostring()
+		return np.clip(pcm * self.audio_gain, -32768, 32767).astype('<i2').tostring()
 
 	def interleave(self, data_a, data_b):
-		combi_data = ""
-		d_len = max(len(data_a), len(data_b))
-		iter_a = iter(data_a)
-		iter_b = iter(data_b)
-		i = 0
-		while i < d_len:
-			i += 2
-			combi_data += next(iter_a, chr(0))
-			combi_data += next(iter_a, chr(0))
-			combi_data += next(iter_b, chr(0))
-			combi_data += next(iter_b, chr(0))
-		return combi_data
+		a = self.samples(data_a, pad = True)
+		b = self.samples(data_b, pad = True)
+		combi = np.zeros((max(len(a), len(b)), 2), dtype='<i2')
+		combi[:len(a), 0] = a
+		combi[:len(b), 1] = b
+		return combi.tostring()
 
 	def stop(self):
 		self.keep_running = False
@@ -432,7 +997,7 @@ class socket_audio(object):
 			self.keep_running = False
 			return
 
-		err = self.pcm.setup(SND_PCM_FORMAT_S16_LE.value, 2, PCM_RATE, PCM_BUFFER_SIZE)
+		err = self.pcm.setup(SND_PCM_FORMAT_S16_LE.value, 2, PCM_RATE, self.pcm_buffer_size)
 		if err < 0:
 			sys.stderr.write('failed to set up pcm stream\n')
 			self.keep_running = False
@@ -444,6 +1009,107 @@ class socket_audio(object):
 		self.pcm.close()
 		return
 
+# One input of socket_mixer: a UDP port with its jitter buffer, gain,
+# stereo position (pan -1.0 left .. 1.0 right) and priority
+class mixer_stream(object):
+	def __init__(self, port, gain = 1.0, pan = 0.0, priority = 0, jitter_delay = JITTER_MAX_DELAY):
+		self.port = port
+		self.gain = gain
+		self.pan = min(max(pan, -1.0), 1.0)
+		self.priority = priority
+		self.sock = None
+		self.buffer = jitter_buffer(max_delay = jitter_delay)
+		self.duck = 1.0		# current ducking gain
+
+	def pan_gains(self):
+		# balance law: centre plays at full level on both sides
+		return (min(1.0, 1.0 - self.pan), min(1.0, 1.0 + self.pan))
+
+def parse_streams(spec, jitter_delay = JITTER_MAX_DELAY):
+	# "port[:gain[:pan[:priority]]],..." -> list of mixer_stream
+	streams = []
+	for item in spec.split(','):
+		f = item.strip().split(':')
+		streams.append(mixer_stream(int(f[0]),
+			float(f[1]) if len(f) > 1 and f[1] else 1.0,
+			float(f[2]) if len(f) > 2 and f[2] else 0.0,
+			int(f[3]) if len(f) > 3 and f[3] else 0,
+			jitter_delay))
+	return streams
+
+# Receives UDP audio on any number of ports and mixes it into one stereo
+# PCM stream.  Every stream is played out of its own jitter buffer, and
+# once per period the frames of all active streams are mixed in one step:
+# each is scaled by its gain (ramped when ducking changes), summed into
+# left and right through the pan matrix and saturated.  Streams of lower
+# priority than the highest active one are ducked to DUCK_GAIN.
+class socket_mixer(socket_audio):
+	def __init__(self, udp_host, streams, pcm_device, audio_gain = 1.0, dest_stdout = False, stats_interval = 0, backend = None, **kwds):
+		self.keep_running = True
+		self.audio_gain = audio_gain
+		self.dest_stdout = dest_stdout
+		self.streams = streams
+		self.stats_interval = stats_interval
+		self.pcm_buffer_size = JITTER_PCM_BUFFER_SIZE
+		self.jitter = [st.buffer for st in streams]
+		self.frame_samples = self.jitter[0].frame_samples
+		self.ring = recv_ring()
+		n = self.frame_samples
+		self.pan = np.array([st.pan_gains() for st in streams], dtype=np.float64).T	# (2, N)
+		self.mix_in = np.zeros((len(streams), n), dtype=np.float64)
+		self.mix_gain = np.zeros((len(streams), n), dtype=np.float64)
+		self.mix_out = np.zeros((2, n), dtype=np.float64)
+		self.mix_pcm = np.zeros((n, 2), dtype='<i2')
+		self.ramp = np.linspace(0.0, 1.0, n, endpoint=False)
+		pcm_device = self.setup_backend(backend, pcm_device)
+		self.setup_sockets(udp_host, None)
+		self.setup_pcm(pcm_device)
+
+	def setup_sockets(self, udp_host, udp_port):
+		for st in self.streams:
+			st.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			st.sock.setblocking(0)
+			st.sock.bind((udp_host, st.port))
+		return
+
+	def close_sockets(self):
+		for st in self.streams:
+			st.sock.close()
+		return
+
+	def mix_frames(self, frames):
+		# frames: one int16 array or None per stream -> stereo S16_LE array
+		# (preallocated, valid until the next period)
+		active = [i for i in range(len(frames)) if frames[i] is not None]
+		if not active:
+			return None
+		top = max([self.streams[i].priority for i in active])
+		g = self.mix_gain
+		for i in range(len(frames)):
+			st = self.streams[i]
+			if frames[i] is None:
+				g[i] = 0.0
+				st.duck = 1.0
+				continue
+			duck = 1.0 if st.priority >= top else DUCK_GAIN
+			# ramp from the previous ducking gain over the period, no clicks
+			np.multiply(self.ramp, duck - st.duck, out=g[i])
+			g[i] += st.duck
+			g[i] *= st.gain * self.audio_gain
+			st.duck = duck
+			self.mix_in[i] = frames[i]
+		np.multiply(self.mix_in, g, out=self.mix_in)
+		np.dot(self.pan, self.mix_in, out=self.mix_out)	# (2, n)
+		np.clip(self.mix_out, -32768, 32767, out=self.mix_out)
+		self.mix_pcm[:] = self.mix_out.T
+		return self.mix_pcm
+
+	def input_sockets(self):
+		return [st.sock for st in self.streams]
+
+	def run(self):
+		return self.run_jitter()
+
 class audio_thread(threading.Thread):
 	def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, **kwds):
 		threading.Thread.__init__(self, **kwds)
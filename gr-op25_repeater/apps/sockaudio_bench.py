@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# Copyright 2017, 2018 Graham Norbury
+#
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Microbenchmark for the socket_audio frame path
+
+Scales and interleaves the same UDP audio frames with the original
+struct/string code (kept below for reference) and with the numpy code in
+sockaudio.socket_audio, checks that both give identical PCM, and reports
+the cost per frame, also for the in-place path run() takes (samples viewed
+in the receive ring, output left in the preallocated frame buffer).  A
+frame is MAX_SUPERFRAME_SIZE bytes of 8 kHz S16_LE audio, so the audio
+thread has 20 ms to handle each one.
+
+With -P the whole UDP -> PCM pipeline runs instead: the frames are sent
+over loopback to a socket_audio writing to the null or wav backend, one
+at a time, and the time from send to the end of the pcm write is
+reported along with the sink statistics.  With the wav backend the file
+written (a temporary file, removed afterwards, unless -o is given) is
+compared with the original code's output, so this doubles as a
+regression test on machines without a sound card.
+
+Every run also plays simulated network audio through a jitter_buffer:
+frames delayed by a uniformly random 10 - 120 ms, with identical sender
+and playout clocks, and then with the sender clock off by +-100 and
++-500 ppm.  Without skew the drift correction must stay nearly idle
+(it only moves the depth to the target learned after playout started).
+"""
+
+import os
+import sys
+import time
+import random
+import struct
+import socket
+import threading
+import wave
+import tempfile
+import numpy as np
+from optparse import OptionParser
+
+import sockaudio
+
+
+# original implementations, for comparison
+def legacy_scale(audio_gain, data):
+    scaled_data = ""
+    d_len = len(data) / 2
+    iter_d = iter(data)
+    i = 0
+    while i < d_len:
+        i += 1
+        pcm_r = struct.unpack('<h', next(iter_d, chr(0)) + next(iter_d, chr(0)))[0]
+        pcm_s = min(max((int)(pcm_r * audio_gain), -32768), 32767)
+        scaled_data += struct.pack('<h', pcm_s)
+    return scaled_data
+
+
+def legacy_interleave(data_a, data_b):
+    combi_data = ""
+    d_len = max(len(data_a), len(data_b))
+    iter_a = iter(data_a)
+    iter_b = iter(data_b)
+    i = 0
+    while i < d_len:
+        i += 2
+        combi_data += next(iter_a, chr(0))
+        combi_data += next(iter_a, chr(0))
+        combi_data += next(iter_b, chr(0))
+        combi_data += next(iter_b, chr(0))
+    return combi_data
+
+
+def legacy_frame(audio_gain, data_a, data_b):
+    return legacy_interleave(legacy_scale(audio_gain, data_a), legacy_scale(audio_gain, data_b))
+
+
+def make_frames(count, size, seed=0):
+    # random speech-level frames, with full scale peaks so that gain > 1 saturates
+    rnd = random.Random(seed)
+    frames = []
+    for i in xrange(count):
+        samples = [int(rnd.gauss(0, 6000)) for j in xrange(size / 2)]
+        samples[rnd.randrange(len(samples))] = 32767
+        samples[rnd.randrange(len(samples))] = -32768
+        frames.append(struct.pack('<%dh' % len(samples), *[min(max(s, -32768), 32767) for s in samples]))
+    return frames
+
+
+def new_audio(audio_gain):
+    # socket_audio without sockets or a pcm device
+    audio = sockaudio.socket_audio.__new__(sockaudio.socket_audio)
+    audio.audio_gain = audio_gain
+    audio.setup_buffers(sockaudio.MAX_SUPERFRAME_SIZE / 2)
+    return audio
+
+
+def simulate_jitter(skew, min_delay, max_delay, seconds=60.0, seed=0):
+    # one transmission through a jitter_buffer played by a perfect local
+    # clock; the sender clock runs (1 + skew) times slower
+    rnd = random.Random(seed)
+    jb = sockaudio.jitter_buffer()
+    period = jb.frame_samples / float(sockaudio.PCM_RATE)
+    n = int(seconds / period)
+    arrivals = sorted([(k * period * (1 + skew) + rnd.uniform(min_delay, max_delay), k) for k in xrange(n)])
+    pcm = np.zeros(jb.frame_samples, dtype='<i2')
+    i = 0
+    t = 0.0
+    while i < len(arrivals) or not jb.idle():
+        while i < len(arrivals) and arrivals[i][0] <= t:
+            jb.put(pcm, arrivals[i][0])
+            i += 1
+            if i == len(arrivals):
+                jb.end()
+        jb.get()
+        t += period
+    return jb.get_stats()
+
+
+def check_jitter():
+    sys.stdout.write('jitter buffer, 60 s of 10 - 120 ms uniform delay:\n')
+    for skew in (0, 1e-4, -1e-4, 5e-4, -5e-4):
+        st = simulate_jitter(skew, 0.01, 0.12)
+        corrections = st['drift_drops'] + st['drift_repeats']
+        sys.stdout.write('  skew %+5.0f ppm: %4d played, %3d drops, %3d repeats (net %+4d, clock %+4d), %2d concealed, '
+                         'est. skew %+4.0f ppm\n' % (skew * 1e6, st['played'], st['drift_drops'], st['drift_repeats'],
+                         st['drift_repeats'] - st['drift_drops'], int(round(st['played'] * sockaudio.MAX_SUPERFRAME_SIZE / 2 * skew)),
+                         st['concealed'], st['skew_ppm']))
+        if skew == 0 and (st['drift_drops'] > 0.01 * st['played'] or corrections > 0.05 * st['played']):
+            sys.stderr.write('*** drift correction active without clock skew\n')
+            sys.exit(2)
+
+
+def timed(fn, pairs, passes):
+    best = None
+    for p in xrange(passes):
+        t0 = time.time()
+        for a, b in pairs:
+            fn(a, b)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def run_pipeline(options, frames):
+    output = options.output
+    if output is None and options.backend == 'wav':
+        fd, output = tempfile.mkstemp(suffix='.wav', prefix='sockaudio_bench-')
+        os.close(fd)
+    try:
+        pipeline(options, frames, output)
+    finally:
+        if options.output is None and output is not None:
+            os.remove(output)
+
+
+def pipeline(options, frames, output):
+    audio = sockaudio.socket_audio('127.0.0.1', options.port, output, False, options.audio_gain,
+                                   backend=options.backend)
+    if not audio.keep_running:
+        sys.exit(1)
+    sink = audio.pcm
+    thread = threading.Thread(target=audio.run)
+    thread.start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dest = ('127.0.0.1', options.port)
+    latencies = []
+    t_start = time.time()
+    for k in xrange(len(frames)):
+        t0 = time.time()
+        sock.sendto(frames[k], dest)
+        while sink.stats['writes'] <= k and thread.is_alive():
+            time.sleep(0)
+        latencies.append(time.time() - t0)
+    elapsed = time.time() - t_start
+    audio.stop()
+    sock.sendto('\0\0', dest)  # end of audio, wakes up select()
+    thread.join()
+
+    latencies.sort()
+    n = len(latencies)
+    sys.stdout.write('%d datagrams through udp -> %s in %.3f s, %.0f datagrams/sec (%.0fx real time)\n' % (
+        n, options.backend, elapsed, n / elapsed, n * sockaudio.MAX_SUPERFRAME_SIZE / 2.0 / sockaudio.PCM_RATE / elapsed))
+    sys.stdout.write('send to write us: p50 %.1f  p90 %.1f  p99 %.1f  max %.1f\n' % tuple(
+        latencies[min(n - 1, int(n * p / 100.0))] * 1e6 for p in (50, 90, 99, 100)))
+    sys.stdout.write('sink: %s\n' % sink.stats_string())
+    if options.backend == 'wav':
+        w = wave.open(output, 'rb')
+        pcm = w.readframes(w.getnframes())
+        w.close()
+        if pcm != ''.join([legacy_frame(options.audio_gain, f, f) for f in frames]):
+            sys.stderr.write('*** mismatch: %s differs from the original code\'s output\n' % output)
+            sys.exit(2)
+        sys.stdout.write('%s matches the original code\'s output\n' % output)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--count", type="int", default=500, help="number of frames")
+    parser.add_option("-x", "--audio-gain", type="float", default=1.5, help="audio gain")
+    parser.add_option("-p", "--passes", type="int", default=5, help="timing passes (best is reported)")
+    parser.add_option("-P", "--pipeline", action="store_true", default=False, help="run the udp -> pcm pipeline instead")
+    parser.add_option("-b", "--backend", type="string", default="null", help="pcm backend for -P: null or wav")
+    parser.add_option("-o", "--output", type="string", default=None, help="keep the wav backend's output in this file")
+    parser.add_option("-u", "--port", type="int", default=23470, help="udp port for -P")
+    (options, args) = parser.parse_args()
+    if len(args) != 0:
+        parser.print_help()
+        sys.exit(1)
+
+    frames = make_frames(options.count, sockaudio.MAX_SUPERFRAME_SIZE)
+    if options.pipeline:
+        run_pipeline(options, frames)
+        return
+    mono = [(f, f) for f in frames]
+    stereo = zip(frames, frames[1:] + frames[:1])
+    n = len(frames)
+    audio = new_audio(options.audio_gain)
+
+    gain = options.audio_gain
+    # odd and missing frames too, scale_interleave pads the shorter channel
+    for a, b in stereo[:50] + [(frames[0], ''), ('', frames[0]), (frames[0][:101], frames[1])]:
+        if (audio.scale(a) != legacy_scale(gain, a) or audio.interleave(a, b) != legacy_interleave(a, b)
+                or audio.scale_interleave(a, b) != legacy_frame(gain, a, b)):
+            sys.stderr.write('*** mismatch: numpy frame differs from the original\n')
+            sys.exit(2)
+
+    sys.stdout.write('%d frames of %d bytes, gain %.2f\n' % (n, sockaudio.MAX_SUPERFRAME_SIZE, gain))
+    sys.stdout.write('%-10s %12s %12s %9s\n' % ('', 'old us', 'new us', 'speedup'))
+    for name, pairs in (('mono', mono), ('stereo', stereo)):
+        t_old = timed(lambda a, b: legacy_frame(gain, a, b), pairs, options.passes)
+        t_new = timed(audio.scale_interleave, pairs, options.passes)
+        sys.stdout.write('%-10s %12.1f %12.1f %8.1fx\n' % (name, t_old * 1e6 / n, t_new * 1e6 / n, t_old / t_new))
+    t_unity = timed(new_audio(1.0).scale_interleave, stereo, options.passes)
+    sys.stdout.write('%-10s %12s %12.1f %9s\n' % ('gain 1.0', '-', t_unity * 1e6 / n, '-'))
+    # what run() does: samples viewed in place, output left in the frame buffer
+    ring = [(audio.samples(a), audio.samples(b)) for a, b in stereo]
+    t_into = timed(audio.scale_interleave_into, ring, options.passes)
+    sys.stdout.write('%-10s %12s %12.1f %9s\n' % ('in place', '-', t_into * 1e6 / n, '-'))
+    sys.stdout.write('frame budget %.0f us\n' % (sockaudio.MAX_SUPERFRAME_SIZE / 2 * 1e6 / sockaudio.PCM_RATE))
+    check_jitter()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,65 +20,135 @@
 
 import numpy as np
 
+# Bit helpers shared by the TDMA tools.  Bit arrays are MSB first.  The
+# scalar functions keep their original return types (lists from the dibit
+# conversions, an np.array from mk_array, ints from mk_int) and take lists
+# or arrays; the _batch variants take and return numpy arrays with one
+# value / bit row per item.
+
+REV8 = [int('{0:08b}'.format(i)[::-1], 2) for i in xrange(256)]
+REV8_ARRAY = np.array(REV8, dtype=np.int64)
+
+# bit weights / shift counts for values of up to 63 bits
+MAX_FAST = 63
+SHIFTS = np.arange(MAX_FAST - 1, -1, -1, dtype=np.int64)
+WEIGHTS = np.left_shift(1, SHIFTS)
+
 def rev_int(n,l):
-	j=0
-	for i in xrange(l):
-		b=n&1
-		n=n>>1
-		j = (j << 1) | b
+	# reverse the order of the low l bits of n, a byte at a time
+	j = 0
+	while l >= 8:
+		j = (j << 8) | REV8[n & 0xff]
+		n >>= 8
+		l -= 8
+	if l:
+		j = (j << l) | (REV8[n & ((1 << l) - 1)] >> (8 - l))
+	return j
+
+def rev_int_batch(ns, l):
+	# rev_int of each element of an int64 array, l <= 63
+	assert l <= MAX_FAST
+	ns = np.asarray(ns, dtype=np.int64)
+	j = np.zeros(ns.shape, dtype=np.int64)
+	while l >= 8:
+		j = (j << 8) | REV8_ARRAY[ns & 0xff]
+		ns = ns >> 8
+		l -= 8
+	if l:
+		j = (j << l) | (REV8_ARRAY[ns & ((1 << l) - 1)] >> (8 - l))
 	return j
 
 def bits_to_dibits(bits):
-	d = []
-	for i in xrange(len(bits)>>1):
-		d.append((bits[i*2]<<1) + bits[i*2+1])
-	return d
+	if isinstance(bits, np.ndarray):
+		return bits_to_dibits_batch(bits[:len(bits) & ~1]).tolist()
+	# converting a short list to an array costs more than pairing it up
+	return [(b0 << 1) + b1 for b0, b1 in zip(bits[0::2], bits[1::2])]
+
+def bits_to_dibits_batch(bits):
+	# pairs of bits along the last axis -> dibits
+	bits = np.asarray(bits)
+	return (bits[..., 0::2] << 1) + bits[..., 1::2]
+
+DIBIT_BITS = [(0, 0), (0, 1), (1, 0), (1, 1)]
 
 def dibits_to_bits(dibits):
-	b = []
-	for d in dibits:
-		b.append((d>>1)&1)
-		b.append(d&1)
-	return b
+	if isinstance(dibits, np.ndarray):
+		return dibits_to_bits_batch(dibits).tolist()
+	return [b for d in dibits for b in DIBIT_BITS[d & 3]]
+
+def dibits_to_bits_batch(dibits):
+	# dibits along the last axis -> interleaved (high, low) bits
+	dibits = np.asarray(dibits, dtype=np.int64)
+	return ((dibits[..., np.newaxis] >> np.array([1, 0])) & 1).reshape(dibits.shape[:-1] + (-1,))
 
 def mk_array(n, l):
-	a = []
-	for i in xrange(0,l):
-		a.insert(0, n & 1)
-		n = n >> 1
-	return np.array(a)
+	n = int(n) & ((1 << l) - 1)
+	if l <= MAX_FAST:
+		return (n >> SHIFTS[MAX_FAST - l:]) & 1
+	nbytes = (l + 7) >> 3
+	a = np.unpackbits(np.frombuffer(('%0*x' % (nbytes * 2, n)).decode('hex'), dtype=np.uint8))
+	return a[nbytes * 8 - l:].astype(np.int64)
+
+def mk_array_batch(ns, l):
+	# mk_array of each element of an int64 array; returns an (N, l) array
+	assert l <= MAX_FAST
+	ns = np.asarray(ns, dtype=np.int64).reshape(-1, 1)
+	return (ns >> SHIFTS[MAX_FAST - l:]) & 1
 
 def mk_int(a):
-	res= 0
-	for i in xrange(0, len(a)):
-		res = res * 2
-		res = res + (a[i] & 1)
-	return res
+	a = np.asarray(a)
+	l = len(a)
+	if l == 0:
+		return 0
+	if l <= MAX_FAST:
+		return int(np.dot(a & 1, WEIGHTS[MAX_FAST - l:]))
+	bits = np.concatenate((np.zeros((-l) & 7, dtype=np.uint8), (a & 1).astype(np.uint8)))
+	return int(np.packbits(bits).tostring().encode('hex'), 16)
+
+def mk_int_batch(a):
+	# mk_int of each row of an (N, l) bit array, l <= 63; returns an int64 array
+	a = np.asarray(a)
+	l = a.shape[-1]
+	assert l <= MAX_FAST
+	return (a & 1).astype(np.int64).dot(WEIGHTS[MAX_FAST - l:])
+
+POPCOUNT8 = np.array([bin(i).count('1') for i in xrange(256)], dtype=np.int64)
+
+def popcount(a):
+	# number of set bits of each element of an int64 array
+	a = np.ascontiguousarray(a, dtype=np.int64)
+	return POPCOUNT8[a.view(np.uint8)].reshape(a.shape + (8,)).sum(axis=-1)
 
 def mk_str(a):
-	return ''.join(['%s' % (x&1) for x in a])
+	if len(a) == 0:
+		return ''
+	return ((np.asarray(a) & 1).astype(np.uint8) + ord('0')).tostring()
 
 def check_l(a,b):
-	ans = 0
 	assert len(a) == len(b)
+	if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+		return int(np.count_nonzero(np.asarray(a) == np.asarray(b)))
+	ans = 0
 	for i in xrange(len(a)):
 		if (a[i] == b[i]):
 			ans += 1
 	return ans
 
 def fixup(a):
-	res = []
-	for c in a:
-		if c == 3:
-			res.append(1)
-		else:	# -3
-			res.append(3)
-
-	return res
+	# symbol +3 -> dibit 1, -3 -> dibit 3
+	return np.where(np.asarray(a) == 3, 1, 3).tolist()
 
 def find_sym(pattern, symbols):
-	for i in xrange(0, len(symbols)-len(pattern)):
-		chunk = symbols[i : i + len(pattern)]
-		if chunk == pattern:
-			return i
+	# first position of pattern in symbols (the last possible position is
+	# not tried), -1 if there is none
+	n = len(symbols) - len(pattern)
+	if n <= 0:
+		return -1
+	if len(pattern) == 0:
+		return 0
+	symbols = np.asarray(symbols)
+	pattern = np.asarray(pattern)
+	for i in np.flatnonzero(symbols[:n] == pattern[0]):
+		if np.array_equal(symbols[i:i + len(pattern)], pattern):
+			return int(i)
 	return -1
@@ -0,0 +1,180 @@
+#! /usr/bin/python
+
+# P25 TDMA Decoder (C) Copyright 2013 KA1RBI
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Microbenchmark for bit_utils
+
+Runs the original pure python bit helpers (kept below for reference), the
+numpy versions in bit_utils and, where there is one, the _batch variant
+over the same random inputs, checks that all of them give the same
+results and reports microseconds per call (per item for the batch
+variants).
+"""
+
+import sys
+import time
+import random
+import numpy as np
+from optparse import OptionParser
+
+import bit_utils
+
+# original implementations, for comparison
+def legacy_rev_int(n,l):
+	j=0
+	for i in xrange(l):
+		b=n&1
+		n=n>>1
+		j = (j << 1) | b
+	return j
+
+def legacy_bits_to_dibits(bits):
+	d = []
+	for i in xrange(len(bits)>>1):
+		d.append((bits[i*2]<<1) + bits[i*2+1])
+	return d
+
+def legacy_dibits_to_bits(dibits):
+	b = []
+	for d in dibits:
+		b.append((d>>1)&1)
+		b.append(d&1)
+	return b
+
+def legacy_mk_array(n, l):
+	a = []
+	for i in xrange(0,l):
+		a.insert(0, n & 1)
+		n = n >> 1
+	return np.array(a)
+
+def legacy_mk_int(a):
+	res= 0
+	for i in xrange(0, len(a)):
+		res = res * 2
+		res = res + (a[i] & 1)
+	return res
+
+def legacy_check_l(a,b):
+	ans = 0
+	assert len(a) == len(b)
+	for i in xrange(len(a)):
+		if (a[i] == b[i]):
+			ans += 1
+	return ans
+
+def timed(fn, args, passes):
+	# best time of passes runs of fn over every argument tuple
+	best = None
+	for p in xrange(passes):
+		t0 = time.time()
+		for a in args:
+			fn(*a)
+		t = time.time() - t0
+		if best is None or t < best:
+			best = t
+	return best
+
+def timed_batch(fn, args, passes):
+	best = None
+	for p in xrange(passes):
+		t0 = time.time()
+		fn(*args)
+		t = time.time() - t0
+		if best is None or t < best:
+			best = t
+	return best
+
+def same(a, b):
+	return np.array_equal(np.asarray(a), np.asarray(b))
+
+def kind(x):
+	# the original mk_int returns a numpy int for array input, the new one
+	# a python int; only lists vs arrays matter to the callers
+	if isinstance(x, (list, np.ndarray)):
+		return type(x)
+	return int
+
+def main():
+	parser = OptionParser()
+	parser.add_option("-n", "--count", type="int", default=2000, help="number of inputs per function")
+	parser.add_option("-l", "--length", type="int", default=44, help="bits per value (<= 63 for the batch variants)")
+	parser.add_option("-d", "--dibits", type="int", default=180, help="dibits per burst for the dibit conversions")
+	parser.add_option("-p", "--passes", type="int", default=5, help="timing passes (best is reported)")
+	(options, args) = parser.parse_args()
+	if len(args) != 0:
+		parser.print_help()
+		sys.exit(1)
+
+	rnd = random.Random(0)
+	n, l = options.count, options.length
+	values = [int(rnd.getrandbits(l)) for i in xrange(n)]
+	bit_rows = [legacy_mk_array(v, l) for v in values]
+	if l > bit_utils.MAX_FAST:
+		# the original mk_int overflows on numpy arrays of more than 63 bits
+		bit_rows = [a.tolist() for a in bit_rows]
+	bursts = [[rnd.randrange(4) for j in xrange(options.dibits)] for i in xrange(n)]
+	burst_bits = [legacy_dibits_to_bits(b) for b in bursts]
+	batch = l <= bit_utils.MAX_FAST
+	values_a = np.array(values, dtype=np.int64) if batch else None
+	bits_a = np.array(bit_rows)
+	bursts_a = np.array(bursts)
+	burst_bits_a = np.array(burst_bits)
+
+	# (name, original, numpy version, argument tuples, batch variant, batch arguments)
+	tests = [
+		('rev_int', legacy_rev_int, bit_utils.rev_int, [(v, l) for v in values],
+			bit_utils.rev_int_batch if batch else None, (values_a, l)),
+		('mk_array', legacy_mk_array, bit_utils.mk_array, [(v, l) for v in values],
+			bit_utils.mk_array_batch if batch else None, (values_a, l)),
+		('mk_int', legacy_mk_int, bit_utils.mk_int, [(a,) for a in bit_rows],
+			bit_utils.mk_int_batch if batch else None, (bits_a,)),
+		('bits_to_dibits', legacy_bits_to_dibits, bit_utils.bits_to_dibits, [(b,) for b in burst_bits],
+			bit_utils.bits_to_dibits_batch, (burst_bits_a,)),
+		('dibits_to_bits', legacy_dibits_to_bits, bit_utils.dibits_to_bits, [(b,) for b in bursts],
+			bit_utils.dibits_to_bits_batch, (bursts_a,)),
+		('check_l', legacy_check_l, bit_utils.check_l, [(bursts[i], bursts[i - 1]) for i in xrange(n)],
+			None, None),
+	]
+
+	sys.stdout.write('%d inputs, %d bit values, %d dibit bursts\n' % (n, l, options.dibits))
+	sys.stdout.write('%-16s %10s %10s %10s %9s %9s\n' % ('', 'old us', 'new us', 'batch us', 'new x', 'batch x'))
+	for name, old_fn, new_fn, fn_args, batch_fn, batch_args in tests:
+		old = [old_fn(*a) for a in fn_args]
+		new = [new_fn(*a) for a in fn_args]
+		if not all(same(o, r) and kind(o) == kind(r) for o, r in zip(old, new)):
+			sys.stderr.write('*** %s mismatch: numpy result differs from the original\n' % name)
+			sys.exit(2)
+		t_old = timed(old_fn, fn_args, options.passes)
+		t_new = timed(new_fn, fn_args, options.passes)
+		if batch_fn is not None:
+			if not same(batch_fn(*batch_args), old):
+				sys.stderr.write('*** %s mismatch: batch result differs from the original\n' % name)
+				sys.exit(2)
+			t_batch = timed_batch(batch_fn, batch_args, options.passes)
+			sys.stdout.write('%-16s %10.2f %10.2f %10.3f %8.1fx %8.1fx\n' % (name, t_old * 1e6 / n,
+				t_new * 1e6 / n, t_batch * 1e6 / n, t_old / t_new, t_old / t_batch))
+		else:
+			sys.stdout.write('%-16s %10.2f %10.2f %10s %8.1fx %9s\n' % (name, t_old * 1e6 / n,
+				t_new * 1e6 / n, '-', t_old / t_new, '-'))
+
+if __name__ == '__main__':
+	main()
@@ -30,6 +30,14 @@ def extract_duid(b):
 	va = mk_array(v, 8)
 	return mk_str(va)
 
+def duid_value(b):
+	return (b[10] << 6) + (b[47] << 4) + (b[132] << 2) + b[169]
+
+def duid_values(bursts):
+	# extract_duid over an (N, 180) array of bursts, as 8 bit ints
+	b = np.asarray(bursts, dtype=np.int64).reshape(-1, 180)
+	return (b[:, 10] << 6) + (b[:, 47] << 4) + (b[:, 132] << 2) + b[:, 169]
+
 def mk_duid_lookup():
 	duid_map = {}
 	g = np.array(np.mat('1 0 0 0 1 1 0 1; 0 1 0 0 1 0 1 1; 0 0 1 0 1 1 1 0; 0 0 0 1 0 1 1 1'))
@@ -49,10 +57,30 @@ class p25p2_duid(object):
 		self.duid_str[15] = "facch w/o"
 
 		self.duid_map = mk_duid_lookup()
+		# nearest codeword and its distance for every received value.  The
+		# codewords are 4 bits apart: one bit error is corrected, values
+		# two bits from more than one codeword are left unknown (-1).
+		codewords = [int(c, 2) for c in self.duid_map]
+		self.duid_table = np.empty(256, dtype=np.int64)
+		self.duid_errors = np.empty(256, dtype=np.int64)
+		for v in xrange(256):
+			dist = sorted([(bin(v ^ c).count('1'), self.duid_map[mk_str(mk_array(c, 8))]) for c in codewords])
+			if dist[0][0] > 1:
+				self.duid_table[v], self.duid_errors[v] = -1, -1
+			else:
+				self.duid_table[v], self.duid_errors[v] = dist[0][1], dist[0][0]
+		self.duid_names = [self.duid_str.get(self.duid_table[v], 'unknown' + mk_str(mk_array(v, 8))) for v in xrange(256)]
 
 	def decode_duid(self, burst):
-		try:
-			b = self.duid_str[self.duid_map[extract_duid(burst)]]
-		except:	# FIXME: find closest matching codeword
-			b = 'unknown' + extract_duid(burst)
-		return b
+		return self.duid_names[duid_value(burst)]
+
+	def decode_duid_errors(self, burst):
+		# decode_duid and the number of bits corrected (-1 if unknown)
+		v = duid_value(burst)
+		return self.duid_names[v], self.duid_errors[v]
+
+	def decode_duid_batch(self, bursts):
+		# decode_duid_errors over an (N, 180) array of bursts; returns the
+		# list of burst types and the errors array
+		v = duid_values(bursts)
+		return [self.duid_names[x] for x in v], self.duid_errors[v]
@@ -33,9 +33,25 @@ def mk_isch(v):
 	v5 = v & 3
 	return v4, v3, v2, v1
 
+SYNC0 = 0x575d57f7ff
+# the codewords (and sync) are at least 14 bits apart
+ISCH_MAX_ERRORS = 6
+
+def isch_values(syms):
+	# 40 bit words of an (N, 20) array of ISCH dibits
+	syms = np.asarray(syms, dtype=np.int64).reshape(-1, 20) & 3
+	return (syms << np.arange(38, -2, -2)).sum(axis=1)
+
 class p25p2_isch(object):
 	def __init__(self):
 		self.isch_map = self.mk_isch_lookup()
+		# codeword of each isch value, with sync as value 128
+		self.isch_codewords = [0] * 129
+		for k in self.isch_map:
+			self.isch_codewords[self.isch_map[k]] = int(k, 16)
+		self.isch_codewords[128] = SYNC0
+		self.isch_index = dict([(c, i) for i, c in enumerate(self.isch_codewords)])
+		self.isch_codeword_array = np.array(self.isch_codewords, dtype=np.int64)
 
 	def mk_isch_lookup(self):
 		isch_map = {}
@@ -47,14 +63,37 @@ class p25p2_isch(object):
 		return isch_map
 
 	def decode_isch(self, syms):
-		sync0 = 0x575d57f7ff
-		v = mk_int(dibits_to_bits(syms))
-		vp = '%x' % v
-		isch = 'unknown'
-		if v == sync0:
-			return -2, -2, -2, -2
-		if vp in self.isch_map:
-			chn,loc,fr,cnt = mk_isch(self.isch_map[vp])
-			return chn, loc, fr, cnt
-		# FIXME: if bit error(s), locate closest matching codeword
-		return -1, -1, -1, -1
+		return self.decode_isch_errors(syms)[:4]
+
+	def decode_isch_errors(self, syms):
+		# chn, loc, fr, cnt of the closest codeword and the number of bits
+		# corrected; all -2 for sync, all -1 if no codeword is close enough
+		v = 0
+		for d in syms:
+			v = (v << 2) | (d & 3)
+		i = self.isch_index.get(v)
+		errors = 0
+		if i is None:
+			dist = [bin(v ^ c).count('1') for c in self.isch_codewords]
+			errors = min(dist)
+			if errors > ISCH_MAX_ERRORS:
+				return -1, -1, -1, -1, -1
+			i = dist.index(errors)
+		if i == 128:
+			return -2, -2, -2, -2, errors
+		chn,loc,fr,cnt = mk_isch(i)
+		return chn, loc, fr, cnt, errors
+
+	def decode_isch_batch(self, syms):
+		# decode_isch_errors over an (N, 20) array of dibits; returns chn,
+		# loc, fr, cnt and errors arrays
+		v = isch_values(syms)
+		dist = popcount(v[:, np.newaxis] ^ self.isch_codeword_array)
+		i = dist.argmin(axis=1)
+		errors = dist[np.arange(len(v)), i]
+		result = list(mk_isch(i))
+		for a in result:
+			a[i == 128] = -2
+			a[errors > ISCH_MAX_ERRORS] = -1
+		errors[errors > ISCH_MAX_ERRORS] = -1
+		return result + [errors]
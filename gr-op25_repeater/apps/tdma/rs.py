@@ -1,4 +1,6 @@
 
+import numpy as np
+
 gly23127DecTbl = [
 	0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 147459, 
 	1, 2, 2, 3, 2, 3, 3, 4268035, 2, 3, 3, 1574915, 3, 2097155, 294915, 4099, 
@@ -129,16 +131,24 @@ gly23127DecTbl = [
 	4718595, 16387, 16387, 16386, 1048579, 2138115, 65539, 16387, 2099203, 69635, 1343491, 16387, 131075, 262147, 4206595, 526339, 
 	1048579, 69635, 141315, 16387, 1048578, 1048579, 1048579, 4456451, 69635, 69634, 524291, 69635, 1048579, 69635, 2113539, 163843 ]
 
-def gly23127GetSyn (pattern) :
+def gly23127Rem (hi) :
+  # (hi * x^11) mod g for a 12 bit hi, one bit at a time
+  pattern = hi << 11
   aux = 0x400000
-
   while(pattern & 0xFFFFF800) != 0 :
     while (aux & pattern) == 0:
       aux = aux >> 1
-    pattern = pattern ^ (aux / 0x800 * 0xC75) #generator is C75
-
+    pattern = pattern ^ ((aux >> 11) * 0xC75) #generator is C75
   return pattern
 
+# syndrome of a 23 bit word = gly23127RemTbl[word >> 11] ^ (word & 0x7FF)
+gly23127RemTbl = [gly23127Rem(hi) for hi in xrange(4096)]
+gly23127RemArr = np.array(gly23127RemTbl, dtype=np.int64)
+gly23127DecArr = np.array(gly23127DecTbl, dtype=np.int64)
+
+def gly23127GetSyn (pattern) :
+  return gly23127RemTbl[pattern >> 11] ^ (pattern & 0x7FF)
+
 def gly23127Dec (CW) :
   correction = gly23127DecTbl[gly23127GetSyn(CW)]
   CW = (CW ^ correction) >> 11
@@ -152,3 +162,12 @@ def gly24128Dec (n) :
   correction = gly23127DecTbl[gly23127GetSyn(CW)]
   CW = (CW ^ correction) >> 11
   return CW, correction
+
+def gly23127DecBatch (CW) :
+  # gly23127Dec over a numpy array of codewords
+  CW = np.asarray(CW, dtype=np.int64)
+  correction = gly23127DecArr[gly23127RemArr[CW >> 11] ^ (CW & 0x7FF)]
+  return (CW ^ correction) >> 11, correction
+
+def gly24128DecBatch (n) :
+  return gly23127DecBatch(np.asarray(n, dtype=np.int64) >> 1)
@@ -27,7 +27,9 @@ After FEC decoding, print the resulting "B" vectors (49 bits per CW).
 Optionally, dump the timeslot info (type, position, type of content)
 
 The input file must contain the demodulated symbols, one per character
-using the low-order two bits of each byte
+using the low-order two bits of each byte.  It is memory-mapped and
+decoded one superframe at a time, so captures of any size stream through
+in bounded memory.
 """
 
 import sys
@@ -38,9 +40,54 @@ from bit_utils import *
 import isch
 import duid
 import lfsr
-from vf import process_v
+from vf import decode_vcw_batch
 
 SUPERFRAME_LEN = 2160
+BURST_LEN = 180
+SYNC_SEARCH_CHUNK = 1 << 20
+
+# voice codewords of a 2v / 4v burst: (start, 36 dibits)
+VCW_OFFSETS = {'2v': (11, 48), '4v': (11, 48, 96, 133)}
+
+def find_sync(symbols, pattern, start=0):
+	# first position >= start where the dibit pattern occurs, or -1.
+	# Candidates matching the first dibit are narrowed down one dibit
+	# at a time, a chunk of the file at a time.
+	pattern = np.array(pattern, dtype=np.uint8)
+	n = len(pattern)
+	for chunk in xrange(start, len(symbols) - n, SYNC_SEARCH_CHUNK):
+		end = min(chunk + SYNC_SEARCH_CHUNK, len(symbols) - n)
+		cand = np.nonzero((symbols[chunk:end] & 3) == pattern[0])[0] + chunk
+		for k in xrange(1, n):
+			cand = cand[(symbols[cand + k] & 3) == pattern[k]]
+		if len(cand):
+			return int(cand[0])
+	return -1
+
+def superframes(symbols, start):
+	# (offset, ISCH dibits (12, 20), bursts (12, 180)) of every complete
+	# superframe, read from the symbol file one superframe at a time
+	for i in xrange(start, len(symbols) - SUPERFRAME_LEN - 10 + 1, SUPERFRAME_LEN):
+		sf = symbols[i: i + SUPERFRAME_LEN + 10] & 3
+		isch_syms = np.lib.stride_tricks.as_strided(sf, shape=(12, 20),
+			strides=(BURST_LEN * sf.strides[0], sf.strides[0]))
+		yield i, isch_syms, sf[10:].reshape(12, BURST_LEN)
+
+def voice_bits(bursts, btypes):
+	# (N, 72) bit array of the voice codewords in the descrambled bursts
+	vcws = []
+	for j in xrange(len(btypes)):
+		for start in VCW_OFFSETS.get(btypes[j], ()):
+			vcws.append(bursts[j, start:start + 36])
+	if not vcws:
+		return None
+	d = np.array(vcws, dtype=np.int64)
+	return dibits_to_bits_batch(d).reshape(-1, 72)
+
+def corrected(errors):
+	if errors > 0:
+		return ' (%d bits corrected)' % errors
+	return ''
 
 def main():
         parser = OptionParser()
@@ -58,58 +105,52 @@ def main():
 	my_isch = isch.p25p2_isch()
 	my_duid = duid.p25p2_duid()
 	my_lfsr = lfsr.p25p2_lfsr(options.nac, options.sysid, options.wacn)
+	xorsyms = np.array(my_lfsr.xorsyms, dtype=np.uint8).reshape(12, BURST_LEN)
 	#print 'nac: %d' % options.nac
 
-	d = open(file).read()
-
-	symbols = []
-	for c in d:
-		symbols.append(ord(c))
+	symbols = np.memmap(file, dtype=np.uint8, mode='r')
 
 	sync0= bits_to_dibits(mk_array(0x575d57f7ff,40))
-	sync_start = find_sym(sync0, symbols)
+	sync_start = find_sync(symbols, sync0)
 	assert sync_start > 0	# unable to locate any sync sequence
 	superframe = -1
-	for i in xrange(sync_start, sync_start + (180*32), 180):
-		chn, loc, fr, cnt = my_isch.decode_isch ( symbols [ i : i + 20 ])
-		if chn == 0 and loc == 0:
-			superframe = i
-			break
+	i = np.arange(sync_start, sync_start + (180*32), 180)
+	i = i[i + 20 <= len(symbols)]
+	chn, loc, fr, cnt, isch_errors = my_isch.decode_isch_batch(symbols[i[:, np.newaxis] + np.arange(20)] & 3)
+	found = np.nonzero((chn == 0) & (loc == 0))[0]
+	if len(found):
+		superframe = int(i[found[0]])
 	assert superframe > 0	# unable to locate start of superframe
 
 	errors = 0
-	for i in xrange(superframe,len(symbols)-SUPERFRAME_LEN,SUPERFRAME_LEN):
-		syms1 = symbols[i + 10: i + SUPERFRAME_LEN + 10]
-		syms2 = np.array(syms1) ^ my_lfsr.xorsyms
+	for i, isch_syms, bursts in superframes(symbols, superframe):
+		bursts_d = bursts ^ xorsyms
+		chn, loc, fr, cnt, isch_errors = my_isch.decode_isch_batch(isch_syms)
+		btypes, duid_errors = my_duid.decode_duid_batch(bursts)
+		vbits = voice_bits(bursts_d, btypes)
+		if vbits is not None:
+			b = iter(decode_vcw_batch(vbits).tolist())
 		for j in xrange(12):
 			if options.verbose:
 				print '%s superframe %d timeslot %d %s' % ('=' * 20, i, j, '=' * 20)
-			chn, loc, fr, cnt = my_isch.decode_isch ( symbols [ i + (j*180) : i + (j*180) + 20 ])
-			if chn == -1:
+			if chn[j] == -1:
 				if options.verbose:
 					print 'unknown isch codeword at %d' % (i + (j*180))
 				errors += 1
-			elif chn == -2:
+			elif chn[j] == -2:
 				if options.verbose:
 					print 'sync isch codeword found at %d' % (i + (j*180))
 				errors = 0
 			else:
 				if options.verbose:
-					print "channel %d loc %d fr %d count %d" % (chn, loc, fr, cnt)
+					print "channel %d loc %d fr %d count %d%s" % (chn[j], loc[j], fr[j], cnt[j], corrected(isch_errors[j]))
 				errors = 0
 
-			burst = syms1 [ (j*180) : (j*180) + 180 ]
-			burst_d= syms2 [ (j*180) : (j*180) + 180 ]
-			btype = my_duid.decode_duid(burst)
+			btype = btypes[j]
 			if options.verbose:
-				print 'burst at %d type %s' % (i + (j*180), btype)
-			if btype == '2v' or btype == '4v':
-				process_v(burst_d, btype)
-			elif not btype.startswith('unknown'):
-				maybe_sync = burst[79:79+21]
-				if btype.endswith(' w'):	# scrambled
-					burst = burst_d
-				# process_oemi(burst, btype)
+				print 'burst at %d type %s%s' % (i + (j*180), btype, corrected(duid_errors[j]))
+			for start in VCW_OFFSETS.get(btype, ()):
+				print "\t".join(['%s' % x for x in next(b)])
 		if errors > 6:
 			if options.verbose:
 				print "too many successive errors, exiting at i=%d" % (i)
@@ -22,43 +22,55 @@ import sys
 import numpy as np
 
 from bit_utils import *
-from rs import gly23127Dec, gly24128Dec
+from rs import gly23127Dec, gly24128Dec, gly23127DecBatch, gly24128DecBatch
 
 def process_vcw(vf):
-	c0, c1, c2, c3 = extract_vcw(vf)
-	c0 = mk_int(c0)
-	c0 = rev_int(c0, 24)
-	c1 = mk_int(c1)
-	c1 = rev_int(c1, 23)
-	c2 = mk_int(c2)
-	c2 = rev_int(c2, 11)
-	c3 = mk_int(c3)
-	c3 = rev_int(c3, 14)
-	u0, correction0 = gly24128Dec(c0)
-	pr = [0] * 24
-	m1 = [0] * 23
-	pr[0] = 16 * u0
-	for n in xrange(1,24):
-		pr[n] = (173*pr[n-1] + 13849) - 65536 * int((173*pr[n-1]+13849)/65536)
-		m1[n-1] = int(pr[n] / 32768) & 1
-	m1 = mk_int(m1)
-	
-	u1, correction1 = gly23127Dec(c1 ^ m1)
-	u2 = c2
-	u3 = c3
-	b = [0] * 9
-	b[0] = ((u0 >> 5) & 0x78) + ((u3 >> 9) & 0x7)
-	b[1] = ((u0 >> 3) & 0x1e) + ((u3 >> 13) & 0x1)
-	b[2] = ((u0 << 1) & 0x1e) + ((u3 >> 12) & 0x1)
-	b[3] = ((u1 >> 3) & 0x1fe) + ((u3 >> 8) & 0x1)
-	b[4] = ((u1 << 3) & 0x78) + ((u3 >> 5) & 0x7)
-	b[5] = ((u2 >> 6) & 0x1e) + ((u3 >> 4) & 0x1)
-	b[6] = ((u2 >> 3) & 0x0e) + ((u3 >> 3) & 0x1)
-	b[7] = ( u2       & 0x0e) + ((u3 >> 2) & 0x1)
-	b[8] = ((u2 << 2) & 0x04) + ( u3       & 0x3)
-	s = "\t".join(['%s' % x for x in b])
+	s = "\t".join(['%s' % x for x in decode_vcw(vf)])
 	print "%s" % s
 
+def mk_m1(u0):
+	# c1 scrambling mask, seeded from u0
+	pr = 16 * u0
+	m1 = 0
+	for n in xrange(23):
+		pr = (173*pr + 13849) & 0xffff
+		m1 = (m1 << 1) | (pr >> 15)
+	return m1
+
+def mk_b(u0, u1, u2, u3):
+	# works on ints and on numpy arrays alike
+	return [((u0 >> 5) & 0x78) + ((u3 >> 9) & 0x7),
+		((u0 >> 3) & 0x1e) + ((u3 >> 13) & 0x1),
+		((u0 << 1) & 0x1e) + ((u3 >> 12) & 0x1),
+		((u1 >> 3) & 0x1fe) + ((u3 >> 8) & 0x1),
+		((u1 << 3) & 0x78) + ((u3 >> 5) & 0x7),
+		((u2 >> 6) & 0x1e) + ((u3 >> 4) & 0x1),
+		((u2 >> 3) & 0x0e) + ((u3 >> 3) & 0x1),
+		( u2       & 0x0e) + ((u3 >> 2) & 0x1),
+		((u2 << 2) & 0x04) + ( u3       & 0x3)]
+
+def decode_vcw(vf):
+	# the 9 "B" values of one 72 bit voice codeword
+	c0, c1, c2, c3 = vcw_ints(vf)
+	u0, correction0 = gly24128Dec(c0)
+	u1, correction1 = gly23127Dec(c1 ^ M1_TABLE[u0])
+	return mk_b(u0, u1, c2, c3)
+
+def decode_vcw_batch(vfs):
+	# decode_vcw over an (N, 72) bit array; returns an (N, 9) array
+	c0, c1, c2, c3 = vcw_ints_batch(vfs)
+	u0, correction0 = gly24128DecBatch(c0)
+	u1, correction1 = gly23127DecBatch(c1 ^ M1_ARRAY[u0])
+	return np.array(mk_b(u0, u1, c2, c3)).T
+
+def vcw_ints(vf):
+	# extract_vcw with each part packed into an int, first bit lowest
+	return [sum([vf[src[k]] << k for k in xrange(len(src))]) for src in VCW_SRC]
+
+def vcw_ints_batch(vfs):
+	vfs = np.asarray(vfs, dtype=np.int64).reshape(-1, 72)
+	return [(vfs[:, src] << np.arange(len(src))).sum(axis=1) for src in VCW_SRC]
+
 def process_v(f,type):
 	vf = dibits_to_bits(f[11:11+36])
 	process_vcw(vf)
@@ -151,3 +163,9 @@ def extract_vcw(vf):
 	c3[0] = vf[71]
 
 	return c0, c1, c2, c3
+
+# position in the voice frame of every bit of c0 .. c3
+VCW_SRC = [list(c) for c in extract_vcw(range(72))]
+
+M1_TABLE = [mk_m1(u0) for u0 in xrange(4096)]
+M1_ARRAY = np.array(M1_TABLE, dtype=np.int64)
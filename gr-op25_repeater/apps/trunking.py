@@ -20,9 +20,17 @@
 
 import sys
 import array
+import traceback
 import time
+import threading
+import bisect
+import heapq
 import collections
+import itertools
 import json
+import numpy as np
+
+from checksum import crc16
 
 sys.path.append('tdma')
 sys.path.append('/home/pi/op25/gr-op25_repeater/apps/tdma')
@@ -33,20 +41,6 @@ def utf_ascii(ustr):
     return (ustr.decode("utf-8")).encode("ascii", "ignore")
 
 
-def crc16(dat, len):  # slow version
-    poly = (1 << 12) + (1 << 5) + (1 << 0)
-    crc = 0
-    for i in range(len):
-        bits = (dat >> (((len - 1) - i) * 8)) & 0xff
-        for j in range(8):
-            bit = (bits >> (7 - j)) & 1
-            crc = ((crc << 1) | bit) & 0x1ffff
-            if crc & 0x10000:
-                crc = (crc & 0xffff) ^ poly
-    crc = crc ^ 0xffff
-    return crc
-
-
 def get_frequency(f):  # return frequency in Hz
     if f.find('.') == -1:  # assume in Hz
         return int(f)
@@ -54,16 +48,129 @@ def get_frequency(f):  # return frequency in Hz
         return int(float(f) * 1000000)
 
 
+class sorted_dict(dict):
+    # dict iterated in key order; new keys are placed by bisection instead
+    # of re-sorting the whole table.  The search is O(log n) but insort and
+    # del still shift the list, O(n): for tables bounded by MAX_FREQUENCIES
+    # (512) that memmove costs about a microsecond, less than a balanced
+    # tree in python would
+    def __init__(self):
+        dict.__init__(self)
+        self.order = []
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            bisect.insort(self.order, key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        del self.order[bisect.bisect_left(self.order, key)]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = dict.__getitem__(self, key)
+        del self[key]
+        return value
+
+    def clear(self):
+        dict.clear(self)
+        self.order = []
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def keys(self):
+        return list(self.order)
+
+    def values(self):
+        return [dict.__getitem__(self, k) for k in self.order]
+
+    def items(self):
+        return [(k, dict.__getitem__(self, k)) for k in self.order]
+
+
+class timer_heap(threading.Thread):
+    # runs callback(curr_time, *args) for each timer when it is due, holding
+    # lock.  Timers are keyed; scheduling a pending key again only moves it
+    # earlier, so callbacks re-check their condition and reschedule if the
+    # deadline has since moved out.
+    def __init__(self, lock):
+        threading.Thread.__init__(self)
+        self.setDaemon(1)
+        self.lock = lock
+        self.cond = threading.Condition(threading.Lock())
+        self.heap = []
+        self.due = {}  # key -> due time of its live heap entry
+        self.callbacks = {}
+        self.seq = itertools.count()
+        self.started = False
+
+    def schedule(self, key, when, callback, *args):
+        with self.cond:
+            self.callbacks[key] = (callback, args)
+            if key in self.due and self.due[key] <= when:
+                return
+            self.due[key] = when
+            heapq.heappush(self.heap, (when, next(self.seq), key))
+            if not self.started:
+                self.started = True
+                self.start()
+            self.cond.notify()
+
+    def cancel(self, key):
+        with self.cond:
+            self.due.pop(key, None)
+            self.callbacks.pop(key, None)
+
+    def pop_due(self, curr_time):
+        # next due (callback, args), dropping cancelled and superseded entries
+        while self.heap:
+            when, seq, key = self.heap[0]
+            if self.due.get(key) != when:
+                heapq.heappop(self.heap)
+            elif when <= curr_time:
+                heapq.heappop(self.heap)
+                del self.due[key]
+                return self.callbacks.pop(key)
+            else:
+                return None
+        return None
+
+    def run(self):
+        while True:
+            with self.cond:
+                entry = self.pop_due(time.time())
+                while entry is None:
+                    self.cond.wait(self.heap[0][0] - time.time() if self.heap else None)
+                    entry = self.pop_due(time.time())
+            callback, args = entry
+            with self.lock:
+                try:
+                    callback(time.time(), *args)
+                except:
+                    # one failing timer must not stop all the others
+                    sys.stderr.write('%f timer_heap: %s failed:\n%s\n' % (time.time(), getattr(callback, '__name__', callback), traceback.format_exc()))
+
+
 class trunked_system(object):
     def __init__(self, debug=0, config=None, wildcard=False):
         self.debug = debug
         self.wildcard_tsys = wildcard
         self.freq_table = {}
+        self.channel_table = None  # freq_table the channel caches were built from
+        self.channel_cache = {}
+        self.channel_arrays = None
         self.stats = {}
         self.stats['tsbks'] = 0
         self.stats['crc'] = 0
+        self.stats['expired_talkgroups'] = 0
+        self.stats['expired_frequencies'] = 0
         self.tsbk_cache = {}
-        self.secondary = {}
+        self.secondary = sorted_dict()
         self.adjacent = {}
         self.adjacent_data = {}
         self.rfss_syid = 0
@@ -74,7 +181,7 @@ class trunked_system(object):
         self.ns_syid = -1
         self.ns_wacn = -1
         self.ns_chan = 0
-        self.voice_frequencies = {}
+        self.voice_frequencies = sorted_dict()
         self.blacklist = {}
         self.whitelist = None
         self.tgid_map = {}
@@ -88,8 +195,25 @@ class trunked_system(object):
         self.CC_HUNT_TIME = 5.0
         self.center_frequency = 0
         self.last_tsbk = 0
-        self.cc_timeouts = 0
-        self.talkgroups = {}
+        self.talkgroups = collections.OrderedDict()  # least recently granted first
+        # talkgroup index for find_talkgroup.  rx_ctl changes it, and the
+        # blacklist, only while holding its lock: a rebuild from another
+        # thread would pull the buckets from under a search in progress
+        self.prio_buckets = {}  # prio -> OrderedDict of eligible tgids, least recently granted first
+        self.prio_order = []
+        self.tgid_bucket = {}
+        self.TALKGROUP_TTL = 3600.0  # forget talkgroups not granted for this long (seconds)
+        self.MAX_TALKGROUPS = 4096
+        self.FREQUENCY_TTL = 3600.0  # same for voice frequencies
+        self.MAX_FREQUENCIES = 512
+        self.EXPIRE_INTERVAL = 10.0
+        self.next_expire = 0
+        self.json_fields = {}  # trunk_update field -> [value, seq]
+        self.json_frequencies = collections.OrderedDict()  # frequency -> [prefix, seq], oldest change first
+        self.json_removed = collections.OrderedDict()  # frequency -> seq
+        self.dirty_frequencies = set()
+        self.granted_talkgroups = set()  # for rx_ctl.track_calls
+        self.network_status_update = None  # called with (tsys, syid, wacn) when they change
         if config:
             self.blacklist = config['blacklist']
             self.whitelist = config['whitelist']
@@ -100,14 +224,20 @@ class trunked_system(object):
             self.cc_list = config['cclist']
             self.center_frequency = config['center_frequency']
             self.modulation = config['modulation']
+            self.TALKGROUP_TTL = config.get('talkgroup_ttl', self.TALKGROUP_TTL)
+            self.MAX_TALKGROUPS = config.get('max_talkgroups', self.MAX_TALKGROUPS)
+            self.FREQUENCY_TTL = config.get('frequency_ttl', self.FREQUENCY_TTL)
+            self.MAX_FREQUENCIES = config.get('max_frequencies', self.MAX_FREQUENCIES)
 
     def reset(self):
         self.freq_table = {}
         self.stats = {}
         self.stats['tsbks'] = 0
         self.stats['crc'] = 0
+        self.stats['expired_talkgroups'] = 0
+        self.stats['expired_frequencies'] = 0
         self.tsbk_cache = {}
-        self.secondary = {}
+        self.secondary = sorted_dict()
         self.adjacent = {}
         self.adjacent_data = {}
         self.rfss_syid = 0
@@ -118,36 +248,77 @@ class trunked_system(object):
         self.ns_syid = -1
         self.ns_wacn = -1
         self.ns_chan = 0
-        self.voice_frequencies = {}
+        self.dirty_frequencies.update(self.voice_frequencies)
+        self.voice_frequencies = sorted_dict()
         self.last_tsbk = 0
-        self.cc_timeouts = 0
-        self.talkgroups = {}
+        self.talkgroups = collections.OrderedDict()
+        self.prio_buckets = {}
+        self.prio_order = []
+        self.tgid_bucket = {}
+        self.next_expire = 0
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self, seq=None, since=0):
+        # trunk_update state of this system.  Every field and voice frequency
+        # is stamped with the update sequence number seq at which a change to
+        # it was first seen; with since > 0 only those stamped later than since
+        # are included, plus the frequencies removed since then.
+        if seq is None:
+            seq = next_json_seq()
+        self.refresh_json_frequencies(seq)
         d = {}
-        d['syid'] = self.rfss_syid
-        d['rfid'] = self.rfss_rfid
-        d['stid'] = self.rfss_stid
-        d['sysid'] = self.ns_syid
-        d['rxchan'] = self.rfss_chan
-        d['txchan'] = self.rfss_txchan
-        d['wacn'] = self.ns_wacn
-        d['secondary'] = self.secondary.keys()
-        d['tsbks'] = self.stats['tsbks']
-        d['frequencies'] = {}
-        d['frequency_data'] = {}
-        d['last_tsbk'] = self.last_tsbk
+        fields = (('syid', self.rfss_syid), ('rfid', self.rfss_rfid), ('stid', self.rfss_stid),
+                  ('sysid', self.ns_syid), ('rxchan', self.rfss_chan), ('txchan', self.rfss_txchan),
+                  ('wacn', self.ns_wacn), ('secondary', self.secondary.keys()), ('tsbks', self.stats['tsbks']),
+                  ('last_tsbk', self.last_tsbk), ('adjacent_data', dict(self.adjacent_data)))
+        for k, v in fields:
+            field = self.json_fields.get(k)
+            if field is None or field[0] != v:
+                field = [v, seq]
+                self.json_fields[k] = field
+            if field[1] > since:
+                d[k] = v
+        if since:
+            changed = []
+            for f in reversed(self.json_frequencies):
+                if self.json_frequencies[f][1] <= since:
+                    break
+                changed.append(f)
+            removed = []
+            for f in reversed(self.json_removed):
+                if self.json_removed[f] <= since:
+                    break
+                removed.append(f)
+            if removed:
+                d['removed_frequencies'] = removed
+        else:
+            changed = self.voice_frequencies
+        if changed or not since:
+            d['frequencies'] = {}
+            d['frequency_data'] = {}
         t = time.time()
-        for f in self.voice_frequencies.keys():
-            tgs = '%s %s' % (self.voice_frequencies[f]['tgid'][0], self.voice_frequencies[f]['tgid'][1])
-            d['frequencies'][f] = 'voice frequency %f tgid(s) %s %4.1fs ago count %d' % (
-            f / 1000000.0, tgs, t - self.voice_frequencies[f]['time'], self.voice_frequencies[f]['counter'])
-
-            d['frequency_data'][f] = {'tgids': self.voice_frequencies[f]['tgid'],
-                                      'last_activity': '%7.1f' % (t - self.voice_frequencies[f]['time']),
-                                      'counter': self.voice_frequencies[f]['counter']}
-            d['adjacent_data'] = self.adjacent_data
-        return json.dumps(d)
+        for f in changed:
+            vf = self.voice_frequencies[f]
+            d['frequencies'][f] = '%s%4.1fs ago count %d' % (self.json_frequencies[f][0], t - vf['time'], vf['counter'])
+            d['frequency_data'][f] = {'tgids': list(vf['tgid']),
+                                      'last_activity': '%7.1f' % (t - vf['time']),
+                                      'counter': vf['counter']}
+        return d
+
+    def refresh_json_frequencies(self, seq):
+        # restamp and reformat the voice frequencies changed since the last update
+        for f in self.dirty_frequencies:
+            self.json_frequencies.pop(f, None)
+            if f in self.voice_frequencies:
+                tgid = self.voice_frequencies[f]['tgid']
+                self.json_frequencies[f] = ['voice frequency %f tgid(s) %s %s ' % (f / 1000000.0, tgid[0], tgid[1]), seq]
+                self.json_removed.pop(f, None)
+            else:
+                self.json_removed.pop(f, None)
+                self.json_removed[f] = seq
+        self.dirty_frequencies.clear()
 
     def to_string(self):
         s = []
@@ -157,7 +328,8 @@ class trunked_system(object):
         s.append('net: syid %x wacn %x frequency %f' % (self.ns_syid, self.ns_wacn, float(self.ns_chan) / 1000000.0))
         s.append('secondary control channel(s): %s' % ','.join(
             ['%f' % (float(k) / 1000000.0) for k in self.secondary.keys()]))
-        s.append('stats: tsbks %d crc %d' % (self.stats['tsbks'], self.stats['crc']))
+        s.append('stats: tsbks %d crc %d expired tgids %d expired frequencies %d' % (
+        self.stats['tsbks'], self.stats['crc'], self.stats['expired_talkgroups'], self.stats['expired_frequencies']))
         s.append('')
         t = time.time()
         for f in self.voice_frequencies:
@@ -176,30 +348,55 @@ class trunked_system(object):
         return '\n'.join(s)
 
     def get_tdma_slot(self, id):
-        table = (id >> 12) & 0xf
-        channel = id & 0xfff
-        if table not in self.freq_table:
-            return None
-        if 'tdma' not in self.freq_table[table]:
-            return None
-        return channel & 1
+        return self.channel_info(id)[1]
 
     # return frequency in Hz
     def channel_id_to_frequency(self, id):
+        return self.channel_info(id)[0]
+
+    def channel_id_to_string(self, id):
+        return self.channel_info(id)[2]
+
+    def channel_info(self, id):
+        # (frequency, tdma slot, string) of a channel id, memoized until the
+        # iden_up table changes
+        if self.channel_table is not self.freq_table:
+            self.flush_channel_cache()
+        info = self.channel_cache.get(id)
+        if info is None:
+            info = self.channel_cache[id] = self.lookup_channel(id)
+        return info
+
+    def lookup_channel(self, id):
         table = (id >> 12) & 0xf
         channel = id & 0xfff
         if table not in self.freq_table:
-            return None
+            return (None, None, "ID-0x%x" % (id))
         if 'tdma' not in self.freq_table[table]:
-            return self.freq_table[table]['frequency'] + self.freq_table[table]['step'] * channel
-        return self.freq_table[table]['frequency'] + self.freq_table[table]['step'] * int(
+            f = self.freq_table[table]['frequency'] + self.freq_table[table]['step'] * channel
+            return (f, None, "%f" % (f / 1000000.0))
+        f = self.freq_table[table]['frequency'] + self.freq_table[table]['step'] * int(
             channel / self.freq_table[table]['tdma'])
-
-    def channel_id_to_string(self, id):
-        f = self.channel_id_to_frequency(id)
-        if f is None:
-            return "ID-0x%x" % (id)
-        return "%f" % (f / 1000000.0)
+        return (f, channel & 1, "%f" % (f / 1000000.0))
+
+    def channel_lut(self):
+        # channel_lut() arrays for the current freq_table
+        if self.channel_table is not self.freq_table:
+            self.flush_channel_cache()
+        if self.channel_arrays is None:
+            self.channel_arrays = channel_lut(self.freq_table)
+        return self.channel_arrays
+
+    def flush_channel_cache(self):
+        self.channel_table = self.freq_table
+        self.channel_cache = {}
+        self.channel_arrays = None
+
+    def set_iden(self, iden, entry):
+        # install an iden_up table entry, dropping the channel caches if it changed
+        if self.freq_table.get(iden) != entry:
+            self.freq_table[iden] = entry
+            self.channel_table = None
 
     def get_tag(self, tgid):
         if not tgid:
@@ -223,11 +420,54 @@ class trunked_system(object):
             if self.debug >= 5:
                 sys.stderr.write(
                     '%f new tgid: %s %s prio %d\n' % (time.time(), tgid, self.get_tag(tgid), self.get_prio(tgid)))
+        else:
+            self.talkgroups[tgid] = self.talkgroups.pop(tgid)  # now the most recently granted
         self.talkgroups[tgid]['time'] = time.time()
         self.talkgroups[tgid]['frequency'] = frequency
         self.talkgroups[tgid]['tdma_slot'] = tdma_slot
         self.talkgroups[tgid]['srcaddr'] = srcaddr
         self.talkgroups[tgid]['prio'] = self.get_prio(tgid)
+        self.index_talkgroup(tgid)
+        self.granted_talkgroups.add(tgid)
+
+    def talkgroup_allowed(self, tgid):
+        if self.whitelist:
+            return tgid in self.whitelist
+        return tgid not in self.blacklist
+
+    def index_talkgroup(self, tgid):
+        # move tgid to the most recent end of its priority bucket, or drop it
+        # from the index if the black/whitelist excludes it.  Must be called
+        # in grant time order to keep the buckets sorted by time.
+        self.unindex_talkgroup(tgid)
+        if not self.talkgroup_allowed(tgid):
+            return
+        prio = self.talkgroups[tgid]['prio']
+        if prio not in self.prio_buckets:
+            self.prio_buckets[prio] = collections.OrderedDict()
+            self.prio_order = sorted(self.prio_buckets)
+        self.prio_buckets[prio][tgid] = True
+        self.tgid_bucket[tgid] = prio
+
+    def unindex_talkgroup(self, tgid):
+        bucket = self.tgid_bucket.pop(tgid, None)
+        if bucket is not None:
+            del self.prio_buckets[bucket][tgid]
+
+    def rebuild_talkgroup_index(self):
+        # after black/whitelist changes
+        self.prio_buckets = {}
+        self.prio_order = []
+        self.tgid_bucket = {}
+        for tgid in sorted(self.talkgroups, key=lambda tg: self.talkgroups[tg]['time']):
+            self.index_talkgroup(tgid)
+
+    def recent_talkgroups(self, prio, start_time):
+        # eligible tgids of one priority granted since start_time, most recent first
+        for tgid in reversed(self.prio_buckets[prio]):
+            if self.talkgroups[tgid]['time'] < start_time:
+                break
+            yield tgid
 
     def update_voice_frequency(self, frequency, tgid=None, tdma_slot=None, srcaddr=0):
         if not frequency:  # e.g., channel identifier not yet known
@@ -235,8 +475,6 @@ class trunked_system(object):
         self.update_talkgroup(frequency, tgid, tdma_slot, srcaddr)
         if frequency not in self.voice_frequencies:
             self.voice_frequencies[frequency] = {'counter': 0}
-            sorted_freqs = collections.OrderedDict(sorted(self.voice_frequencies.items()))
-            self.voice_frequencies = sorted_freqs
             if self.debug >= 5:
                 sys.stderr.write('%f new freq: %f\n' % (time.time(), frequency / 1000000.0))
 
@@ -247,45 +485,57 @@ class trunked_system(object):
         self.voice_frequencies[frequency]['tgid'][tdma_slot] = tgid
         self.voice_frequencies[frequency]['counter'] += 1
         self.voice_frequencies[frequency]['time'] = time.time()
+        self.dirty_frequencies.add(frequency)
+
+    def expire_tables(self, curr_time):
+        # forget talkgroups and voice frequencies not granted within their
+        # TTL, and the least recently granted ones beyond the size limits
+        self.next_expire = curr_time + self.EXPIRE_INTERVAL
+        while self.talkgroups:
+            tgid = next(iter(self.talkgroups))
+            if len(self.talkgroups) <= self.MAX_TALKGROUPS and \
+                    self.talkgroups[tgid]['time'] + self.TALKGROUP_TTL >= curr_time:
+                break
+            self.talkgroups.pop(tgid)
+            self.unindex_talkgroup(tgid)
+            self.stats['expired_talkgroups'] += 1
+
+        by_age = sorted(self.voice_frequencies, key=lambda f: self.voice_frequencies[f]['time'])
+        excess = len(by_age) - self.MAX_FREQUENCIES
+        for i, frequency in enumerate(by_age):
+            if i >= excess and self.voice_frequencies[frequency]['time'] + self.FREQUENCY_TTL >= curr_time:
+                break
+            del self.voice_frequencies[frequency]
+            self.dirty_frequencies.add(frequency)
+            self.stats['expired_frequencies'] += 1
 
     def get_updated_talkgroups(self, start_time):
-        return [tgid for tgid in self.talkgroups if (
-                self.talkgroups[tgid]['time'] >= start_time and
-                ((self.whitelist and tgid in self.whitelist) or
-                 (not self.whitelist and tgid not in self.blacklist)))]
-
-    def blacklist_update(self, start_time):
-        # print ("**** blacklist update **** %s\r\n " % self.blacklist)
-
-        expired_tgs = [tg for tg in self.blacklist.keys()
-                       if self.blacklist[tg] is not None
-                       and self.blacklist[tg] < start_time]
-        for tg in expired_tgs:
-            print("**** don't pop %s\r\n " % tg)
-            # self.blacklist.pop(tg)
+        updated = []
+        for prio in self.prio_order:
+            updated.extend(self.recent_talkgroups(prio, start_time))
+        return updated
 
     def find_talkgroup(self, start_time, tgid=None, hold=False):
         tgt_tgid = None
-        self.blacklist_update(start_time)
 
         if tgid is not None and tgid in self.talkgroups:
             tgt_tgid = tgid
 
-        for active_tgid in self.talkgroups:
-            if hold:
+        # best (lowest) priority first, most recent grant within a priority;
+        # the requested tgid is only displaced by a better priority
+        tdma_ok = self.ns_syid >= 0 and self.ns_wacn >= 0
+        for prio in self.prio_order:
+            if hold or (tgt_tgid is not None and prio >= self.talkgroups[tgt_tgid]['prio']):
+                break
+            found = None
+            for active_tgid in self.recent_talkgroups(prio, start_time):
+                if self.talkgroups[active_tgid]['tdma_slot'] is not None and not tdma_ok:
+                    continue
+                found = active_tgid
+                break
+            if found is not None:
+                tgt_tgid = found
                 break
-            if self.talkgroups[active_tgid]['time'] < start_time:
-                continue
-            if active_tgid in self.blacklist and (not self.whitelist or active_tgid not in self.whitelist):
-                continue
-            if self.whitelist and active_tgid not in self.whitelist:
-                continue
-            if self.talkgroups[active_tgid]['tdma_slot'] is not None and (self.ns_syid < 0 or self.ns_wacn < 0):
-                continue
-            if tgt_tgid is None:
-                tgt_tgid = active_tgid
-            elif self.talkgroups[active_tgid]['prio'] < self.talkgroups[tgt_tgid]['prio']:
-                tgt_tgid = active_tgid
 
         if tgt_tgid is not None and self.talkgroups[tgt_tgid]['time'] >= start_time:
             return self.talkgroups[tgt_tgid]['frequency'], tgt_tgid, self.talkgroups[tgt_tgid]['tdma_slot'], \
@@ -299,8 +549,9 @@ class trunked_system(object):
         print("}\n")
 
     def decode_mbt_data(self, opcode, src, header, mbt_data):
-        self.cc_timeouts = 0
         self.last_tsbk = time.time()
+        if self.last_tsbk >= self.next_expire:
+            self.expire_tables(self.last_tsbk)
         updated = 0
         if self.debug > 10:
             sys.stderr.write('decode_mbt_data: %x %x\n' % (opcode, mbt_data))
@@ -336,9 +587,7 @@ class trunked_system(object):
             f1 = self.channel_id_to_frequency(ch1)
             f2 = self.channel_id_to_frequency(ch2)
             if f1 and f2:
-                self.ns_syid = syid
-                self.ns_wacn = wacn
-                self.ns_chan = f1
+                self.set_network_status(syid, wacn, f1)
             if self.debug > 10:
                 sys.stderr.write('mbt3b net stat sys %x wacn %x ch1 %s ch2 %s\n' % (
                 syid, wacn, self.channel_id_to_string(ch1), self.channel_id_to_string(ch2)))
@@ -364,246 +613,329 @@ class trunked_system(object):
         return updated
 
     def decode_tsbk(self, tsbk):
-        self.cc_timeouts = 0
         self.last_tsbk = time.time()
         self.stats['tsbks'] += 1
-        updated = 0
-        tsbk = tsbk << 16  # for missing crc
-        opcode = (tsbk >> 88) & 0x3f
+        if self.last_tsbk >= self.next_expire:
+            self.expire_tables(self.last_tsbk)
         if self.debug > 10:
-            sys.stderr.write('TSBK: 0x%02x 0x%024x\n' % (opcode, tsbk))
-        if opcode == 0x00:  # group voice chan grant
-            mfrid = (tsbk >> 80) & 0xff
-            if mfrid == 0x90:  # MOT_GRG_ADD_CMD
-                sg = (tsbk >> 64) & 0xffff
-                ga1 = (tsbk >> 48) & 0xffff
-                ga2 = (tsbk >> 32) & 0xffff
-                ga3 = (tsbk >> 16) & 0xffff
-                if self.debug > 10:
-                    sys.stderr.write('MOT_GRG_ADD_CMD(0x00): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
-            else:
-                opts = (tsbk >> 72) & 0xff
-                ch = (tsbk >> 56) & 0xffff
-                ga = (tsbk >> 40) & 0xffff
-                sa = (tsbk >> 16) & 0xffffff
-                f = self.channel_id_to_frequency(ch)
-                self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
-                if f:
-                    updated += 1
-                if self.debug > 10:
-                    sys.stderr.write('tsbk00 grant freq %s ga %d sa %d\n' % (self.channel_id_to_string(ch), ga, sa))
-        elif opcode == 0x01:  # reserved
-            mfrid = (tsbk >> 80) & 0xff
-            if mfrid == 0x90:  # MOT_GRG_DEL_CMD
-                sg = (tsbk >> 64) & 0xffff
-                ga1 = (tsbk >> 48) & 0xffff
-                ga2 = (tsbk >> 32) & 0xffff
-                ga3 = (tsbk >> 16) & 0xffff
-                if self.debug > 10:
-                    sys.stderr.write('MOT_GRG_DEL_CMD(0x01): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
-        elif opcode == 0x02:  # group voice chan grant update
-            mfrid = (tsbk >> 80) & 0xff
-            if mfrid == 0x90:
-                ch = (tsbk >> 56) & 0xffff
-                sg = (tsbk >> 40) & 0xffff
-                sa = (tsbk >> 16) & 0xffffff
-                f = self.channel_id_to_frequency(ch)
-                self.update_voice_frequency(f, tgid=sg, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
-                if f:
-                    updated += 1
-                if self.debug > 10:
+            sys.stderr.write('TSBK: 0x%02x 0x%024x\n' % ((tsbk >> 72) & 0x3f, tsbk << 16))
+        # opcode and mfrid are adjacent, so one shift yields the table index
+        entry = TSBK_DISPATCH[(tsbk >> 64) & 0x3fff]
+        if entry is None:
+            # sys.stderr.write('tsbk other %x\n' % opcode)
+            return 0
+        handler, extract = entry
+        return handler(self, *extract(tsbk))
+
+    def decode_tsbk_batch(self, tsbks, times=None):
+        # decode an array of 12-byte msgq type-7 payloads (nac + TSBK) in one
+        # pass.  Leaves the same talkgroup, voice frequency, iden_up, rfss,
+        # network and adjacent/secondary state as feeding every TSBK through
+        # decode_tsbk in order.  times (one per TSBK) defaults to now.
+        # Returns the tsbk_columns() dict plus freq1/freq2/updated columns.
+        cols = tsbk_columns(tsbks)
+        n = len(cols['opcode'])
+        if times is None:
+            times = np.empty(n)
+            times.fill(time.time())
+        else:
+            times = np.asarray(times, dtype=np.float64)
+        cols['freq1'] = np.zeros(n, dtype=np.int64)
+        cols['freq2'] = np.zeros(n, dtype=np.int64)
+        cols['updated'] = np.zeros(n, dtype=np.int64)
+        if n == 0:
+            return cols
+        self.last_tsbk = float(times[-1])
+        self.stats['tsbks'] += n
+
+        # the frequency table is constant between iden_up TSBKs that change
+        # it, so each such run of TSBKs is resolved with one channel lookup
+        handler = cols['handler']
+        events = []
+        seg_start = 0
+        for r in np.nonzero(np.isin(handler, TSBK_IDEN_HANDLERS))[0]:
+            saved = self.freq_table
+            self.freq_table = dict(saved)  # handlers replace, never modify, table entries
+            self.apply_tsbk_row(cols, r)
+            if self.freq_table == saved:
+                self.freq_table = saved
+                continue
+            new_table = self.freq_table
+            self.freq_table = saved
+            events.append(self.decode_tsbk_segment(cols, times, seg_start, r))
+            self.freq_table = new_table
+            seg_start = r + 1
+        events.append(self.decode_tsbk_segment(cols, times, seg_start, n))
+
+        ev_order, ev_freq, ev_tgid, ev_slot, ev_src, ev_time = [np.concatenate(e) for e in zip(*events)]
+        order = np.argsort(ev_order, kind='mergesort')
+        self.apply_grant_events(ev_freq[order], ev_tgid[order], ev_slot[order], ev_src[order], ev_time[order])
+        if self.last_tsbk >= self.next_expire:
+            self.expire_tables(self.last_tsbk)
+        return cols
+
+    def apply_tsbk_row(self, cols, r):
+        tsbk = (int(cols['hi'][r]) << 64) | int(cols['lo'][r])
+        handler, extract = TSBK_DISPATCH[(tsbk >> 64) & 0x3fff]
+        return handler(self, *extract(tsbk))
+
+    def decode_tsbk_segment(self, cols, times, start, end):
+        # resolve channels for rows [start, end) against the current freq_table,
+        # apply control channel status and return the voice grant events
+        lut_freq, lut_slot = self.channel_lut()
+        handler = cols['handler'][start:end]
+        ch1 = cols['ch1'][start:end]
+        ch2 = cols['ch2'][start:end]
+        f1 = np.where(ch1 >= 0, lut_freq[ch1 & 0xffff], 0)
+        f2 = np.where(ch2 >= 0, lut_freq[ch2 & 0xffff], 0)
+        cols['freq1'][start:end] = f1
+        cols['freq2'][start:end] = f2
+
+        for name in ('tsbk_rfss_sts_bcst', 'tsbk_net_sts_bcst'):  # only the last one sticks
+            rows = np.nonzero((handler == TSBK_HANDLER_NAMES.index(name)) & (f1 != 0))[0]
+            if len(rows):
+                self.apply_tsbk_row(cols, start + rows[-1])
+        rows = np.nonzero((handler == TSBK_HANDLER_NAMES.index('tsbk_adj_sts_bcst')) & (f1 != 0))[0]
+        for i in last_occurrence(f1[rows]):
+            self.apply_tsbk_row(cols, start + rows[i])
+        rows = np.nonzero((handler == TSBK_HANDLER_NAMES.index('tsbk_sccb')) & (f1 != 0) & (f2 != 0))[0]
+        for i in last_occurrence((f1[rows] << 32) ^ f2[rows]):
+            self.apply_tsbk_row(cols, start + rows[i])
+
+        single = np.isin(handler, TSBK_GRANT_HANDLERS)
+        double = np.isin(handler, TSBK_GRANT_UPDT_HANDLERS)
+        second = double & (f1 != f2)
+        updated = cols['updated'][start:end]
+        updated += ((single | double) & (f1 != 0)).astype(np.int64) + (double & (f2 != 0))
+
+        sel1 = np.nonzero((single | double) & (f1 != 0))[0]
+        sel2 = np.nonzero(second & (f2 != 0))[0]
+        rows = start + np.concatenate((sel1, sel2))
+        return (np.concatenate((rows[:len(sel1)] * 2, rows[len(sel1):] * 2 + 1)),
+                np.concatenate((f1[sel1], f2[sel2])),
+                np.concatenate((cols['ga1'][start:end][sel1], cols['ga2'][start:end][sel2])),
+                np.concatenate((lut_slot[ch1[sel1]], lut_slot[ch2[sel2]])),
+                np.concatenate((np.maximum(cols['sa'][start:end][sel1], 0), np.zeros(len(sel2), dtype=np.int64))),
+                times[rows])
+
+    def apply_grant_events(self, ev_freq, ev_tgid, ev_slot, ev_src, ev_time):
+        # batch equivalent of calling update_voice_frequency for every grant event, in order
+        for i in np.sort(last_occurrence(ev_tgid)):  # grant time order, for the priority index
+            tgid = int(ev_tgid[i])
+            if tgid not in self.talkgroups:
+                self.talkgroups[tgid] = {'counter': 0}
+                if self.debug >= 5:
                     sys.stderr.write(
-                        'MOT_GRG_CN_GRANT(0x02): freq %s sg:%d sa:%d\n' % (self.channel_id_to_string(ch), sg, sa))
+                        '%f new tgid: %s %s prio %d\n' % (time.time(), tgid, self.get_tag(tgid), self.get_prio(tgid)))
             else:
-                ch1 = (tsbk >> 64) & 0xffff
-                ga1 = (tsbk >> 48) & 0xffff
-                ch2 = (tsbk >> 32) & 0xffff
-                ga2 = (tsbk >> 16) & 0xffff
-                f1 = self.channel_id_to_frequency(ch1)
-                f2 = self.channel_id_to_frequency(ch2)
-                self.update_voice_frequency(f1, tgid=ga1, tdma_slot=self.get_tdma_slot(ch1))
-                if f1 != f2:
-                    self.update_voice_frequency(f2, tgid=ga2, tdma_slot=self.get_tdma_slot(ch2))
-                if f1:
-                    updated += 1
-                if f2:
-                    updated += 1
-                if self.debug > 10:
-                    sys.stderr.write('tsbk02 grant update: chan %s %d %s %d\n' % (
-                    self.channel_id_to_string(ch1), ga1, self.channel_id_to_string(ch2), ga2))
-        elif opcode == 0x03:  # group voice chan grant update exp : TIA.102-AABC-B-2005 page 56
-            mfrid = (tsbk >> 80) & 0xff
-            if mfrid == 0x90:  # MOT_GRG_CN_GRANT_UPDT
-                ch1 = (tsbk >> 64) & 0xffff
-                sg1 = (tsbk >> 48) & 0xffff
-                ch2 = (tsbk >> 32) & 0xffff
-                sg2 = (tsbk >> 16) & 0xffff
-                f1 = self.channel_id_to_frequency(ch1)
-                f2 = self.channel_id_to_frequency(ch2)
-                self.update_voice_frequency(f1, tgid=sg1, tdma_slot=self.get_tdma_slot(ch1))
-                if f1 != f2:
-                    self.update_voice_frequency(f2, tgid=sg2, tdma_slot=self.get_tdma_slot(ch2))
-                if f1:
-                    updated += 1
-                if f2:
-                    updated += 1
-                if self.debug > 10:
-                    sys.stderr.write('MOT_GRG_CN_GRANT_UPDT(0x03): freq %s sg1:%d freq %s sg2:%d\n' % (
-                    self.channel_id_to_string(ch1), sg1, self.channel_id_to_string(ch2), sg2))
-            elif mfrid == 0:
-                ch1 = (tsbk >> 48) & 0xffff
-                ch2 = (tsbk >> 32) & 0xffff
-                ga = (tsbk >> 16) & 0xffff
-                f = self.channel_id_to_frequency(ch1)
-                self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch1))
-                if f:
-                    updated += 1
-                if self.debug > 10:
-                    sys.stderr.write('tsbk03: freq-t %s freq-r %s ga:%d\n' % (
-                    self.channel_id_to_string(ch1), self.channel_id_to_string(ch2), ga))
+                self.talkgroups[tgid] = self.talkgroups.pop(tgid)
+            self.talkgroups[tgid]['time'] = float(ev_time[i])
+            self.talkgroups[tgid]['frequency'] = int(ev_freq[i])
+            self.talkgroups[tgid]['tdma_slot'] = int(ev_slot[i]) if ev_slot[i] >= 0 else None
+            self.talkgroups[tgid]['srcaddr'] = int(ev_src[i])
+            self.talkgroups[tgid]['prio'] = self.get_prio(tgid)
+            self.index_talkgroup(tgid)
+            self.granted_talkgroups.add(tgid)
+
+        freqs, counts = np.unique(ev_freq, return_counts=True)
+        for frequency, count in zip(freqs, counts):
+            frequency = int(frequency)
+            if frequency not in self.voice_frequencies:
+                self.voice_frequencies[frequency] = {'counter': 0, 'tgid': [None, None]}
+                if self.debug >= 5:
+                    sys.stderr.write('%f new freq: %f\n' % (time.time(), frequency / 1000000.0))
+            self.voice_frequencies[frequency]['counter'] += int(count)
+            self.dirty_frequencies.add(frequency)
+        for i in last_occurrence(ev_freq):
+            self.voice_frequencies[int(ev_freq[i])]['time'] = float(ev_time[i])
+        slot_index = np.maximum(ev_slot, 0)
+        for i in last_occurrence((ev_freq << 1) | slot_index):
+            self.voice_frequencies[int(ev_freq[i])]['tgid'][slot_index[i]] = int(ev_tgid[i])
+
+    def tsbk_mot_grg_add_cmd(self, sg, ga1, ga2, ga3):
+        if self.debug > 10:
+            sys.stderr.write('MOT_GRG_ADD_CMD(0x00): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
+        return 0
 
-        elif opcode == 0x16:  # sndcp data ch
-            ch1 = (tsbk >> 48) & 0xffff
-            ch2 = (tsbk >> 32) & 0xffff
-            if self.debug > 10:
-                sys.stderr.write('tsbk16 sndcp data ch: chan %x %x\n' % (ch1, ch2))
-        elif opcode == 0x28:  # grp_aff_rsp
-            mfrid = (tsbk >> 80) & 0xff
-            lg = (tsbk >> 79) & 0x01
-            gav = (tsbk >> 72) & 0x03
-            aga = (tsbk >> 56) & 0xffff
-            ga = (tsbk >> 40) & 0xffff
-            ta = (tsbk >> 16) & 0xffffff
-            if self.debug > 10:
-                sys.stderr.write(
-                    'tsbk28 grp_aff_resp: mfrid: 0x%x, gav: %d, aga: %d, ga: %d, ta: %d\n' % (mfrid, gav, aga, ga, ta))
-        elif opcode == 0x34:  # iden_up vhf uhf
-            iden = (tsbk >> 76) & 0xf
-            bwvu = (tsbk >> 72) & 0xf
-            toff0 = (tsbk >> 58) & 0x3fff
-            spac = (tsbk >> 48) & 0x3ff
-            freq = (tsbk >> 16) & 0xffffffff
-            toff_sign = (toff0 >> 13) & 1
-            toff = toff0 & 0x1fff
-            if toff_sign == 0:
-                toff = 0 - toff
-            txt = ["mob Tx-", "mob Tx+"]
-            self.freq_table[iden] = {}
-            self.freq_table[iden]['offset'] = toff * spac * 125
-            self.freq_table[iden]['step'] = spac * 125
-            self.freq_table[iden]['frequency'] = freq * 5
-            if self.debug > 10:
-                sys.stderr.write('tsbk34 iden vhf/uhf id %d toff %f spac %f freq %f [%s]\n' % (
-                iden, toff * spac * 0.125 * 1e-3, spac * 0.125, freq * 0.000005, txt[toff_sign]))
-        elif opcode == 0x33:  # iden_up_tdma
-            mfrid = (tsbk >> 80) & 0xff
-            if mfrid == 0:
-                iden = (tsbk >> 76) & 0xf
-                channel_type = (tsbk >> 72) & 0xf
-                toff0 = (tsbk >> 58) & 0x3fff
-                spac = (tsbk >> 48) & 0x3ff
-                toff_sign = (toff0 >> 13) & 1
-                toff = toff0 & 0x1fff
-                if toff_sign == 0:
-                    toff = 0 - toff
-                f1 = (tsbk >> 16) & 0xffffffff
-                slots_per_carrier = [1, 1, 1, 2, 4, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
-                                     2]  # values above 5 are reserved and not valid
-                self.freq_table[iden] = {}
-                self.freq_table[iden]['offset'] = toff * spac * 125
-                self.freq_table[iden]['step'] = spac * 125
-                self.freq_table[iden]['frequency'] = f1 * 5
-                self.freq_table[iden]['tdma'] = slots_per_carrier[channel_type]
-                if self.debug > 10:
-                    sys.stderr.write('tsbk33 iden up tdma id %d f %d offset %d spacing %d slots/carrier %d\n' % (
-                    iden, self.freq_table[iden]['frequency'], self.freq_table[iden]['offset'],
-                    self.freq_table[iden]['step'], self.freq_table[iden]['tdma']))
-
-        elif opcode == 0x3d:  # iden_up
-            iden = (tsbk >> 76) & 0xf
-            bw = (tsbk >> 67) & 0x1ff
-            toff0 = (tsbk >> 58) & 0x1ff
-            spac = (tsbk >> 48) & 0x3ff
-            freq = (tsbk >> 16) & 0xffffffff
-            toff_sign = (toff0 >> 8) & 1
-            toff = toff0 & 0xff
-            if toff_sign == 0:
-                toff = 0 - toff
-            txt = ["mob xmit < recv", "mob xmit > recv"]
-            self.freq_table[iden] = {}
-            self.freq_table[iden]['offset'] = toff * 250000
-            self.freq_table[iden]['step'] = spac * 125
-            self.freq_table[iden]['frequency'] = freq * 5
-            if self.debug > 10:
-                sys.stderr.write(
-                    'tsbk3d iden id %d toff %f spac %f freq %f\n' % (iden, toff * 0.25, spac * 0.125, freq * 0.000005))
-        elif opcode == 0x3a:  # rfss status
-            syid = (tsbk >> 56) & 0xfff
-            rfid = (tsbk >> 48) & 0xff
-            stid = (tsbk >> 40) & 0xff
-            chan = (tsbk >> 24) & 0xffff
-            f1 = self.channel_id_to_frequency(chan)
-            if f1:
-                self.rfss_syid = syid
-                self.rfss_rfid = rfid
-                self.rfss_stid = stid
-                self.rfss_chan = f1
-                self.rfss_txchan = f1 + self.freq_table[chan >> 12]['offset']
-            if self.debug > 10:
-                sys.stderr.write('tsbk3a rfss status: syid: %x rfid %x stid %d ch1 %x(%s)\n' % (
-                syid, rfid, stid, chan, self.channel_id_to_string(chan)))
-        elif opcode == 0x39:  # secondary cc
-            rfid = (tsbk >> 72) & 0xff
-            stid = (tsbk >> 64) & 0xff
-            ch1 = (tsbk >> 48) & 0xffff
-            ch2 = (tsbk >> 24) & 0xffff
-            f1 = self.channel_id_to_frequency(ch1)
-            f2 = self.channel_id_to_frequency(ch2)
-            if f1 and f2:
-                self.secondary[f1] = 1
-                self.secondary[f2] = 1
-                sorted_freqs = collections.OrderedDict(sorted(self.secondary.items()))
-                self.secondary = sorted_freqs
-            if self.debug > 10:
-                sys.stderr.write('tsbk39 secondary cc: rfid %x stid %d ch1 %x(%s) ch2 %x(%s)\n' % (
-                rfid, stid, ch1, self.channel_id_to_string(ch1), ch2, self.channel_id_to_string(ch2)))
-        elif opcode == 0x3b:  # network status
-            wacn = (tsbk >> 52) & 0xfffff
-            syid = (tsbk >> 40) & 0xfff
-            ch1 = (tsbk >> 24) & 0xffff
-            f1 = self.channel_id_to_frequency(ch1)
-            if f1:
-                self.ns_syid = syid
-                self.ns_wacn = wacn
-                self.ns_chan = f1
-            if self.debug > 10:
-                sys.stderr.write(
-                    'tsbk3b net stat: wacn %x syid %x ch1 %x(%s)\n' % (wacn, syid, ch1, self.channel_id_to_string(ch1)))
-        elif opcode == 0x3c:  # adjacent status
-            rfid = (tsbk >> 48) & 0xff
-            stid = (tsbk >> 40) & 0xff
-            ch1 = (tsbk >> 24) & 0xffff
-            table = (ch1 >> 12) & 0xf
-            f1 = self.channel_id_to_frequency(ch1)
-            if f1 and table in self.freq_table:
-                self.adjacent[f1] = 'rfid: %d stid:%d uplink:%f tbl:%d' % (
-                rfid, stid, (f1 + self.freq_table[table]['offset']) / 1000000.0, table)
-                self.adjacent_data[f1] = {'rfid': rfid, 'stid': stid, 'uplink': f1 + self.freq_table[table]['offset'],
-                                          'table': table}
-            if self.debug > 10:
-                sys.stderr.write(
-                    'tsbk3c adjacent: rfid %x stid %d ch1 %x(%s)\n' % (rfid, stid, ch1, self.channel_id_to_string(ch1)))
-                if table in self.freq_table:
-                    sys.stderr.write(
-                        'tsbk3c : %s %s\n' % (self.freq_table[table]['frequency'], self.freq_table[table]['step']))
-            # else:
-            #	sys.stderr.write('tsbk other %x\n' % opcode)
+    def tsbk_grp_v_ch_grant(self, ch, ga, sa):
+        updated = 0
+        f = self.channel_id_to_frequency(ch)
+        self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
+        if f:
+            updated += 1
+        if self.debug > 10:
+            sys.stderr.write('tsbk00 grant freq %s ga %d sa %d\n' % (self.channel_id_to_string(ch), ga, sa))
+        return updated
+
+    def tsbk_mot_grg_del_cmd(self, sg, ga1, ga2, ga3):
+        if self.debug > 10:
+            sys.stderr.write('MOT_GRG_DEL_CMD(0x01): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
+        return 0
+
+    def tsbk_mot_grg_cn_grant(self, ch, sg, sa):
+        updated = 0
+        f = self.channel_id_to_frequency(ch)
+        self.update_voice_frequency(f, tgid=sg, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
+        if f:
+            updated += 1
+        if self.debug > 10:
+            sys.stderr.write(
+                'MOT_GRG_CN_GRANT(0x02): freq %s sg:%d sa:%d\n' % (self.channel_id_to_string(ch), sg, sa))
+        return updated
+
+    def tsbk_grp_v_ch_grant_updt(self, ch1, ga1, ch2, ga2):
+        updated = 0
+        f1 = self.channel_id_to_frequency(ch1)
+        f2 = self.channel_id_to_frequency(ch2)
+        self.update_voice_frequency(f1, tgid=ga1, tdma_slot=self.get_tdma_slot(ch1))
+        if f1 != f2:
+            self.update_voice_frequency(f2, tgid=ga2, tdma_slot=self.get_tdma_slot(ch2))
+        if f1:
+            updated += 1
+        if f2:
+            updated += 1
+        if self.debug > 10:
+            sys.stderr.write('tsbk02 grant update: chan %s %d %s %d\n' % (
+            self.channel_id_to_string(ch1), ga1, self.channel_id_to_string(ch2), ga2))
+        return updated
+
+    def tsbk_mot_grg_cn_grant_updt(self, ch1, sg1, ch2, sg2):
+        updated = 0
+        f1 = self.channel_id_to_frequency(ch1)
+        f2 = self.channel_id_to_frequency(ch2)
+        self.update_voice_frequency(f1, tgid=sg1, tdma_slot=self.get_tdma_slot(ch1))
+        if f1 != f2:
+            self.update_voice_frequency(f2, tgid=sg2, tdma_slot=self.get_tdma_slot(ch2))
+        if f1:
+            updated += 1
+        if f2:
+            updated += 1
+        if self.debug > 10:
+            sys.stderr.write('MOT_GRG_CN_GRANT_UPDT(0x03): freq %s sg1:%d freq %s sg2:%d\n' % (
+            self.channel_id_to_string(ch1), sg1, self.channel_id_to_string(ch2), sg2))
+        return updated
+
+    def tsbk_grp_v_ch_grant_updt_exp(self, ch1, ch2, ga):
+        # TIA.102-AABC-B-2005 page 56
+        updated = 0
+        f = self.channel_id_to_frequency(ch1)
+        self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch1))
+        if f:
+            updated += 1
+        if self.debug > 10:
+            sys.stderr.write('tsbk03: freq-t %s freq-r %s ga:%d\n' % (
+            self.channel_id_to_string(ch1), self.channel_id_to_string(ch2), ga))
         return updated
 
+    def tsbk_sndcp_data_ch(self, ch1, ch2):
+        if self.debug > 10:
+            sys.stderr.write('tsbk16 sndcp data ch: chan %x %x\n' % (ch1, ch2))
+        return 0
+
+    def tsbk_grp_aff_rsp(self, mfrid, lg, gav, aga, ga, ta):
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk28 grp_aff_resp: mfrid: 0x%x, gav: %d, aga: %d, ga: %d, ta: %d\n' % (mfrid, gav, aga, ga, ta))
+        return 0
+
+    def tsbk_iden_up_vu(self, iden, bwvu, toff0, spac, freq):
+        toff_sign = (toff0 >> 13) & 1
+        toff = toff0 & 0x1fff
+        if toff_sign == 0:
+            toff = 0 - toff
+        txt = ["mob Tx-", "mob Tx+"]
+        self.set_iden(iden, {'offset': toff * spac * 125, 'step': spac * 125, 'frequency': freq * 5})
+        if self.debug > 10:
+            sys.stderr.write('tsbk34 iden vhf/uhf id %d toff %f spac %f freq %f [%s]\n' % (
+            iden, toff * spac * 0.125 * 1e-3, spac * 0.125, freq * 0.000005, txt[toff_sign]))
+        return 0
+
+    def tsbk_iden_up_tdma(self, iden, channel_type, toff0, spac, f1):
+        toff_sign = (toff0 >> 13) & 1
+        toff = toff0 & 0x1fff
+        if toff_sign == 0:
+            toff = 0 - toff
+        slots_per_carrier = [1, 1, 1, 2, 4, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                             2]  # values above 5 are reserved and not valid
+        self.set_iden(iden, {'offset': toff * spac * 125, 'step': spac * 125, 'frequency': f1 * 5,
+                             'tdma': slots_per_carrier[channel_type]})
+        if self.debug > 10:
+            sys.stderr.write('tsbk33 iden up tdma id %d f %d offset %d spacing %d slots/carrier %d\n' % (
+            iden, self.freq_table[iden]['frequency'], self.freq_table[iden]['offset'],
+            self.freq_table[iden]['step'], self.freq_table[iden]['tdma']))
+        return 0
+
+    def tsbk_iden_up(self, iden, bw, toff0, spac, freq):
+        toff_sign = (toff0 >> 8) & 1
+        toff = toff0 & 0xff
+        if toff_sign == 0:
+            toff = 0 - toff
+        txt = ["mob xmit < recv", "mob xmit > recv"]
+        self.set_iden(iden, {'offset': toff * 250000, 'step': spac * 125, 'frequency': freq * 5})
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3d iden id %d toff %f spac %f freq %f\n' % (iden, toff * 0.25, spac * 0.125, freq * 0.000005))
+        return 0
+
+    def tsbk_rfss_sts_bcst(self, syid, rfid, stid, chan):
+        f1 = self.channel_id_to_frequency(chan)
+        if f1:
+            self.rfss_syid = syid
+            self.rfss_rfid = rfid
+            self.rfss_stid = stid
+            self.rfss_chan = f1
+            self.rfss_txchan = f1 + self.freq_table[chan >> 12]['offset']
+        if self.debug > 10:
+            sys.stderr.write('tsbk3a rfss status: syid: %x rfid %x stid %d ch1 %x(%s)\n' % (
+            syid, rfid, stid, chan, self.channel_id_to_string(chan)))
+        return 0
+
+    def tsbk_sccb(self, rfid, stid, ch1, ch2):
+        f1 = self.channel_id_to_frequency(ch1)
+        f2 = self.channel_id_to_frequency(ch2)
+        if f1 and f2:
+            self.secondary[f1] = 1
+            self.secondary[f2] = 1
+        if self.debug > 10:
+            sys.stderr.write('tsbk39 secondary cc: rfid %x stid %d ch1 %x(%s) ch2 %x(%s)\n' % (
+            rfid, stid, ch1, self.channel_id_to_string(ch1), ch2, self.channel_id_to_string(ch2)))
+        return 0
+
+    def set_network_status(self, syid, wacn, frequency):
+        changed = (syid, wacn) != (self.ns_syid, self.ns_wacn)
+        self.ns_syid = syid
+        self.ns_wacn = wacn
+        self.ns_chan = frequency
+        if changed and self.network_status_update:
+            self.network_status_update(self, syid, wacn)
+
+    def tsbk_net_sts_bcst(self, wacn, syid, ch1):
+        f1 = self.channel_id_to_frequency(ch1)
+        if f1:
+            self.set_network_status(syid, wacn, f1)
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3b net stat: wacn %x syid %x ch1 %x(%s)\n' % (wacn, syid, ch1, self.channel_id_to_string(ch1)))
+        return 0
+
+    def tsbk_adj_sts_bcst(self, rfid, stid, ch1):
+        table = (ch1 >> 12) & 0xf
+        f1 = self.channel_id_to_frequency(ch1)
+        if f1 and table in self.freq_table:
+            self.adjacent[f1] = 'rfid: %d stid:%d uplink:%f tbl:%d' % (
+            rfid, stid, (f1 + self.freq_table[table]['offset']) / 1000000.0, table)
+            self.adjacent_data[f1] = {'rfid': rfid, 'stid': stid, 'uplink': f1 + self.freq_table[table]['offset'],
+                                      'table': table}
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3c adjacent: rfid %x stid %d ch1 %x(%s)\n' % (rfid, stid, ch1, self.channel_id_to_string(ch1)))
+            if table in self.freq_table:
+                sys.stderr.write(
+                    'tsbk3c : %s %s\n' % (self.freq_table[table]['frequency'], self.freq_table[table]['step']))
+        return 0
+
     def hunt_cc(self, curr_time):
-        if self.cc_timeouts < 6:
-            return False
-        self.cc_timeouts = 0
+        # move on to the next control channel; true if it differs from the last one
         self.cc_list_index += 1
         if self.cc_list_index >= len(self.cc_list):
             self.cc_list_index = 0
@@ -620,6 +952,8 @@ class trunked_system(object):
             return
         # print ('Adding to the Blacklist: %s - %s\n' % (tgid, end_time))
         self.blacklist[tgid] = end_time
+        if not self.talkgroup_allowed(tgid):
+            self.unindex_talkgroup(tgid)
 
     def remove_blacklist(self, tgid, end_time=None):
         if not tgid:
@@ -628,6 +962,161 @@ class trunked_system(object):
 
         if tgid in self.blacklist:
             self.blacklist.pop(tgid)
+            self.rebuild_talkgroup_index()
+
+
+# TSBK decoder table, keyed by (opcode, mfrid).  An mfrid of None applies to
+# every manufacturer ID not listed separately for the same opcode.  Each field
+# is given as (name, shift, mask) with the shift counted from the LSB of the
+# full 96-bit TSBK (i.e. including the 16-bit crc), per TIA-102.AABC.
+TSBK_FIELDS = {
+    (0x00, 0x90): ('tsbk_mot_grg_add_cmd', [('sg', 64, 0xffff), ('ga1', 48, 0xffff), ('ga2', 32, 0xffff),
+                                            ('ga3', 16, 0xffff)]),
+    (0x00, None): ('tsbk_grp_v_ch_grant', [('ch', 56, 0xffff), ('ga', 40, 0xffff), ('sa', 16, 0xffffff)]),
+    (0x01, 0x90): ('tsbk_mot_grg_del_cmd', [('sg', 64, 0xffff), ('ga1', 48, 0xffff), ('ga2', 32, 0xffff),
+                                            ('ga3', 16, 0xffff)]),
+    (0x02, 0x90): ('tsbk_mot_grg_cn_grant', [('ch', 56, 0xffff), ('sg', 40, 0xffff), ('sa', 16, 0xffffff)]),
+    (0x02, None): ('tsbk_grp_v_ch_grant_updt', [('ch1', 64, 0xffff), ('ga1', 48, 0xffff), ('ch2', 32, 0xffff),
+                                                ('ga2', 16, 0xffff)]),
+    (0x03, 0x90): ('tsbk_mot_grg_cn_grant_updt', [('ch1', 64, 0xffff), ('sg1', 48, 0xffff), ('ch2', 32, 0xffff),
+                                                  ('sg2', 16, 0xffff)]),
+    (0x03, 0x00): ('tsbk_grp_v_ch_grant_updt_exp', [('ch1', 48, 0xffff), ('ch2', 32, 0xffff), ('ga', 16, 0xffff)]),
+    (0x16, None): ('tsbk_sndcp_data_ch', [('ch1', 48, 0xffff), ('ch2', 32, 0xffff)]),
+    (0x28, None): ('tsbk_grp_aff_rsp', [('mfrid', 80, 0xff), ('lg', 79, 0x01), ('gav', 72, 0x03),
+                                        ('aga', 56, 0xffff), ('ga', 40, 0xffff), ('ta', 16, 0xffffff)]),
+    (0x33, 0x00): ('tsbk_iden_up_tdma', [('iden', 76, 0xf), ('channel_type', 72, 0xf), ('toff0', 58, 0x3fff),
+                                         ('spac', 48, 0x3ff), ('f1', 16, 0xffffffff)]),
+    (0x34, None): ('tsbk_iden_up_vu', [('iden', 76, 0xf), ('bwvu', 72, 0xf), ('toff0', 58, 0x3fff),
+                                       ('spac', 48, 0x3ff), ('freq', 16, 0xffffffff)]),
+    (0x39, None): ('tsbk_sccb', [('rfid', 72, 0xff), ('stid', 64, 0xff), ('ch1', 48, 0xffff), ('ch2', 24, 0xffff)]),
+    (0x3a, None): ('tsbk_rfss_sts_bcst', [('syid', 56, 0xfff), ('rfid', 48, 0xff), ('stid', 40, 0xff),
+                                          ('chan', 24, 0xffff)]),
+    (0x3b, None): ('tsbk_net_sts_bcst', [('wacn', 52, 0xfffff), ('syid', 40, 0xfff), ('ch1', 24, 0xffff)]),
+    (0x3c, None): ('tsbk_adj_sts_bcst', [('rfid', 48, 0xff), ('stid', 40, 0xff), ('ch1', 24, 0xffff)]),
+    (0x3d, None): ('tsbk_iden_up', [('iden', 76, 0xf), ('bw', 67, 0x1ff), ('toff0', 58, 0x1ff),
+                                    ('spac', 48, 0x3ff), ('freq', 16, 0xffffffff)]),
+}
+
+
+def field_extractor(fields):
+    # compile the field list into one function returning all fields as a tuple.
+    # decode_tsbk receives the TSBK without its crc, hence the extra 16 bits.
+    exprs = ['(t >> %d) & 0x%x' % (shift - 16, mask) for name, shift, mask in fields]
+    return eval('lambda t: (%s,)' % ', '.join(exprs))
+
+
+def build_tsbk_dispatch(cls, specs):
+    # flat table indexed by (opcode << 8) | mfrid, wildcard entries filled first
+    table = [None] * (64 * 256)
+    for (opcode, mfrid), (name, fields) in sorted(specs.items(), key=lambda kv: kv[0][1] is not None):
+        entry = (cls.__dict__[name], field_extractor(fields))
+        if mfrid is None:
+            for m in range(256):
+                table[(opcode << 8) | m] = entry
+        else:
+            table[(opcode << 8) | mfrid] = entry
+    return table
+
+
+TSBK_DISPATCH = build_tsbk_dispatch(trunked_system, TSBK_FIELDS)
+
+
+# batch decoding (trunked_system.decode_tsbk_batch) support.  Handlers are
+# numbered by their position in TSBK_HANDLER_NAMES.
+TSBK_HANDLER_NAMES = sorted([name for name, fields in TSBK_FIELDS.values()])
+TSBK_HANDLER_INDEX = np.array([-1 if entry is None else TSBK_HANDLER_NAMES.index(entry[0].__name__)
+                               for entry in TSBK_DISPATCH], dtype=np.int64)
+TSBK_IDEN_HANDLERS = [TSBK_HANDLER_NAMES.index(name) for name in
+                      ('tsbk_iden_up', 'tsbk_iden_up_tdma', 'tsbk_iden_up_vu')]
+TSBK_GRANT_HANDLERS = [TSBK_HANDLER_NAMES.index(name) for name in
+                       ('tsbk_grp_v_ch_grant', 'tsbk_mot_grg_cn_grant', 'tsbk_grp_v_ch_grant_updt_exp')]
+TSBK_GRANT_UPDT_HANDLERS = [TSBK_HANDLER_NAMES.index(name) for name in
+                            ('tsbk_grp_v_ch_grant_updt', 'tsbk_mot_grg_cn_grant_updt')]
+
+# TSBK_FIELDS names gathered into the common tsbk_columns() columns.  Where
+# two fields of one TSBK map to the same column the first one wins.
+TSBK_COLUMN_ALIASES = {'ch': 'ch1', 'ch1': 'ch1', 'chan': 'ch1', 'ch2': 'ch2',
+                       'ga': 'ga1', 'ga1': 'ga1', 'sg': 'ga1', 'sg1': 'ga1', 'ga2': 'ga2', 'sg2': 'ga2',
+                       'sa': 'sa'}
+
+
+def tsbk_field(hi, lo, shift, mask):
+    # vectorized form of one TSBK_FIELDS entry; hi holds the top 16 bits of the
+    # 80-bit TSBK (without crc) and lo the remaining 64
+    shift -= 16
+    if shift >= 64:
+        v = hi >> np.uint64(shift - 64)
+    elif shift == 0:
+        v = lo
+    else:
+        v = (lo >> np.uint64(shift)) | (hi << np.uint64(64 - shift))
+    return (v & np.uint64(mask)).astype(np.int64)
+
+
+def tsbk_columns(tsbks):
+    # split 12-byte msgq type-7 payloads (2 byte nac followed by the 10 byte
+    # TSBK without crc) into int64 column arrays, one entry per TSBK.  ch1, ch2,
+    # ga1, ga2 and sa are -1 for TSBKs which do not carry the field.
+    if not isinstance(tsbks, np.ndarray):
+        tsbks = np.frombuffer(tsbks, dtype=np.uint8)
+    a = np.ascontiguousarray(tsbks, dtype=np.uint8).reshape(-1, 12)
+    n = a.shape[0]
+    hi = (a[:, 2].astype(np.uint64) << np.uint64(8)) | a[:, 3]
+    lo = a[:, 4:].copy().view('>u8').ravel().astype(np.uint64)
+    cols = {'hi': hi, 'lo': lo}
+    cols['nac'] = (a[:, 0].astype(np.int64) << 8) | a[:, 1]
+    cols['opcode'] = ((hi >> np.uint64(8)) & np.uint64(0x3f)).astype(np.int64)
+    cols['mfrid'] = (hi & np.uint64(0xff)).astype(np.int64)
+    cols['handler'] = TSBK_HANDLER_INDEX[(hi & np.uint64(0x3fff)).astype(np.int64)]
+    for c in ('ch1', 'ch2', 'ga1', 'ga2', 'sa'):
+        cols[c] = np.empty(n, dtype=np.int64)
+        cols[c].fill(-1)
+    for name, fields in TSBK_FIELDS.values():
+        rows = np.nonzero(cols['handler'] == TSBK_HANDLER_NAMES.index(name))[0]
+        if not len(rows):
+            continue
+        done = set()
+        for field, shift, mask in fields:
+            c = TSBK_COLUMN_ALIASES.get(field)
+            if c is None or c in done:
+                continue
+            done.add(c)
+            cols[c][rows] = tsbk_field(hi[rows], lo[rows], shift, mask)
+    return cols
+
+
+def channel_lut(freq_table):
+    # frequency (Hz, 0 if the iden is unknown) and tdma slot (-1 for fdma
+    # channels) of every 16-bit channel id
+    freqs = np.zeros(65536, dtype=np.int64)
+    slots = np.empty(65536, dtype=np.int64)
+    slots.fill(-1)
+    channel = np.arange(4096, dtype=np.int64)
+    for table in freq_table:
+        ids = slice(table << 12, (table + 1) << 12)
+        if 'tdma' not in freq_table[table]:
+            freqs[ids] = freq_table[table]['frequency'] + freq_table[table]['step'] * channel
+        else:
+            freqs[ids] = freq_table[table]['frequency'] + freq_table[table]['step'] * (
+                channel // freq_table[table]['tdma'])
+            slots[ids] = channel & 1
+    return freqs, slots
+
+
+# trunk_update sequence numbers, starting from the time in ms so that they
+# keep increasing across restarts
+JSON_SEQ = itertools.count(int(time.time() * 1000))
+
+
+def next_json_seq():
+    return next(JSON_SEQ)
+
+
+def last_occurrence(keys):
+    # indices of the last occurrence of each distinct key, in key order
+    keys = np.asarray(keys)
+    u, idx = np.unique(keys[::-1], return_index=True)
+    return len(keys) - 1 - idx
 
 
 def get_int_dict(s):
@@ -662,7 +1151,8 @@ def get_int_dict(s):
 
 
 class rx_ctl(object):
-    def __init__(self, debug=0, frequency_set=None, conf_file=None, logfile_workers=None, meta_update=None):
+    def __init__(self, debug=0, frequency_set=None, conf_file=None, logfile_workers=None, meta_update=None,
+                 site_set=None, call_event=None, xor_cache=None):
         class _states(object):
             ACQ = 0
             CC = 1
@@ -675,6 +1165,9 @@ class rx_ctl(object):
         self.trunked_systems = {}
         self.frequency_set = frequency_set
         self.meta_update = meta_update
+        self.call_event = call_event  # call start/end records, see cdr.py
+        self.calls = {}  # (nac, tgid) -> call in progress
+        self.CALL_TIMEOUT = 3.0  # TODO: make more configurable
         self.meta_state = 0
         self.debug = debug
         self.tgid_hold = None
@@ -696,8 +1189,19 @@ class rx_ctl(object):
         self.logfile_workers = logfile_workers
         self.active_talkgroups = {}
         self.working_frequencies = {}
-        self.xor_cache = {}
-        self.last_garbage_collect = 0
+        self.working_tgids = {}  # tgid -> working frequency
+        self.free_workers = list(reversed(logfile_workers or []))
+        self.worker_prios = {}  # prio -> working frequencies, least recently updated first
+        self.worker_stats = {'drops': 0, 'preemptions': 0}
+        self.xor_cache = xor_cache  # phase 2 scrambling sequences, see lfsr.xor_cache
+        if self.xor_cache is None:
+            self.xor_cache = lfsr.xor_cache()
+        self.site_set = site_set  # multi-site mode: tunes the per-system control channel decoders
+        self.sites = []
+        self.site_since = {}
+        self.lock = threading.RLock()
+        self.timers = timer_heap(self.lock)
+        self.cc_since = time.time()  # main channel (re)tuned to the control channel
         if self.logfile_workers:
             self.input_rate = self.logfile_workers[0]['demod'].input_rate
 
@@ -709,6 +1213,7 @@ class rx_ctl(object):
             self.nacs = self.configs.keys()
             self.current_nac = self.find_next_tsys()
             self.current_state = self.states.CC
+            self.xor_cache.prewarm(nacs=set(self.nacs))
 
             tsys = self.trunked_systems[self.current_nac]
 
@@ -716,6 +1221,14 @@ class rx_ctl(object):
                 for worker in self.logfile_workers:
                     worker['demod'].connect_chain('fsk4')
 
+            if self.site_set:
+                self.sites = list(self.nacs)
+                for nac in self.sites:
+                    self.set_site(nac)
+            else:
+                self.cc_watchdog(time.time())
+            self.arm_state_timer()
+
             self.set_frequency({
                 'freq': tsys.trunk_cc,
                 'tgid': None,
@@ -733,6 +1246,20 @@ class rx_ctl(object):
         if frequency and self.frequency_set:
             self.frequency_set(params)
 
+    def set_site(self, nac):
+        tsys = self.trunked_systems[nac]
+        site = self.sites.index(nac)
+        self.site_since[site] = time.time()
+        self.timers.schedule(('cc', site), self.site_since[site] + tsys.CC_HUNT_TIME, self.site_watchdog, site)
+        self.site_set({
+            'site': site,
+            'freq': tsys.trunk_cc,
+            'offset': tsys.offset,
+            'nac': nac,
+            'system': tsys.sysname,
+            'center_frequency': tsys.center_frequency,
+            'modulation': tsys.modulation})
+
     def do_metadata(self, state, tgid, tag):
         if (state == 1) and (self.meta_state == 1):  # don't update more than once for an idle channel (state=1)
             return
@@ -755,6 +1282,7 @@ class rx_ctl(object):
         if nac == 0:
             nac0 = True
         self.trunked_systems[nac] = trunked_system(debug=self.debug, config=cfg, wildcard=nac0)
+        self.trunked_systems[nac].network_status_update = self.network_status_update
 
     def build_config_tsv(self, tsv_filename):
         # print 'Building * config * file'
@@ -774,7 +1302,7 @@ class rx_ctl(object):
                         hdrmap.append(hdr)
                     continue
                 fields = {}
-                if (len(row) < 4) or (len(row) > 9):
+                if (len(row) < 4) or (len(row) > 13):
                     sys.stderr.write("Skipping invalid row in %s: %s\n" % (tsv_filename, row))
                     continue
                 for i in xrange(len(row)):
@@ -876,6 +1404,12 @@ class rx_ctl(object):
                         self.configs[nac]['tgid_map'][tgid] = (txt, prio)
             if 'center_frequency' in configs[nac]:
                 self.configs[nac]['center_frequency'] = get_frequency(configs[nac]['center_frequency'])
+            for k in ['talkgroup_ttl', 'frequency_ttl']:
+                if k in configs[nac]:
+                    self.configs[nac][k] = float(configs[nac][k])
+            for k in ['max_talkgroups', 'max_frequencies']:
+                if k in configs[nac]:
+                    self.configs[nac][k] = int(configs[nac][k])
 
             self.add_trunked_system(nac)
 
@@ -885,14 +1419,24 @@ class rx_ctl(object):
             self.current_id = 0
         return self.nacs[self.current_id]
 
-    def to_json(self):
-        d = {'json_type': 'trunk_update'}
-        for nac in self.trunked_systems.keys():
-            d[nac] = json.loads(self.trunked_systems[nac].to_json())
-        d['srcaddr'] = self.current_srcaddr
-        d['grpaddr'] = self.current_grpaddr
-        d['encrypted'] = self.current_encrypted
-        d['nac'] = self.current_nac
+    def to_json(self, since=0):
+        # full trunk_update, or with since (the seq of a previous update) only
+        # what changed after it; nacs without changes are left out.  Called
+        # from the terminal's thread: the state is read under the lock the
+        # decoder holds, only the encoding happens outside it
+        with self.lock:
+            seq = next_json_seq()
+            d = {'json_type': 'trunk_update', 'seq': seq}
+            if since:
+                d['since'] = since
+            for nac in self.trunked_systems.keys():
+                tsys = self.trunked_systems[nac].to_dict(seq, since)
+                if tsys or not since:
+                    d[nac] = tsys
+            d['srcaddr'] = self.current_srcaddr
+            d['grpaddr'] = self.current_grpaddr
+            d['encrypted'] = self.current_encrypted
+            d['nac'] = self.current_nac
         return json.dumps(d)
 
     def dump_tgids(self):
@@ -904,9 +1448,22 @@ class rx_ctl(object):
         for nac in self.trunked_systems:
             s += '\n====== NAC 0x%x ====== %s ======\n' % (nac, self.trunked_systems[nac].sysname)
             s += self.trunked_systems[nac].to_string()
+        if self.logfile_workers:
+            s += '\nworkers: %d busy, %d free, %d preemptions, %d dropped\n' % (
+                len(self.working_frequencies), len(self.free_workers),
+                self.worker_stats['preemptions'], self.worker_stats['drops'])
         return s
 
     def process_qmsg(self, msg):
+        with self.lock:
+            self.decode_qmsg(msg, False)
+
+    def process_site_qmsg(self, msg):
+        # multi-site mode: message from one of the control channel decoders
+        with self.lock:
+            self.decode_qmsg(msg, True)
+
+    def decode_qmsg(self, msg, site):
         type = msg.type()
         updated = 0
         curr_time = time.time()
@@ -920,6 +1477,11 @@ class rx_ctl(object):
                 self.current_grpaddr = js['grpaddr']
             if 'encrypted' in js:
                 self.current_encrypted = js['encrypted']
+            call = self.calls.get((self.current_nac, self.current_tgid))
+            if call is not None:
+                if self.current_srcaddr:
+                    call['srcaddr'] = self.current_srcaddr
+                call['encrypted'] = max(call['encrypted'], self.current_encrypted)
             return
         elif type == -2:  # request from gui
             cmd = msg.to_string()
@@ -927,6 +1489,8 @@ class rx_ctl(object):
                 sys.stderr.write('process_qmsg: command: %s\n' % cmd)
             self.update_state(cmd, curr_time, int(msg.arg1()))
             return
+        elif type == -1 and site:  # site_watchdog does the hunting
+            return
         elif type == -1:  # timeout
             if self.debug > 10:
                 sys.stderr.write('%f process_data_unit timeout\n' % time.time())
@@ -945,12 +1509,16 @@ class rx_ctl(object):
             # nac is always 1st two bytes
             nac = (ord(s[0]) << 8) + ord(s[1])
 
+            if site and type != 7 and type != 12:
+                return
             if nac == 0xffff:
                 if (type != 7) and (type != 12):  # TDMA duid (end of call etc)
                     self.update_state('tdma_duid%d' % type, curr_time)
                     return
                 else:  # voice channel derived TSBK or MBT PDU
                     nac = self.current_nac
+            elif self.site_set and not site and (type == 7 or type == 12):
+                return  # main channel parked on a control channel its site decoder already follows
             s = s[2:]
             if self.debug > 10:
                 sys.stderr.write('nac %x type %d at %f state %d len %d\n' % (nac, type, time.time(), self.current_state, len(s)))
@@ -965,6 +1533,7 @@ class rx_ctl(object):
                         self.trunked_systems[nac] = self.trunked_systems.pop(0)
                         self.configs[nac] = self.configs.pop(0)
                         self.nacs = self.configs.keys()
+                        self.sites = [nac if n == 0 else n for n in self.sites]
                         self.current_nac = nac
                     else:
                         sys.stderr.write("%f NAC %x not configured\n" % (time.time(), nac))
@@ -978,8 +1547,12 @@ class rx_ctl(object):
                 s1 = s[:10]  # header without crc
                 s2 = s[12:]
                 header = mbt_data = 0
-                for c in s1:
+                for c in s[:12]:
                     header = (header << 8) + ord(c)
+                if crc16(header, 12) != 0:
+                    self.trunked_systems[nac].stats['crc'] += 1
+                    return
+                header >>= 16
                 for c in s2:
                     mbt_data = (mbt_data << 8) + ord(c)
 
@@ -995,6 +1568,17 @@ class rx_ctl(object):
                     type, time.time(), self.current_state, len(s1), len(s2), opcode, header, mbt_data))
                 updated += self.trunked_systems[nac].decode_mbt_data(opcode, src, header << 16, mbt_data << 32)
 
+            if updated and self.call_event:
+                self.track_calls(nac, curr_time)
+
+            if site:  # grants from every system are merged into one voice selection
+                if self.logfile_workers:
+                    if nac == self.current_nac:
+                        self.logging_scheduler(curr_time)
+                elif updated:
+                    self.update_state('update', curr_time)
+                return
+
             if nac != self.current_nac:
                 if self.debug > 10:  # this is occasionally expected if cycling between different tsys
                     sys.stderr.write("%f received NAC %x does not match expected NAC %x\n" % (time.time(), nac, self.current_nac))
@@ -1009,18 +1593,188 @@ class rx_ctl(object):
             else:
                 self.update_state('duid%d' % type, curr_time)
 
+    def cc_watchdog(self, curr_time):
+        # hunt for another control channel once the main channel has been on
+        # a silent one for CC_HUNT_TIME
+        tsys = self.trunked_systems[self.current_nac]
+        due = max(tsys.last_tsbk, self.cc_since) + tsys.CC_HUNT_TIME
+        if due <= curr_time:
+            self.update_state('cc_timeout', curr_time)
+            due = curr_time + tsys.CC_HUNT_TIME
+        self.timers.schedule('cc', due, self.cc_watchdog)
+
+    def site_watchdog(self, curr_time, site):
+        # same for the control channel decoder of each system in multi-site mode
+        tsys = self.trunked_systems[self.sites[site]]
+        due = max(tsys.last_tsbk, self.site_since[site]) + tsys.CC_HUNT_TIME
+        if due > curr_time:
+            self.timers.schedule(('cc', site), due, self.site_watchdog, site)
+        else:
+            tsys.hunt_cc(curr_time)
+            self.set_site(self.sites[site])
+
+    def state_timer(self, curr_time):
+        self.update_state('timer', curr_time)
+
+    def arm_state_timer(self, after=0):
+        # voice release is due when the talkgroup hold runs out; in the
+        # control channel state also wait for the TSYS hold before rotating.
+        # Nothing is armed unless due later than after.
+        if self.hold_mode:
+            return
+        due = self.tgid_hold_until
+        if self.current_state == self.states.CC and not self.site_set:
+            due = max(due, self.wait_until)
+        if due > after:
+            self.timers.schedule('state', due, self.state_timer)
+
+    def skip_timer(self, curr_time, nac, tgid):
+        # a skipped talkgroup stays blacklisted until it has gone
+        # TGID_SKIP_TIME without a grant, i.e. for the rest of its call
+        tsys = self.trunked_systems.get(nac)
+        if tsys is None or tsys.blacklist.get(tgid) is None:  # since reset or locked out
+            return
+        end_time = tsys.blacklist[tgid]
+        if tgid in tsys.talkgroups:
+            end_time = max(end_time, tsys.talkgroups[tgid]['time'] + self.TGID_SKIP_TIME)
+        if end_time > curr_time:
+            tsys.blacklist[tgid] = end_time
+            self.timers.schedule(('skip', nac, tgid), end_time, self.skip_timer, nac, tgid)
+        else:
+            tsys.remove_blacklist(tgid)
+
+    def worker_timer(self, curr_time, frequency, tgid):
+        # release a logfile worker talkgroup TGID_HOLD_TIME after its last update
+        if frequency not in self.working_frequencies or tgid not in self.working_frequencies[frequency]['tgids']:
+            return
+        due = self.working_frequencies[frequency]['tgids'][tgid]['updated'] + self.TGID_HOLD_TIME
+        if due > curr_time:
+            self.timers.schedule(('worker', frequency, tgid), due, self.worker_timer, frequency, tgid)
+            return
+        self.free_talkgroup(frequency, tgid, curr_time)
+        if not self.working_frequencies[frequency]['tgids']:
+            self.free_frequency(frequency, curr_time)
+
+    def network_status_update(self, tsys, syid, wacn):
+        # have the phase 2 scrambling sequence ready before the first TDMA grant
+        for nac in self.trunked_systems:
+            if self.trunked_systems[nac] is tsys and nac:
+                self.xor_cache.get(nac, syid, wacn)
+
+    def track_calls(self, nac, curr_time):
+        # start a call record for every newly granted talkgroup; a call ends when
+        # its grant moves to another channel or has not been repeated for
+        # CALL_TIMEOUT seconds
+        tsys = self.trunked_systems[nac]
+        for tgid in tsys.granted_talkgroups:
+            if tgid not in tsys.talkgroups:
+                continue
+            tg = tsys.talkgroups[tgid]
+            call = self.calls.get((nac, tgid))
+            if call is not None and (call['frequency'], call['slot']) == (tg['frequency'], tg['tdma_slot']):
+                call['last'] = tg['time']
+                if tg['srcaddr']:
+                    call['srcaddr'] = tg['srcaddr']
+                continue
+            if call is not None:
+                self.end_call(nac, tgid, call['last'])
+            self.calls[(nac, tgid)] = {'start': tg['time'], 'last': tg['time'], 'srcaddr': tg['srcaddr'],
+                                       'frequency': tg['frequency'], 'slot': tg['tdma_slot'], 'encrypted': 0}
+            self.call_event({'event': 'start', 'time': tg['time'], 'nac': nac, 'tgid': tgid,
+                             'srcaddr': tg['srcaddr'], 'frequency': tg['frequency'], 'slot': tg['tdma_slot']})
+            self.timers.schedule(('call', nac, tgid), tg['time'] + self.CALL_TIMEOUT, self.call_timer, nac, tgid)
+        tsys.granted_talkgroups.clear()
+
+    def call_timer(self, curr_time, nac, tgid):
+        call = self.calls.get((nac, tgid))
+        if call is None:
+            return
+        due = call['last'] + self.CALL_TIMEOUT
+        if due > curr_time:
+            self.timers.schedule(('call', nac, tgid), due, self.call_timer, nac, tgid)
+            return
+        self.end_call(nac, tgid, call['last'])
+
+    def end_call(self, nac, tgid, end_time):
+        call = self.calls.pop((nac, tgid))
+        self.timers.cancel(('call', nac, tgid))
+        self.call_event({'event': 'end', 'time': end_time, 'nac': nac, 'tgid': tgid, 'srcaddr': call['srcaddr'],
+                         'frequency': call['frequency'], 'slot': call['slot'],
+                         'duration': end_time - call['start'], 'encrypted': call['encrypted']})
+
+    def find_site_talkgroup(self, start_time, tgid=None, hold=False):
+        # find_talkgroup over the grants of every system in multi-site mode.
+        # Returns the nac along with the find_talkgroup result.  As within a
+        # system, tgid is only displaced by a better priority elsewhere;
+        # otherwise the best priority, most recent grant wins.
+        best_nac = self.current_nac
+        best = self.trunked_systems[best_nac].find_talkgroup(start_time, tgid=tgid, hold=hold)
+        if hold:
+            return best_nac, best
+        for nac in self.sites:
+            if nac == self.current_nac:
+                continue
+            tsys = self.trunked_systems[nac]
+            found = tsys.find_talkgroup(start_time)
+            if found[0] is None:
+                continue
+            if best[0] is not None:
+                best_tsys = self.trunked_systems[best_nac]
+                if tgid is not None and tsys.get_prio(found[1]) >= best_tsys.get_prio(best[1]):
+                    continue
+                if (tsys.get_prio(found[1]), -tsys.talkgroups[found[1]]['time']) >= (
+                        best_tsys.get_prio(best[1]), -best_tsys.talkgroups[best[1]]['time']):
+                    continue
+            best_nac, best = nac, found
+        return best_nac, best
+
     def find_available_worker(self):
-        for worker in self.logfile_workers:
-            if not worker['active']:
-                worker['active'] = True
-                return worker
+        if not self.free_workers:
+            return None
+        worker = self.free_workers.pop()
+        worker['active'] = True
+        return worker
+
+    def index_worker(self, frequency):
+        # (re)file a working frequency under the best priority of its talkgroups,
+        # as the most recently updated one
+        wf = self.working_frequencies[frequency]
+        if wf['prio'] is not None:
+            self.worker_prios[wf['prio']].pop(frequency, None)
+        wf['prio'] = None
+        if not wf['tgids']:
+            return
+        wf['prio'] = min([wf['tgids'][tgid]['prio'] for tgid in wf['tgids']])
+        self.worker_prios.setdefault(wf['prio'], collections.OrderedDict())[frequency] = True
+
+    def preempt_worker(self, prio, curr_time):
+        # free the worker of the least recently updated frequency whose
+        # talkgroups all have a worse priority (higher number) than prio
+        for worker_prio in sorted(self.worker_prios, reverse=True):
+            if worker_prio <= prio:
+                break
+            if not self.worker_prios[worker_prio]:
+                continue
+            frequency = next(iter(self.worker_prios[worker_prio]))
+            tgids = self.working_frequencies[frequency]['tgids'].keys()
+            for tgid in tgids:
+                self.free_talkgroup(frequency, tgid, curr_time)
+            self.free_frequency(frequency, curr_time)
+            self.worker_stats['preemptions'] += 1
+            sys.stderr.write('%f preempted worker frequency %d tgids %s prio %d for prio %d (%d preemptions)\n' % (
+                curr_time, frequency, ','.join(['%d' % tgid for tgid in tgids]), worker_prio, prio,
+                self.worker_stats['preemptions']))
+            return self.find_available_worker()
         return None
 
     def free_frequency(self, frequency, curr_time):
         assert not self.working_frequencies[frequency]['tgids']
-        self.working_frequencies[frequency]['worker']['demod'].set_relative_frequency(0)
-        self.working_frequencies[frequency]['worker']['active'] = False
+        worker = self.working_frequencies[frequency]['worker']
+        worker['demod'].set_relative_frequency(0)
+        worker['active'] = False
+        self.index_worker(frequency)
         self.working_frequencies.pop(frequency)
+        self.free_workers.append(worker)
         sys.stderr.write('%f release worker frequency %d\n' % (curr_time, frequency))
 
     def free_talkgroup(self, frequency, tgid, curr_time):
@@ -1030,6 +1784,13 @@ class rx_ctl(object):
         if tdma_slot is None:
             index = 0
         self.working_frequencies[frequency]['tgids'].pop(tgid)
+        decoder.close_file(index=index)
+        if self.working_frequencies[frequency]['slots'].get(tdma_slot) == tgid:
+            self.working_frequencies[frequency]['slots'].pop(tdma_slot)
+        if self.working_tgids.get(tgid) == frequency:
+            self.working_tgids.pop(tgid)
+        self.timers.cancel(('worker', frequency, tgid))
+        self.index_worker(frequency)
         sys.stderr.write('%f release tgid %d frequency %d\n' % (curr_time, tgid, frequency))
 
     def logging_scheduler(self, curr_time):
@@ -1037,16 +1798,14 @@ class rx_ctl(object):
         for tgid in tsys.get_updated_talkgroups(curr_time):
             frequency = tsys.talkgroups[tgid]['frequency']
             tdma_slot = tsys.talkgroups[tgid]['tdma_slot']
-            # see if this tgid active on any other freq(s)
-            other_freqs = [f for f in self.working_frequencies if
-                           f != frequency and tgid in self.working_frequencies[f]['tgids']]
-            if other_freqs:
-                sys.stderr.write('%f tgid %d slot %s frequency %d found on other frequencies %s\n' % (
-                curr_time, tgid, tdma_slot, frequency, ','.join(['%s' % f for f in other_freqs])))
-                for f in other_freqs:
-                    self.free_talkgroup(f, tgid, curr_time)
-                    if not self.working_frequencies[f]['tgids']:
-                        self.free_frequency(f, curr_time)
+            # see if this tgid active on another freq
+            other_freq = self.working_tgids.get(tgid)
+            if other_freq is not None and other_freq != frequency:
+                sys.stderr.write('%f tgid %d slot %s frequency %d found on other frequency %d\n' % (
+                curr_time, tgid, tdma_slot, frequency, other_freq))
+                self.free_talkgroup(other_freq, tgid, curr_time)
+                if not self.working_frequencies[other_freq]['tgids']:
+                    self.free_frequency(other_freq, curr_time)
             diff = abs(tsys.center_frequency - frequency)
             if diff > self.input_rate / 2:
                 # sys.stderr.write('%f request for frequency %d tgid %d failed, offset %d exceeds maximum %d\n' % (curr_time, frequency, tgid, diff, self.input_rate/2))
@@ -1055,31 +1814,44 @@ class rx_ctl(object):
             update = True
             if frequency in self.working_frequencies:
                 tgids = self.working_frequencies[frequency]['tgids']
+                slots = self.working_frequencies[frequency]['slots']
                 if tgid in tgids:
                     if tgids[tgid]['tdma_slot'] == tdma_slot:
                         update = False
                     else:
                         sys.stderr.write('%f slot switch %s was %s tgid %d frequency %d\n' % (
                         curr_time, tdma_slot, tgids[tgid]['tdma_slot'], tgid, frequency))
+                        if slots.get(tgids[tgid]['tdma_slot']) == tgid:
+                            slots.pop(tgids[tgid]['tdma_slot'])
                         worker = self.working_frequencies[frequency]['worker']
                 else:
-                    # active_tdma_slots = [tgids[tg]['tdma_slot'] for tg in tgids]
                     sys.stderr.write("%f new tgid %d slot %s arriving on already active frequency %d\n" % (
                     curr_time, tgid, tdma_slot, frequency))
-                    previous_tgid = [id for id in tgids if tgids[id]['tdma_slot'] == tdma_slot]
-                    assert len(previous_tgid) == 1  ## check for logic error
-                    self.free_talkgroup(frequency, previous_tgid[0], curr_time)
                     worker = self.working_frequencies[frequency]['worker']
+                if update and slots.get(tdma_slot, tgid) != tgid:
+                    self.free_talkgroup(frequency, slots[tdma_slot], curr_time)
             else:
+                prio = tsys.get_prio(tgid)
                 worker = self.find_available_worker()
                 if worker is None:
-                    sys.stderr.write('*** error, no free demodulators, freq %d tgid %d\n' % (frequency, tgid))
+                    worker = self.preempt_worker(prio, curr_time)
+                if worker is None:
+                    self.worker_stats['drops'] += 1
+                    sys.stderr.write('*** error, no free demodulators, freq %d tgid %d prio %d (%d dropped)\n' % (
+                        frequency, tgid, prio, self.worker_stats['drops']))
                     continue
-                self.working_frequencies[frequency] = {'tgids': {}, 'worker': worker}
+                self.working_frequencies[frequency] = {'tgids': {}, 'slots': {}, 'worker': worker, 'prio': None}
                 worker['demod'].set_relative_frequency(tsys.center_frequency - frequency)
                 sys.stderr.write(
                     '%f starting worker frequency %d tg %d slot %s\n' % (curr_time, frequency, tgid, tdma_slot))
-            self.working_frequencies[frequency]['tgids'][tgid] = {'updated': curr_time, 'tdma_slot': tdma_slot}
+            if tgid not in self.working_frequencies[frequency]['tgids']:
+                self.timers.schedule(('worker', frequency, tgid), curr_time + self.TGID_HOLD_TIME,
+                                     self.worker_timer, frequency, tgid)
+            self.working_frequencies[frequency]['tgids'][tgid] = {'updated': curr_time, 'tdma_slot': tdma_slot,
+                                                                  'prio': tsys.get_prio(tgid)}
+            self.working_frequencies[frequency]['slots'][tdma_slot] = tgid
+            self.working_tgids[tgid] = frequency
+            self.index_worker(frequency)
             if not update:
                 continue
             filename = 'tgid-%d-%f.wav' % (tgid, curr_time)
@@ -1096,30 +1868,11 @@ class rx_ctl(object):
                 index = tdma_slot
                 symbol_rate = 6000
                 xorhash = '%x%x%x' % (self.current_nac, tsys.ns_syid, tsys.ns_wacn)
-                if xorhash not in self.xor_cache:
-                    self.xor_cache[xorhash] = lfsr.p25p2_lfsr(self.current_nac, tsys.ns_syid, tsys.ns_wacn).xor_chars
-                decoder.set_xormask(self.xor_cache[xorhash], xorhash, index=index)
+                decoder.set_xormask(self.xor_cache.get(self.current_nac, tsys.ns_syid, tsys.ns_wacn), xorhash, index=index)
             demod.set_omega(symbol_rate)
-            decoder.set_output(filename, index=index)
-
-        # garbage collection
-        if self.last_garbage_collect + 1 > curr_time:
-            return
-        self.last_garbage_collect = curr_time
-
-        gc_frequencies = []
-        gc_tgids = []
-        for frequency in self.working_frequencies:
-            tgids = self.working_frequencies[frequency]['tgids']
-            inactive_tgids = [[frequency, tgid] for tgid in tgids if
-                              tgids[tgid]['updated'] + self.TGID_HOLD_TIME < curr_time]
-            if len(inactive_tgids) == len(tgids):
-                gc_frequencies += [frequency]
-            gc_tgids += inactive_tgids
-        for frequency, tgid in gc_tgids:  # expire talkgroups
-            self.free_talkgroup(frequency, tgid, curr_time)
-        for frequency in gc_frequencies:  # expire working frequencies
-            self.free_frequency(frequency, curr_time)
+            decoder.set_output(filename, index=index, info={
+                'tgid': tgid, 'srcaddr': tsys.talkgroups[tgid]['srcaddr'], 'nac': self.current_nac,
+                'system': tsys.sysname, 'frequency': frequency, 'slot': tdma_slot, 'start': curr_time})
 
     def update_state(self, command, curr_time, cmd_data=0):
         if not self.configs:
@@ -1138,7 +1891,6 @@ class rx_ctl(object):
             if self.current_state == self.states.CC:
                 if self.debug > 0:
                     sys.stderr.write("%f control channel timeout\n" % time.time())
-                tsys.cc_timeouts += 1
             elif self.current_state != self.states.CC:
                 if self.debug > 1:
                     sys.stderr.write("%f voice timeout\n" % time.time())
@@ -1158,8 +1910,14 @@ class rx_ctl(object):
                     desired_tgid = self.tgid_hold
                 elif (self.tgid_hold is not None) and (self.hold_mode == False):
                     self.tgid_hold = None
-                new_frequency, new_tgid, tdma_slot, srcaddr = tsys.find_talkgroup(curr_time, tgid=desired_tgid,
-                                                                                  hold=self.hold_mode)
+                if self.site_set:
+                    nac, (new_frequency, new_tgid, tdma_slot, srcaddr) = self.find_site_talkgroup(
+                        curr_time, tgid=desired_tgid, hold=self.hold_mode)
+                    self.current_nac = nac
+                    tsys = self.trunked_systems[nac]
+                else:
+                    new_frequency, new_tgid, tdma_slot, srcaddr = tsys.find_talkgroup(curr_time, tgid=desired_tgid,
+                                                                                      hold=self.hold_mode)
                 if new_frequency:
                     if self.debug > 0:
                         tslot = tdma_slot if tdma_slot is not None else '-'
@@ -1174,9 +1932,20 @@ class rx_ctl(object):
                     new_slot = tdma_slot
                     self.do_metadata(0, new_tgid, tsys.get_tag(new_tgid))
             else:  # check for priority tgid preemption
-                new_frequency, new_tgid, tdma_slot, srcaddr = tsys.find_talkgroup(
-                    tsys.talkgroups[self.current_tgid]['time'], tgid=self.current_tgid, hold=self.hold_mode)
-                if new_tgid != self.current_tgid:
+                if self.current_tgid in tsys.talkgroups:
+                    start_time = tsys.talkgroups[self.current_tgid]['time']
+                else:  # expired
+                    start_time = curr_time
+                if self.site_set:
+                    site_nac, (new_frequency, new_tgid, tdma_slot, srcaddr) = self.find_site_talkgroup(
+                        start_time, tgid=self.current_tgid, hold=self.hold_mode)
+                else:
+                    site_nac = nac
+                    new_frequency, new_tgid, tdma_slot, srcaddr = tsys.find_talkgroup(
+                        start_time, tgid=self.current_tgid, hold=self.hold_mode)
+                if new_tgid != self.current_tgid or site_nac != nac:
+                    nac = self.current_nac = site_nac
+                    tsys = self.trunked_systems[nac]
                     if self.debug > 0:
                         tslot = tdma_slot if tdma_slot is not None else '-'
                         sys.stderr.write("%f voice preempt: tg(%s), freq(%s), slot(%s), prio(%d)\n" % (
@@ -1218,6 +1987,24 @@ class rx_ctl(object):
             self.wait_until = curr_time + self.TSYS_HOLD_TIME
         elif command == 'duid7' or command == 'duid12':  # tsbk/pdu should never arrive here...
             pass
+        elif command == 'timer':  # hold / TSYS timers below are due
+            pass
+        elif command == 'cc_timeout':  # see cc_watchdog
+            self.cc_since = curr_time
+            if self.current_state == self.states.CC and tsys.hunt_cc(curr_time):
+                new_frequency = tsys.trunk_cc
+                if tsys.wildcard_tsys and self.current_nac != 0:
+                    if self.debug >= 5:
+                        sys.stderr.write("%f reset tsys to NAC 0 after control channel change\n" % time.time())
+                    self.trunked_systems[0] = self.trunked_systems.pop(self.current_nac)
+                    self.configs[0] = self.configs.pop(self.current_nac)
+                    self.nacs = self.configs.keys()
+                    nac = self.current_nac = 0
+                    self.current_tgid = None
+                    self.current_srcaddr = 0
+                    self.current_grpaddr = 0
+                    self.current_encrypted = 0
+                    tsys.reset()
         elif command == 'hold':
             if cmd_data > 0:
                 self.tgid_hold = cmd_data
@@ -1256,6 +2043,9 @@ class rx_ctl(object):
                     end_time = curr_time + self.TGID_SKIP_TIME
 
                 tsys.add_blacklist(self.current_tgid, end_time=end_time)
+                if end_time is not None:
+                    self.timers.schedule(('skip', nac, self.current_tgid), end_time, self.skip_timer, nac,
+                                         self.current_tgid)
                 self.current_tgid = None
                 self.tgid_hold = None
                 self.tgid_hold_until = curr_time
@@ -1267,22 +2057,9 @@ class rx_ctl(object):
             sys.stderr.write('update_state: unknown command: %s\n' % command)
             assert 0 == 1
 
-        hunted_cc = tsys.hunt_cc(curr_time)
-        if tsys.wildcard_tsys and hunted_cc and self.current_nac != 0:
-            if self.debug >= 5:
-                sys.stderr.write("%f reset tsys to NAC 0 after control channel change\n" % time.time())
-            self.trunked_systems[0] = self.trunked_systems.pop(self.current_nac)
-            self.configs[0] = self.configs.pop(self.current_nac)
-            self.nacs = self.configs.keys()
-            self.current_nac = 0
-            self.current_state = self.states.CC
-            self.current_tgid = None
-            self.current_srcaddr = 0
-            self.current_grpaddr = 0
-            self.current_encrypted = 0
-            tsys.reset()
-
-        if self.current_state != self.states.CC and self.tgid_hold_until <= curr_time and self.hold_mode is False and new_state is None:
+        if command != 'timer':
+            pass  # release and rotation only happen when their timer is due
+        elif self.current_state != self.states.CC and self.tgid_hold_until <= curr_time and self.hold_mode is False:
             if self.debug > 1:
                 sys.stderr.write("%f release tg(%s)\n" % (time.time(), self.current_tgid))
             self.tgid_hold = None
@@ -1292,7 +2069,8 @@ class rx_ctl(object):
             self.current_encrypted = 0
             new_state = self.states.CC
             new_frequency = tsys.trunk_cc
-        elif self.wait_until <= curr_time and self.tgid_hold_until <= curr_time and self.hold_mode is False and new_state is None:
+        elif self.wait_until <= curr_time and self.tgid_hold_until <= curr_time and self.hold_mode is False and \
+                not self.site_set:  # no time-slicing needed with a decoder per system
             self.wait_until = curr_time + self.TSYS_HOLD_TIME
             self.current_srcaddr = 0
             self.current_grpaddr = 0
@@ -1300,10 +2078,12 @@ class rx_ctl(object):
             new_nac = self.find_next_tsys()
             new_state = self.states.CC
 
-        if self.current_state == self.states.CC and self.tgid_hold_until <= curr_time:
+        if command == 'timer' and self.current_state == self.states.CC and self.tgid_hold_until <= curr_time:
             self.do_metadata(1, None, None)
 
         if new_nac is not None:
+            if new_nac != nac:
+                self.cc_since = curr_time
             nac = self.current_nac = new_nac
             tsys = self.trunked_systems[nac]
             new_frequency = tsys.trunk_cc
@@ -1326,25 +2106,25 @@ class rx_ctl(object):
                 'sysid': tsys.ns_syid})
 
         if new_state is not None:
+            if new_state == self.states.CC and self.current_state != self.states.CC:
+                self.cc_since = curr_time
             self.current_state = new_state
+        self.arm_state_timer(curr_time if command == 'timer' else 0)
 
     def add_blacklist(self, current_tgid):
         # print 'tsys %s ', self.trunked_systems[self.current_nac].to_string()
 
-        tsys = self.trunked_systems[self.current_nac]
-        tsys.add_blacklist(current_tgid)
-
-        start_time = time.time()
-        tsys.blacklist_update(start_time)
+        # called from the gui thread; the talkgroup index is the decoder's
+        with self.lock:
+            tsys = self.trunked_systems[self.current_nac]
+            tsys.add_blacklist(current_tgid)
 
     def remove_blacklist(self, current_tgid):
         # print 'tsys %s ', self.trunked_systems[self.current_nac].to_string()
 
-        tsys = self.trunked_systems[self.current_nac]
-        tsys.remove_blacklist(current_tgid)
-
-        start_time = time.time()
-        tsys.blacklist_update(start_time)
+        with self.lock:
+            tsys = self.trunked_systems[self.current_nac]
+            tsys.remove_blacklist(current_tgid)
 
     def get_tgid_map(self, nac):
         print('rx_ctl: Get TGID Map for %s ' % nac)
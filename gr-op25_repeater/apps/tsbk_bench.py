@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+# 
+# This file is part of OP25
+# 
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Microbenchmark for trunked_system.decode_tsbk
+
+Replays a list of TSBKs through the table-driven decoder and through the
+original if/elif decoder (kept below for reference), checks that both
+leave the trunked_system in the same state and reports TSBKs/sec.  The
+same TSBKs are then decoded in one call to decode_tsbk_batch and checked
+against the scalar result.
+
+The input file holds one TSBK per line in hex, either the 10 byte TSBK
+without crc or the 12 byte form printed by "TSBK: 0x.. 0x..." debug lines
+(the last hex word of each line is used).  Without an input file a
+synthetic control channel mix is generated.
+"""
+
+import sys
+import time
+import random
+import collections
+import numpy as np
+from optparse import OptionParser
+
+import trunking
+
+
+# original if/elif decoder, for comparison
+def legacy_decode_tsbk(self, tsbk):
+    self.last_tsbk = time.time()
+    self.stats['tsbks'] += 1
+    updated = 0
+    tsbk = tsbk << 16  # for missing crc
+    opcode = (tsbk >> 88) & 0x3f
+    if self.debug > 10:
+        sys.stderr.write('TSBK: 0x%02x 0x%024x\n' % (opcode, tsbk))
+    if opcode == 0x00:  # group voice chan grant
+        mfrid = (tsbk >> 80) & 0xff
+        if mfrid == 0x90:  # MOT_GRG_ADD_CMD
+            sg = (tsbk >> 64) & 0xffff
+            ga1 = (tsbk >> 48) & 0xffff
+            ga2 = (tsbk >> 32) & 0xffff
+            ga3 = (tsbk >> 16) & 0xffff
+            if self.debug > 10:
+                sys.stderr.write('MOT_GRG_ADD_CMD(0x00): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
+        else:
+            opts = (tsbk >> 72) & 0xff
+            ch = (tsbk >> 56) & 0xffff
+            ga = (tsbk >> 40) & 0xffff
+            sa = (tsbk >> 16) & 0xffffff
+            f = self.channel_id_to_frequency(ch)
+            self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
+            if f:
+                updated += 1
+            if self.debug > 10:
+                sys.stderr.write('tsbk00 grant freq %s ga %d sa %d\n' % (self.channel_id_to_string(ch), ga, sa))
+    elif opcode == 0x01:  # reserved
+        mfrid = (tsbk >> 80) & 0xff
+        if mfrid == 0x90:  # MOT_GRG_DEL_CMD
+            sg = (tsbk >> 64) & 0xffff
+            ga1 = (tsbk >> 48) & 0xffff
+            ga2 = (tsbk >> 32) & 0xffff
+            ga3 = (tsbk >> 16) & 0xffff
+            if self.debug > 10:
+                sys.stderr.write('MOT_GRG_DEL_CMD(0x01): sg:%d ga1:%d ga2:%d ga3:%d\n' % (sg, ga1, ga2, ga3))
+    elif opcode == 0x02:  # group voice chan grant update
+        mfrid = (tsbk >> 80) & 0xff
+        if mfrid == 0x90:
+            ch = (tsbk >> 56) & 0xffff
+            sg = (tsbk >> 40) & 0xffff
+            sa = (tsbk >> 16) & 0xffffff
+            f = self.channel_id_to_frequency(ch)
+            self.update_voice_frequency(f, tgid=sg, tdma_slot=self.get_tdma_slot(ch), srcaddr=sa)
+            if f:
+                updated += 1
+            if self.debug > 10:
+                sys.stderr.write(
+                    'MOT_GRG_CN_GRANT(0x02): freq %s sg:%d sa:%d\n' % (self.channel_id_to_string(ch), sg, sa))
+        else:
+            ch1 = (tsbk >> 64) & 0xffff
+            ga1 = (tsbk >> 48) & 0xffff
+            ch2 = (tsbk >> 32) & 0xffff
+            ga2 = (tsbk >> 16) & 0xffff
+            f1 = self.channel_id_to_frequency(ch1)
+            f2 = self.channel_id_to_frequency(ch2)
+            self.update_voice_frequency(f1, tgid=ga1, tdma_slot=self.get_tdma_slot(ch1))
+            if f1 != f2:
+                self.update_voice_frequency(f2, tgid=ga2, tdma_slot=self.get_tdma_slot(ch2))
+            if f1:
+                updated += 1
+            if f2:
+                updated += 1
+            if self.debug > 10:
+                sys.stderr.write('tsbk02 grant update: chan %s %d %s %d\n' % (
+                self.channel_id_to_string(ch1), ga1, self.channel_id_to_string(ch2), ga2))
+    elif opcode == 0x03:  # group voice chan grant update exp : TIA.102-AABC-B-2005 page 56
+        mfrid = (tsbk >> 80) & 0xff
+        if mfrid == 0x90:  # MOT_GRG_CN_GRANT_UPDT
+            ch1 = (tsbk >> 64) & 0xffff
+            sg1 = (tsbk >> 48) & 0xffff
+            ch2 = (tsbk >> 32) & 0xffff
+            sg2 = (tsbk >> 16) & 0xffff
+            f1 = self.channel_id_to_frequency(ch1)
+            f2 = self.channel_id_to_frequency(ch2)
+            self.update_voice_frequency(f1, tgid=sg1, tdma_slot=self.get_tdma_slot(ch1))
+            if f1 != f2:
+                self.update_voice_frequency(f2, tgid=sg2, tdma_slot=self.get_tdma_slot(ch2))
+            if f1:
+                updated += 1
+            if f2:
+                updated += 1
+            if self.debug > 10:
+                sys.stderr.write('MOT_GRG_CN_GRANT_UPDT(0x03): freq %s sg1:%d freq %s sg2:%d\n' % (
+                self.channel_id_to_string(ch1), sg1, self.channel_id_to_string(ch2), sg2))
+        elif mfrid == 0:
+            ch1 = (tsbk >> 48) & 0xffff
+            ch2 = (tsbk >> 32) & 0xffff
+            ga = (tsbk >> 16) & 0xffff
+            f = self.channel_id_to_frequency(ch1)
+            self.update_voice_frequency(f, tgid=ga, tdma_slot=self.get_tdma_slot(ch1))
+            if f:
+                updated += 1
+            if self.debug > 10:
+                sys.stderr.write('tsbk03: freq-t %s freq-r %s ga:%d\n' % (
+                self.channel_id_to_string(ch1), self.channel_id_to_string(ch2), ga))
+
+    elif opcode == 0x16:  # sndcp data ch
+        ch1 = (tsbk >> 48) & 0xffff
+        ch2 = (tsbk >> 32) & 0xffff
+        if self.debug > 10:
+            sys.stderr.write('tsbk16 sndcp data ch: chan %x %x\n' % (ch1, ch2))
+    elif opcode == 0x28:  # grp_aff_rsp
+        mfrid = (tsbk >> 80) & 0xff
+        lg = (tsbk >> 79) & 0x01
+        gav = (tsbk >> 72) & 0x03
+        aga = (tsbk >> 56) & 0xffff
+        ga = (tsbk >> 40) & 0xffff
+        ta = (tsbk >> 16) & 0xffffff
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk28 grp_aff_resp: mfrid: 0x%x, gav: %d, aga: %d, ga: %d, ta: %d\n' % (mfrid, gav, aga, ga, ta))
+    elif opcode == 0x34:  # iden_up vhf uhf
+        iden = (tsbk >> 76) & 0xf
+        bwvu = (tsbk >> 72) & 0xf
+        toff0 = (tsbk >> 58) & 0x3fff
+        spac = (tsbk >> 48) & 0x3ff
+        freq = (tsbk >> 16) & 0xffffffff
+        toff_sign = (toff0 >> 13) & 1
+        toff = toff0 & 0x1fff
+        if toff_sign == 0:
+            toff = 0 - toff
+        txt = ["mob Tx-", "mob Tx+"]
+        self.freq_table[iden] = {}
+        self.freq_table[iden]['offset'] = toff * spac * 125
+        self.freq_table[iden]['step'] = spac * 125
+        self.freq_table[iden]['frequency'] = freq * 5
+        if self.debug > 10:
+            sys.stderr.write('tsbk34 iden vhf/uhf id %d toff %f spac %f freq %f [%s]\n' % (
+            iden, toff * spac * 0.125 * 1e-3, spac * 0.125, freq * 0.000005, txt[toff_sign]))
+    elif opcode == 0x33:  # iden_up_tdma
+        mfrid = (tsbk >> 80) & 0xff
+        if mfrid == 0:
+            iden = (tsbk >> 76) & 0xf
+            channel_type = (tsbk >> 72) & 0xf
+            toff0 = (tsbk >> 58) & 0x3fff
+            spac = (tsbk >> 48) & 0x3ff
+            toff_sign = (toff0 >> 13) & 1
+            toff = toff0 & 0x1fff
+            if toff_sign == 0:
+                toff = 0 - toff
+            f1 = (tsbk >> 16) & 0xffffffff
+            slots_per_carrier = [1, 1, 1, 2, 4, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                                 2]  # values above 5 are reserved and not valid
+            self.freq_table[iden] = {}
+            self.freq_table[iden]['offset'] = toff * spac * 125
+            self.freq_table[iden]['step'] = spac * 125
+            self.freq_table[iden]['frequency'] = f1 * 5
+            self.freq_table[iden]['tdma'] = slots_per_carrier[channel_type]
+            if self.debug > 10:
+                sys.stderr.write('tsbk33 iden up tdma id %d f %d offset %d spacing %d slots/carrier %d\n' % (
+                iden, self.freq_table[iden]['frequency'], self.freq_table[iden]['offset'],
+                self.freq_table[iden]['step'], self.freq_table[iden]['tdma']))
+
+    elif opcode == 0x3d:  # iden_up
+        iden = (tsbk >> 76) & 0xf
+        bw = (tsbk >> 67) & 0x1ff
+        toff0 = (tsbk >> 58) & 0x1ff
+        spac = (tsbk >> 48) & 0x3ff
+        freq = (tsbk >> 16) & 0xffffffff
+        toff_sign = (toff0 >> 8) & 1
+        toff = toff0 & 0xff
+        if toff_sign == 0:
+            toff = 0 - toff
+        txt = ["mob xmit < recv", "mob xmit > recv"]
+        self.freq_table[iden] = {}
+        self.freq_table[iden]['offset'] = toff * 250000
+        self.freq_table[iden]['step'] = spac * 125
+        self.freq_table[iden]['frequency'] = freq * 5
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3d iden id %d toff %f spac %f freq %f\n' % (iden, toff * 0.25, spac * 0.125, freq * 0.000005))
+    elif opcode == 0x3a:  # rfss status
+        syid = (tsbk >> 56) & 0xfff
+        rfid = (tsbk >> 48) & 0xff
+        stid = (tsbk >> 40) & 0xff
+        chan = (tsbk >> 24) & 0xffff
+        f1 = self.channel_id_to_frequency(chan)
+        if f1:
+            self.rfss_syid = syid
+            self.rfss_rfid = rfid
+            self.rfss_stid = stid
+            self.rfss_chan = f1
+            self.rfss_txchan = f1 + self.freq_table[chan >> 12]['offset']
+        if self.debug > 10:
+            sys.stderr.write('tsbk3a rfss status: syid: %x rfid %x stid %d ch1 %x(%s)\n' % (
+            syid, rfid, stid, chan, self.channel_id_to_string(chan)))
+    elif opcode == 0x39:  # secondary cc
+        rfid = (tsbk >> 72) & 0xff
+        stid = (tsbk >> 64) & 0xff
+        ch1 = (tsbk >> 48) & 0xffff
+        ch2 = (tsbk >> 24) & 0xffff
+        f1 = self.channel_id_to_frequency(ch1)
+        f2 = self.channel_id_to_frequency(ch2)
+        if f1 and f2:
+            self.secondary[f1] = 1
+            self.secondary[f2] = 1
+            sorted_freqs = collections.OrderedDict(sorted(self.secondary.items()))
+            self.secondary = sorted_freqs
+        if self.debug > 10:
+            sys.stderr.write('tsbk39 secondary cc: rfid %x stid %d ch1 %x(%s) ch2 %x(%s)\n' % (
+            rfid, stid, ch1, self.channel_id_to_string(ch1), ch2, self.channel_id_to_string(ch2)))
+    elif opcode == 0x3b:  # network status
+        wacn = (tsbk >> 52) & 0xfffff
+        syid = (tsbk >> 40) & 0xfff
+        ch1 = (tsbk >> 24) & 0xffff
+        f1 = self.channel_id_to_frequency(ch1)
+        if f1:
+            self.ns_syid = syid
+            self.ns_wacn = wacn
+            self.ns_chan = f1
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3b net stat: wacn %x syid %x ch1 %x(%s)\n' % (wacn, syid, ch1, self.channel_id_to_string(ch1)))
+    elif opcode == 0x3c:  # adjacent status
+        rfid = (tsbk >> 48) & 0xff
+        stid = (tsbk >> 40) & 0xff
+        ch1 = (tsbk >> 24) & 0xffff
+        table = (ch1 >> 12) & 0xf
+        f1 = self.channel_id_to_frequency(ch1)
+        if f1 and table in self.freq_table:
+            self.adjacent[f1] = 'rfid: %d stid:%d uplink:%f tbl:%d' % (
+            rfid, stid, (f1 + self.freq_table[table]['offset']) / 1000000.0, table)
+            self.adjacent_data[f1] = {'rfid': rfid, 'stid': stid, 'uplink': f1 + self.freq_table[table]['offset'],
+                                      'table': table}
+        if self.debug > 10:
+            sys.stderr.write(
+                'tsbk3c adjacent: rfid %x stid %d ch1 %x(%s)\n' % (rfid, stid, ch1, self.channel_id_to_string(ch1)))
+            if table in self.freq_table:
+                sys.stderr.write(
+                    'tsbk3c : %s %s\n' % (self.freq_table[table]['frequency'], self.freq_table[table]['step']))
+        # else:
+        #	sys.stderr.write('tsbk other %x\n' % opcode)
+    return updated
+
+
+
+def read_tsbks(filename):
+    tsbks = []
+    with open(filename) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            w = words[-1]
+            if w.startswith('0x'):
+                w = w[2:]
+            try:
+                t = int(w, 16)
+            except ValueError:
+                continue
+            if len(w) > 20:  # includes crc (or the zero fill of the debug output)
+                t = t >> 16
+            tsbks.append(t)
+    return tsbks
+
+
+def synthetic_tsbks(count, seed=0):
+    rng = random.Random(seed)
+    # iden_up for every table first, so grants resolve to a frequency
+    tsbks = []
+    for iden in range(16):
+        base = (851006250 + iden * 1000000) // 5
+        tsbks.append((0x3d << 72) | (iden << 60) | (0x64 << 32) | base)
+    # a realistic system has a few dozen channels and a few hundred talkgroups
+    channels = [(rng.randrange(16) << 12) | rng.randrange(64) for i in range(30)]
+    tgids = [rng.randrange(1, 65536) for i in range(400)]
+    weights = [((0x00, 0x00), 30), ((0x02, 0x00), 30), ((0x02, 0x90), 10), ((0x03, 0x90), 5), ((0x03, 0x00), 5),
+               ((0x28, 0x00), 5), ((0x3a, 0x00), 4), ((0x3b, 0x00), 4), ((0x39, 0x00), 3), ((0x3c, 0x00), 3),
+               ((0x16, 0x00), 1), ((0x2f, 0x00), 2)]
+    keys = []
+    for k, w in weights:
+        keys.extend([k] * w)
+    for i in range(count - len(tsbks)):
+        opcode, mfrid = rng.choice(keys)
+        t = (opcode << 72) | (mfrid << 64) | rng.getrandbits(64)
+        spec = trunking.TSBK_FIELDS.get((opcode, mfrid), trunking.TSBK_FIELDS.get((opcode, None)))
+        for name, shift, mask in (spec[1] if spec else []):
+            if name.startswith('ch'):
+                v = rng.choice(channels)
+            elif name in ('ga', 'ga1', 'ga2', 'sg', 'sg1', 'sg2'):
+                v = rng.choice(tgids)
+            else:
+                continue
+            t = (t & ~(mask << (shift - 16))) | (v << (shift - 16))
+        tsbks.append(t)
+    return tsbks
+
+
+def snapshot(tsys):
+    # state left behind by decode_tsbk, with timestamps removed
+    vf = {}
+    for f in tsys.voice_frequencies:
+        vf[f] = (tuple(tsys.voice_frequencies[f]['tgid']), tsys.voice_frequencies[f]['counter'])
+    tg = {}
+    for t in tsys.talkgroups:
+        d = tsys.talkgroups[t]
+        tg[t] = (d['frequency'], d['tdma_slot'], d['srcaddr'], d['prio'])
+    return (tsys.freq_table, vf, tg, dict(tsys.secondary), tsys.adjacent_data, tsys.stats['tsbks'],
+            tsys.rfss_syid, tsys.rfss_rfid, tsys.rfss_stid, tsys.rfss_chan, tsys.rfss_txchan,
+            tsys.ns_syid, tsys.ns_wacn, tsys.ns_chan)
+
+
+def run(decode, tsbks, passes):
+    best = None
+    for p in range(passes):
+        tsys = trunking.trunked_system(debug=0)
+        t0 = time.time()
+        updated = 0
+        for t in tsbks:
+            updated += decode(tsys, t)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, updated, tsys
+
+
+def to_payloads(tsbks, nac=0x293):
+    # msgq type-7 payloads: 2 byte nac followed by the 10 byte TSBK
+    a = np.zeros((len(tsbks), 12), dtype=np.uint8)
+    for i, t in enumerate(tsbks):
+        t |= nac << 80
+        for j in range(12):
+            a[i, 11 - j] = (t >> (j * 8)) & 0xff
+    return a
+
+
+def run_batch(payloads, passes):
+    best = None
+    for p in range(passes):
+        tsys = trunking.trunked_system(debug=0)
+        t0 = time.time()
+        cols = tsys.decode_tsbk_batch(payloads)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, int(cols['updated'].sum()), tsys
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-i", "--input-file", type="string", default=None, help="file of hex TSBKs, one per line")
+    parser.add_option("-n", "--count", type="int", default=100000, help="number of synthetic TSBKs")
+    parser.add_option("-p", "--passes", type="int", default=5, help="timing passes (best is reported)")
+    (options, args) = parser.parse_args()
+    if len(args) != 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if options.input_file:
+        tsbks = read_tsbks(options.input_file)
+    else:
+        tsbks = synthetic_tsbks(options.count)
+    if not tsbks:
+        sys.stderr.write('no TSBKs to replay\n')
+        sys.exit(1)
+
+    t_old, u_old, tsys_old = run(legacy_decode_tsbk, tsbks, options.passes)
+    t_new, u_new, tsys_new = run(trunking.trunked_system.decode_tsbk, tsbks, options.passes)
+    t_batch, u_batch, tsys_batch = run_batch(to_payloads(tsbks), options.passes)
+
+    if u_old != u_new or snapshot(tsys_old) != snapshot(tsys_new):
+        sys.stderr.write('*** decoder mismatch: table-driven state differs from if/elif state\n')
+        sys.exit(2)
+    if u_batch != u_new or snapshot(tsys_batch) != snapshot(tsys_new):
+        sys.stderr.write('*** decoder mismatch: batch state differs from scalar state\n')
+        sys.exit(2)
+
+    n = len(tsbks)
+    sys.stdout.write('%d tsbks, %d voice updates, %d frequencies\n' % (n, u_new, len(tsys_new.voice_frequencies)))
+    sys.stdout.write('if/elif:      %8.3f s  %10.0f tsbks/sec  %6.2f us/tsbk\n' % (t_old, n / t_old, t_old * 1e6 / n))
+    sys.stdout.write('table-driven: %8.3f s  %10.0f tsbks/sec  %6.2f us/tsbk\n' % (t_new, n / t_new, t_new * 1e6 / n))
+    sys.stdout.write('batch:        %8.3f s  %10.0f tsbks/sec  %6.2f us/tsbk\n' % (t_batch, n / t_batch, t_batch * 1e6 / n))
+    sys.stdout.write('speedup %.2fx table-driven, %.2fx batch\n' % (t_old / t_new, t_old / t_batch))
+
+
+if __name__ == '__main__':
+    main()
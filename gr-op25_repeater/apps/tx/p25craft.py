@@ -46,7 +46,10 @@
 # the Free Software Foundation, Inc., 51 Franklin Street,
 # Boston, MA 02110-1301, USA.
 
-import sys, struct
+import os, sys, struct
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import checksum
 
 quiet = False
 outfile = ""
@@ -462,14 +465,7 @@ def trellis_3_4_encode(input):
 def crc_ccitt(data):
 	assert data >= 0
 	assert data <= 0xffffffffffffffffffffL
-	g = (1 << 12) | (1 << 5) | 1
-	crc = 0;
-	for i in range(79, -1, -1):
-		crc <<= 1
-		if (((crc >> 16) ^ (data >> i)) & 1):
-			crc ^= g
-	crc = (crc & 0xffff) ^ 0xffff
-	return crc
+	return checksum.crc_ccitt(data, 80)
 
 # 32 bit CRC over variable number of data bits
 # arguments are integers
@@ -479,14 +475,7 @@ def crc_32(data, length):
 	assert length <= 4096
 	assert data >= 0
 	assert data < 2**length
-	g = 0x04c11db7
-	crc = 0;
-	for i in range(length - 1, -1, -1):
-		crc <<= 1
-		if (((crc >> 32) ^ (data >> i)) & 1):
-			crc ^= g
-	crc = (crc & 0xffffffff) ^ 0xffffffff
-	return crc
+	return checksum.crc_32(data, length)
 
 # 9 bit CRC over 7 bit serial number and 128 data bits
 # arguments are integers
@@ -496,15 +485,7 @@ def crc_9(serial, data):
 	assert serial <= 0x7f
 	assert data >= 0
 	assert data <= 0xffffffffffffffffffffffffffffffffL
-	data |= (serial << 128)
-	g = (1 << 6) | (1 << 4) | (1 << 3) | 1
-	crc = 0;
-	for i in range(134, -1, -1):
-		crc <<= 1
-		if (((crc >> 9) ^ (data >> i)) & 1):
-			crc ^= g
-	crc = (crc & 0x1ff) ^ 0x1ff
-	return crc
+	return checksum.crc_9((serial << 128) | data, 135)
 
 
 ##############################